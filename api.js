@@ -119,8 +119,13 @@ class API {
         });
     }
 
-    static async getMessageHistory(friendId) {
-        return this.request(`/messages/history?friend_id=${friendId}`);
+    static async getMessageHistory(friendId, before = null) {
+        const cursor = before ? `&before=${before}` : '';
+        return this.request(`/messages/history?friend_id=${friendId}${cursor}`);
+    }
+
+    static async searchMessages(query, page = 1) {
+        return this.request(`/messages/search?q=${encodeURIComponent(query)}&page=${page}`);
     }
 
     static async getConversations() {
@@ -157,6 +162,26 @@ class API {
         });
     }
 
+    static async addGroupMembers(groupId, userIds) {
+        return this.request('/groups/add_members', {
+            method: 'POST',
+            body: JSON.stringify({
+                group_id: groupId,
+                user_ids: userIds
+            })
+        });
+    }
+
+    static async removeGroupMembers(groupId, userIds) {
+        return this.request('/groups/remove_members', {
+            method: 'POST',
+            body: JSON.stringify({
+                group_id: groupId,
+                user_ids: userIds
+            })
+        });
+    }
+
     static async deleteGroup(groupId) {
         return this.request('/groups/delete', {
             method: 'POST',
@@ -166,6 +191,10 @@ class API {
         });
     }
 
+    static async getGroupDeleteJob(jobId) {
+        return this.request(`/groups/delete_jobs/${jobId}`);
+    }
+
     static async sendGroupMessage(groupId, content) {
         return this.request('/groups/send_message', {
             method: 'POST',
@@ -176,8 +205,9 @@ class API {
         });
     }
 
-    static async getGroupHistory(groupId) {
-        return this.request(`/groups/history?group_id=${groupId}`);
+    static async getGroupHistory(groupId, before = null) {
+        const cursor = before ? `&before=${before}` : '';
+        return this.request(`/groups/history?group_id=${groupId}${cursor}`);
     }
 
     static async getUserGroups() {
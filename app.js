@@ -5,6 +5,8 @@ let currentChatType = null; // 'friend' or 'group'
 let friends = [];
 let groups = [];
 let messageRefreshInterval = null;
+let historyCursor = null;
+let loadingOlderMessages = false;
 
 // DOM Elements
 const loadingScreen = document.getElementById('loading-screen');
@@ -209,7 +211,7 @@ function renderFriends() {
 
     friends.forEach(friend => {
         const friendElement = document.createElement('div');
-        friendElement.className = 'friend-item';
+        friendElement.className = `friend-item ${friend.online ? 'online' : ''}`;
         friendElement.onclick = () => openChat(friend, 'friend');
         
         friendElement.innerHTML = `
@@ -462,45 +464,77 @@ async function loadMessages() {
     if (!currentChat || !currentChatType) return;
 
     try {
-        let response;
-        if (currentChatType === 'friend') {
-            response = await API.getMessageHistory(currentChat.id);
-        } else {
-            response = await API.getGroupHistory(currentChat.id);
-        }
-        
+        const response = await fetchHistoryPage(null);
         if (response.success) {
             renderMessages(response.messages);
+            setHistoryCursor(response.next_cursor);
         }
     } catch (error) {
         console.error('Error loading messages:', error);
     }
 }
 
+function fetchHistoryPage(before) {
+    if (currentChatType === 'friend') {
+        return API.getMessageHistory(currentChat.id, before);
+    }
+    return API.getGroupHistory(currentChat.id, before);
+}
+
+// Cursor of the next older page; null once the oldest message is shown
+function setHistoryCursor(cursor) {
+    historyCursor = cursor || null;
+    const messagesArea = document.getElementById('messages-area');
+    let button = document.getElementById('load-older-messages');
+    if (!historyCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'load-older-messages';
+        button.className = 'load-older-messages';
+        button.textContent = 'Xem tin nhắn cũ hơn';
+        button.onclick = loadOlderMessages;
+    }
+    messagesArea.prepend(button);
+}
+
+async function loadOlderMessages() {
+    if (!currentChat || !currentChatType || !historyCursor || loadingOlderMessages) return;
+
+    const chat = currentChat;
+    loadingOlderMessages = true;
+    try {
+        const response = await fetchHistoryPage(historyCursor);
+        // The user may have switched chats while the page was loading
+        if (!response.success || chat !== currentChat) return;
+
+        const messagesArea = document.getElementById('messages-area');
+        const previousHeight = messagesArea.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        response.messages.forEach(message => {
+            fragment.appendChild(createMessageElement(message));
+        });
+        const button = document.getElementById('load-older-messages');
+        messagesArea.insertBefore(fragment, button ? button.nextSibling : messagesArea.firstChild);
+        setHistoryCursor(response.next_cursor);
+        // Keep the messages the user was reading in place
+        messagesArea.scrollTop += messagesArea.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
 function renderMessages(messages) {
     const messagesArea = document.getElementById('messages-area');
     messagesArea.innerHTML = '';
 
     messages.forEach(message => {
-        const messageElement = document.createElement('div');
-        messageElement.className = `message ${message.sender_id === currentUser.id ? 'own' : ''}`;
-        
-        const messageTime = new Date(message.timestamp).toLocaleTimeString('vi-VN', {
-            hour: '2-digit',
-            minute: '2-digit'
-        });
-        
-        messageElement.innerHTML = `
-            <div class="message-avatar">
-                <i class="fas fa-user"></i>
-            </div>
-            <div class="message-content">
-                <div class="message-text">${message.content}</div>
-                <div class="message-time">${messageTime}</div>
-            </div>
-        `;
-        
-        messagesArea.appendChild(messageElement);
+        trackMessageSeq(message);
+        messagesArea.appendChild(createMessageElement(message));
     });
     
     // Scroll to bottom
@@ -0,0 +1,303 @@
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from itertools import takewhile
+from datetime import datetime, timedelta
+from src.models.user import db, Message
+from src.sync import message_payload
+
+# Một bản ghi index: first_id, last_id, segment, offset, length (đã nén), raw_length, count
+_INDEX_RECORD = struct.Struct('<qqIQIII')
+_KEY_PATTERN = re.compile(r'^(?:private_\d+_\d+|group_\d+)$')
+
+class MessageArchive:
+    """Kho lưu trữ tin nhắn cũ: các file segment nén, chỉ ghi nối thêm, theo từng cuộc trò chuyện.
+
+    Mỗi cuộc trò chuyện là một thư mục root/<conversation_key>/ gồm các file
+    NNNNNN.seg và một file index. Segment chứa các khối zlib, mỗi khối là mảng
+    JSON tối đa block_messages payload (giống message_payload) tăng dần theo id;
+    index là các bản ghi _INDEX_RECORD cố định, một bản ghi cho mỗi khối. Đọc
+    lịch sử chỉ giải nén các khối cần thiết qua mmap, không đọc cả segment.
+    Segment được ghi và fsync trước index nên index luôn chỉ tới dữ liệu hợp lệ.
+    """
+
+    def __init__(self, root=None, block_messages=256, segment_max_bytes=64 * 1024 * 1024, level=6, max_open=64):
+        self.root = root
+        self.block_messages = block_messages
+        self.segment_max_bytes = segment_max_bytes
+        self.level = level
+        self.max_open = max_open
+        self._indexes = OrderedDict()
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+        self.blocks_read = 0
+
+    def _dir(self, key):
+        if self.root is None or not _KEY_PATTERN.match(key):
+            return None
+        return os.path.join(self.root, key)
+
+    def _index(self, key):
+        """Danh sách bản ghi index của cuộc trò chuyện, đọc lại khi file index đổi kích thước."""
+        directory = self._dir(key)
+        if directory is None:
+            return []
+        path = os.path.join(directory, 'index')
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached[0] == size:
+                self._indexes.move_to_end(key)
+                return cached[1]
+        with open(path, 'rb') as f:
+            data = f.read(size - size % _INDEX_RECORD.size)
+        records = [_INDEX_RECORD.unpack_from(data, offset) for offset in range(0, len(data), _INDEX_RECORD.size)]
+        with self._lock:
+            self._indexes[key] = (size, records)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > 4096:
+                self._indexes.popitem(last=False)
+        return records
+
+    def _segment_path(self, key, segment):
+        return os.path.join(self._dir(key), f'{segment:06d}.seg')
+
+    def _read_block(self, key, record):
+        _, _, segment, offset, length, _, _ = record
+        with self._lock:
+            entry = self._maps.get((key, segment))
+            if entry is None or len(entry[1]) < offset + length:
+                # Segment đã được ghi thêm sau lần map trước: map lại
+                if entry is not None:
+                    entry[1].close()
+                    entry[0].close()
+                f = open(self._segment_path(key, segment), 'rb')
+                entry = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                self._maps[(key, segment)] = entry
+                while len(self._maps) > self.max_open:
+                    _, (old_file, old_map) = self._maps.popitem(last=False)
+                    old_map.close()
+                    old_file.close()
+            self._maps.move_to_end((key, segment))
+            data = entry[1][offset:offset + length]
+            self.blocks_read += 1
+        return json.loads(zlib.decompress(data))
+
+    def _close(self, key):
+        with self._lock:
+            self._indexes.pop(key, None)
+            for map_key in [map_key for map_key in self._maps if map_key[0] == key]:
+                f, mapped = self._maps.pop(map_key)
+                mapped.close()
+                f.close()
+
+    def last_id(self, key):
+        """id lớn nhất đã lưu trữ của cuộc trò chuyện (0 nếu chưa có)."""
+        records = self._index(key)
+        return records[-1][1] if records else 0
+
+    def _write_blocks(self, directory, payloads, segment, level):
+        """Ghi payloads thành các khối vào segment của directory rồi ghi nối index; trả về segment cuối."""
+        records = []
+        for start in range(0, len(payloads), self.block_messages):
+            block = payloads[start:start + self.block_messages]
+            raw = json.dumps(block, separators=(',', ':')).encode()
+            data = zlib.compress(raw, level)
+            path = os.path.join(directory, f'{segment:06d}.seg')
+            if os.path.exists(path) and os.path.getsize(path) + len(data) > self.segment_max_bytes:
+                segment += 1
+                path = os.path.join(directory, f'{segment:06d}.seg')
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            records.append((block[0]['id'], block[-1]['id'], segment, offset, len(data), len(raw), len(block)))
+
+        with open(os.path.join(directory, 'index'), 'ab') as f:
+            # Bản ghi dở dang do sự cố ở lần ghi trước bị cắt bỏ để bản ghi mới thẳng hàng
+            size = f.tell()
+            if size % _INDEX_RECORD.size:
+                f.truncate(size - size % _INDEX_RECORD.size)
+            for record in records:
+                f.write(_INDEX_RECORD.pack(*record))
+            f.flush()
+            os.fsync(f.fileno())
+        return segment
+
+    def append(self, key, payloads):
+        """Ghi nối các payload (tăng dần theo id, mới hơn last_id) thành các khối mới."""
+        directory = self._dir(key)
+        if directory is None:
+            raise ValueError(f'Invalid conversation key: {key}')
+        if not payloads:
+            return
+        os.makedirs(directory, exist_ok=True)
+        records = self._index(key)
+        self._write_blocks(directory, payloads, records[-1][2] if records else 1, self.level)
+
+    def page_before(self, key, before, limit):
+        """Tối đa limit payload có id < before (None: mới nhất), tăng dần theo id; trả về (payloads, has_more)."""
+        records = self._index(key)
+        collected = []
+        for record in reversed(records):
+            if before is not None and record[0] >= before:
+                continue
+            block = self._read_block(key, record)
+            if before is not None:
+                block = [payload for payload in block if payload['id'] < before]
+            collected[:0] = block
+            if len(collected) > limit:
+                break
+        has_more = len(collected) > limit
+        return (collected[max(0, len(collected) - limit):] if limit else []), has_more
+
+    def page_after(self, key, after, limit):
+        """Tối đa limit payload có id > after, tăng dần theo id; trả về (payloads, has_more)."""
+        collected = []
+        for record in self._index(key):
+            if record[1] <= after:
+                continue
+            collected.extend(payload for payload in self._read_block(key, record) if payload['id'] > after)
+            if len(collected) > limit:
+                break
+        return collected[:limit], len(collected) > limit
+
+    def iter_messages(self, key, before=None, after=None):
+        """Duyệt các payload trong khoảng (after, before) tăng dần, giải nén từng khối một."""
+        for record in self._index(key):
+            if (after is not None and record[1] <= after) or (before is not None and record[0] >= before):
+                continue
+            for payload in self._read_block(key, record):
+                if (after is None or payload['id'] > after) and (before is None or payload['id'] < before):
+                    yield payload
+
+    def delete(self, key):
+        """Xóa toàn bộ dữ liệu lưu trữ của một cuộc trò chuyện (ví dụ khi xóa nhóm)."""
+        directory = self._dir(key)
+        self._close(key)
+        if directory is not None and os.path.isdir(directory):
+            shutil.rmtree(directory)
+
+    def keys(self):
+        if self.root is None or not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if _KEY_PATTERN.match(name))
+
+    def compact(self, key, level=9):
+        """Ghi lại lưu trữ của một cuộc trò chuyện thành các khối đầy, nén ở level cao hơn.
+
+        Chỉ chạy khi server không đọc/ghi kho (lệnh offline). Các file mới được
+        ghi vào thư mục tạm rồi đổi tên, nên lỗi giữa chừng không làm hỏng dữ liệu cũ.
+        Trả về (số khối, byte) trước và sau.
+        """
+        directory = self._dir(key)
+        records = self._index(key)
+        before = (len(records), sum(record[4] for record in records))
+        temporary = directory + '.compact'
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary)
+
+        os.makedirs(temporary)
+        segment = 1
+        batch = []
+        for payload in self.iter_messages(key):
+            batch.append(payload)
+            if len(batch) == self.block_messages * 16:
+                segment = self._write_blocks(temporary, batch, segment, level)
+                batch = []
+        if batch:
+            self._write_blocks(temporary, batch, segment, level)
+
+        self._close(key)
+        backup = directory + '.old'
+        os.replace(directory, backup)
+        os.replace(temporary, directory)
+        shutil.rmtree(backup)
+        records = self._index(key)
+        return before, (len(records), sum(record[4] for record in records))
+
+    def report(self, samples=200, limit=50):
+        """Dung lượng kho và độ trễ đọc một trang (ms) trên các cuộc trò chuyện đã lưu trữ."""
+        keys = self.keys()
+        totals = {'conversations': len(keys), 'segments': 0, 'blocks': 0, 'messages': 0,
+                  'compressed_bytes': 0, 'raw_bytes': 0, 'index_bytes': 0}
+        for key in keys:
+            records = self._index(key)
+            directory = self._dir(key)
+            totals['segments'] += sum(1 for name in os.listdir(directory) if name.endswith('.seg'))
+            totals['blocks'] += len(records)
+            totals['messages'] += sum(record[6] for record in records)
+            totals['compressed_bytes'] += sum(record[4] for record in records)
+            totals['raw_bytes'] += sum(record[5] for record in records)
+            totals['index_bytes'] += os.path.getsize(os.path.join(directory, 'index'))
+        totals['compression_ratio'] = round(totals['raw_bytes'] / totals['compressed_bytes'], 2) \
+            if totals['compressed_bytes'] else 0.0
+
+        timings = []
+        for position in range(min(samples, len(keys) * 4)):
+            key = keys[position % len(keys)]
+            records = self._index(key)
+            if not records:
+                continue
+            # Trang mới nhất và một trang ở giữa kho của cuộc trò chuyện
+            before = None if position % 2 == 0 else records[len(records) // 2][1]
+            started = time.perf_counter()
+            self.page_before(key, before, limit)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        if timings:
+            totals['page_read_ms'] = {
+                'count': len(timings),
+                'p50': round(timings[len(timings) // 2] * 1000.0, 3),
+                'p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000.0, 3),
+                'max': round(timings[-1] * 1000.0, 3)
+            }
+        return totals
+
+message_archive = MessageArchive()
+
+def archive_cold_messages(older_than_days, batch_size=2000, archive=None):
+    """Chuyển tin nhắn cũ hơn older_than_days ngày từ bảng Message sang kho lưu trữ.
+
+    Duyệt bảng theo id tăng dần và dừng ở tin nhắn đầu tiên còn mới, nên phần
+    được chuyển luôn là đoạn đầu (theo id) của mỗi cuộc trò chuyện. Mỗi lô được
+    ghi vào segment trước rồi mới xóa khỏi database trong một transaction ngắn;
+    chạy lại sau sự cố chỉ xóa nốt các dòng đã có trong kho. Trả về số tin đã chuyển.
+    """
+    archive = archive or message_archive
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Message).filter(Message.id > last_id).order_by(Message.id.asc()).limit(batch_size).all()
+        cold = list(takewhile(lambda message: message.timestamp < cutoff, rows))
+        if not cold:
+            break
+
+        by_key = {}
+        for message in cold:
+            by_key.setdefault(message.conversation_key, []).append(message)
+        for key, messages in by_key.items():
+            archived_up_to = archive.last_id(key)
+            archive.append(key, [message_payload(message) for message in messages if message.id > archived_up_to])
+
+        ids = [message.id for message in cold]
+        db.session.execute(db.delete(Message).where(Message.id.in_(ids)))
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(ids)
+        last_id = ids[-1]
+        if len(cold) < len(rows) or len(rows) < batch_size:
+            break
+    return moved
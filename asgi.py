@@ -0,0 +1,254 @@
+"""Chế độ chạy asyncio: python-socketio AsyncServer + các blueprint Flask qua ASGI.
+
+    pip install -r requirements-asgi.txt
+    uvicorn src.asgi:application --host 0.0.0.0 --port 5000
+
+Cùng tên sự kiện (connect, join_chat, leave_chat, send_message) và tên phòng
+(user_{id}, private_{a}_{b}, group_{id}) như main.py. Mỗi kết nối chỉ là một
+coroutine nên một tiến trình giữ được hàng chục nghìn kết nối nhàn rỗi; truy
+cập SQLite chạy trên pool luồng giới hạn để không chặn event loop. Các REST
+API không đổi, Flask được gắn vào cùng ứng dụng ASGI qua asgiref.
+"""
+import asyncio
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+import socketio
+from itsdangerous import BadSignature
+from src.main import app, message_writer, save_message, message_events
+from src.presence import presence, presence_cycle, connect_snapshot
+from src.metrics import instrument_socketio
+from src.json_backend import FastJSON
+from src.backpressure import AsyncOutboundLimiter, send_limiter
+from src.cache import group_members
+from src.models.indexes import private_conversation_key, group_conversation_key
+from src.sync import collect_missing_messages, can_access_conversation
+from src.models.read_state import read_cursors, clamp_read_seq
+from src.models.group_deletion import group_purger
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:
+    raise RuntimeError('Chế độ ASGI cần cài đặt asgiref: pip install -r requirements-asgi.txt') from e
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', json=FastJSON)
+
+# Hàng đợi gửi của từng kết nối bị giới hạn như main.py (OUTBOUND_QUEUE_MAX_FRAMES, OUTBOUND_QUEUE_POLICY)
+outbound = AsyncOutboundLimiter(
+    app.config['OUTBOUND_QUEUE_MAX_FRAMES'], app.config['OUTBOUND_QUEUE_POLICY']
+).install(sio)
+
+# Pool luồng riêng cho truy cập database từ các handler bất đồng bộ
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_DB_THREADS', '8')),
+    thread_name_prefix='asgi-db'
+)
+
+async def run_db(fn, *args):
+    """Chạy fn(*args) trong app context trên pool luồng database."""
+    def call():
+        with app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+def _user_id_from_environ(environ):
+    """Đọc user_id từ cookie session Flask đã ký."""
+    cookie = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+    morsel = cookie.get(app.config.get('SESSION_COOKIE_NAME', 'session'))
+    if morsel is None:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+async def emit_events(events):
+    """Phát các sự kiện của một tin nhắn; fan-out nhiều phòng chạy như task nền."""
+    for event, payload, to in events:
+        if isinstance(to, list):
+            if to:
+                sio.start_background_task(sio.emit, event, payload, to=to)
+        else:
+            await sio.emit(event, payload, to=to)
+
+_presence_task = None
+_loop = None
+
+async def presence_broadcaster():
+    """Gửi cho mỗi người bạn online một diff presence đã gom sau mỗi chu kỳ."""
+    interval = app.config['PRESENCE_BROADCAST_MS'] / 1000.0
+    while True:
+        await sio.sleep(interval)
+        try:
+            diffs = await run_db(presence_cycle)
+            for friend_id, diff in diffs.items():
+                await sio.emit('presence_update', diff, to=f'user_{friend_id}')
+            # Gửi số thông báo đã gộp khi hàng đợi của client còn đầy
+            await outbound.flush_idle()
+        except Exception as e:
+            print(f'Error broadcasting presence: {e}')
+
+async def close_group_room(group_id, member_ids):
+    """Báo cho thành viên nhóm đã bị xóa và đưa mọi kết nối ra khỏi phòng nhóm."""
+    rooms = [f'user_{user_id}' for user_id in member_ids]
+    if rooms:
+        await sio.emit('group_deleted', {'group_id': group_id}, to=rooms)
+    await sio.close_room(group_conversation_key(group_id))
+
+def _schedule_close_group_room(group_id, member_ids):
+    # Route xóa nhóm chạy trên luồng của WsgiToAsgi nên đẩy việc về event loop
+    if _loop is not None:
+        asyncio.run_coroutine_threadsafe(close_group_room(group_id, member_ids), _loop)
+
+group_purger.notify = _schedule_close_group_room
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    global _presence_task, _loop
+    user_id = _user_id_from_environ(environ)
+    if user_id is None:
+        print('Unauthorized connection attempt')
+        return
+    if _presence_task is None:
+        # Task nền cần event loop đang chạy nên khởi động ở kết nối đầu tiên
+        _presence_task = sio.start_background_task(presence_broadcaster)
+        _loop = asyncio.get_running_loop()
+    await sio.save_session(sid, {'user_id': user_id})
+    await sio.enter_room(sid, f'user_{user_id}')
+    presence.connect(user_id, sid)
+    online_friends, digest = await run_db(connect_snapshot, user_id)
+    await sio.emit('presence_snapshot', {
+        'online': online_friends,
+        'heartbeat_interval': app.config['PRESENCE_HEARTBEAT_S']
+    }, to=sid)
+    if digest:
+        await sio.emit('pending_notifications', {'notifications': digest}, to=sid)
+    print(f'User {user_id} connected')
+
+@sio.event
+async def disconnect(sid, *args):
+    session = await sio.get_session(sid)
+    if 'user_id' in session:
+        presence.disconnect(session['user_id'], sid)
+        print(f'User {session["user_id"]} disconnected')
+
+@sio.event
+async def heartbeat(sid, *args):
+    session = await sio.get_session(sid)
+    if 'user_id' in session and not presence.heartbeat(session['user_id'], sid):
+        presence.connect(session['user_id'], sid)
+
+@sio.event
+async def join_chat(sid, data):
+    session = await sio.get_session(sid)
+    if 'user_id' not in session:
+        return
+
+    chat_type = data.get('type')
+    chat_id = data.get('id')
+
+    if chat_type == 'friend':
+        await sio.enter_room(sid, private_conversation_key(session['user_id'], chat_id))
+    elif chat_type == 'group':
+        if await run_db(group_members.is_member, chat_id, session['user_id']):
+            await sio.enter_room(sid, group_conversation_key(chat_id))
+
+@sio.event
+async def leave_chat(sid, data):
+    session = await sio.get_session(sid)
+    if 'user_id' not in session:
+        return
+
+    chat_type = data.get('type')
+    chat_id = data.get('id')
+
+    if chat_type == 'friend':
+        await sio.leave_room(sid, private_conversation_key(session['user_id'], chat_id))
+    elif chat_type == 'group':
+        await sio.leave_room(sid, group_conversation_key(chat_id))
+
+@sio.event
+async def sync(sid, data):
+    session = await sio.get_session(sid)
+    if 'user_id' not in session:
+        return {'success': False}
+
+    cursors = data.get('conversations') if isinstance(data, dict) else None
+    if not isinstance(cursors, dict):
+        return {'success': False, 'error': 'invalid_conversations'}
+    return {
+        'success': True,
+        'conversations': await run_db(collect_missing_messages, session['user_id'], cursors)
+    }
+
+@sio.event
+async def mark_read(sid, data):
+    session = await sio.get_session(sid)
+    if 'user_id' not in session:
+        return {'success': False}
+
+    conversation_key = data.get('conversation')
+    try:
+        seq = int(data.get('seq'))
+    except (TypeError, ValueError):
+        return {'success': False}
+
+    if not isinstance(conversation_key, str) or \
+            not await run_db(can_access_conversation, session['user_id'], conversation_key):
+        return {'success': False}
+
+    seq = await run_db(clamp_read_seq, conversation_key, seq)
+    read_cursors.mark(session['user_id'], conversation_key, seq)
+    return {'success': True}
+
+@sio.event
+async def send_message(sid, data):
+    session = await sio.get_session(sid)
+    if 'user_id' not in session:
+        return
+
+    chat_type = data.get('type')
+    chat_id = data.get('id')
+    content = data.get('content', '').strip()
+
+    if not content:
+        return
+
+    if not send_limiter.allow(session['user_id']):
+        return {'success': False, 'error': 'rate_limited'}
+
+    if chat_type == 'friend':
+        fields = {'sender_id': session['user_id'], 'receiver_id': chat_id, 'content': content}
+    elif chat_type == 'group':
+        if not await run_db(group_members.is_member, chat_id, session['user_id']):
+            return
+        fields = {'sender_id': session['user_id'], 'group_id': chat_id, 'content': content}
+    else:
+        return
+
+    try:
+        if message_writer is not None:
+            # Chế độ ghi theo lô: luồng ghi đẩy việc phát sự kiện về event loop
+            loop = asyncio.get_running_loop()
+            message_writer.submit(
+                fields,
+                on_commit=lambda message: asyncio.run_coroutine_threadsafe(emit_events(message_events(message)), loop)
+            )
+            return
+
+        events = await run_db(lambda: message_events(save_message(fields)))
+        await emit_events(events)
+
+    except queue.Full:
+        return {'success': False, 'error': 'busy'}
+    except Exception as e:
+        print(f'Error sending message: {e}')
+
+if app.config['METRICS_ENABLED']:
+    # /metrics và các route Flask đã được đo trong main.py; ở đây chỉ thêm các sự kiện của AsyncServer
+    instrument_socketio(sio)
+
+application = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(app))
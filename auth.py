@@ -1,10 +1,19 @@
 from flask import Blueprint, jsonify, request, session
 from src.models.user import User, db
+from src.cache import profiles
+from src.database import read_session
+from src.passwords import password_hasher, PasswordHasherBusy
 import os
 from werkzeug.utils import secure_filename
 
 auth_bp = Blueprint('auth', __name__)
 
+def _busy_response():
+    # Hàng đợi băm mật khẩu đầy: từ chối ngay thay vì để request chờ và chặn luồng xử lý
+    response = jsonify({'success': False, 'error': 'Máy chủ đang quá tải, vui lòng thử lại sau'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -20,18 +29,23 @@ def register():
         if len(custom_id) > 16:
             return jsonify({'success': False, 'error': 'ID tùy chỉnh không được vượt quá 16 ký tự'}), 400
         
-        # Kiểm tra xem username hoặc custom_id đã tồn tại chưa
-        existing_user = User.query.filter((User.username == username) | (User.custom_id == custom_id)).first()
-        if existing_user:
-            if existing_user.username == username:
+        # Kiểm tra xem username hoặc custom_id đã tồn tại chưa (qua read_session, trả kết nối trước khi băm)
+        existing_username = read_session.query(User.username).filter(
+            (User.username == username) | (User.custom_id == custom_id)
+        ).scalar()
+        read_session.close()
+        if existing_username is not None:
+            if existing_username == username:
                 return jsonify({'success': False, 'error': 'Tên người dùng đã tồn tại'}), 400
             else:
                 return jsonify({'success': False, 'error': 'ID tùy chỉnh đã tồn tại'}), 400
         
-        # Tạo người dùng mới (mật khẩu không mã hóa theo yêu cầu)
-        new_user = User(username=username, password=password, custom_id=custom_id)
+        # Băm (scrypt trên pool luồng riêng) khi không giữ kết nối ghi nào, rồi mới mở transaction ghi
+        hashed = password_hasher.hash(password)
+        new_user = User(username=username, password=hashed, custom_id=custom_id)
         db.session.add(new_user)
         db.session.commit()
+        profiles.invalidate(new_user.id)
         
         return jsonify({
             'success': True, 
@@ -39,6 +53,8 @@ def register():
             'user': new_user.to_dict()
         }), 201
         
+    except PasswordHasherBusy:
+        return _busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -53,23 +69,45 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'error': 'Tên người dùng và mật khẩu không được để trống'}), 400
         
-        # Tìm người dùng theo username hoặc custom_id
-        user = User.query.filter((User.username == username) | (User.custom_id == username)).first()
+        # Tìm người dùng theo username hoặc custom_id qua read_session; kết nối được trả lại
+        # trước khi băm để việc chờ scrypt không giữ pool ghi (pool_size=1 ở profile production)
+        user = read_session.query(User).filter((User.username == username) | (User.custom_id == username)).first()
+        if not user:
+            read_session.close()
+            return jsonify({'success': False, 'error': 'Tên người dùng hoặc mật khẩu không đúng'}), 401
+        user_id, user_name, stored_password, profile = user.id, user.username, user.password, user.to_dict()
+        read_session.close()
         
-        if not user or user.password != password:  # So sánh mật khẩu không mã hóa
+        matches, needs_rehash = password_hasher.verify(password, stored_password)
+        if not matches:
             return jsonify({'success': False, 'error': 'Tên người dùng hoặc mật khẩu không đúng'}), 401
         
+        # Dòng cũ lưu mật khẩu thô: băm lại ngay khi đăng nhập thành công, chỉ ghi
+        # nếu mật khẩu chưa bị đổi trong lúc băm
+        if needs_rehash:
+            try:
+                hashed = password_hasher.hash(password)
+                db.session.execute(db.update(User).where(
+                    User.id == user_id, User.password == stored_password
+                ).values(password=hashed))
+                db.session.commit()
+            except PasswordHasherBusy:
+                pass
+        
         # Lưu thông tin người dùng vào session
-        session['user_id'] = user.id
-        session['username'] = user.username
+        session['user_id'] = user_id
+        session['username'] = user_name
         
         return jsonify({
             'success': True,
             'message': 'Đăng nhập thành công',
-            'user': user.to_dict()
+            'user': profile
         }), 200
         
+    except PasswordHasherBusy:
+        return _busy_response()
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
@@ -123,6 +161,7 @@ def upload_avatar():
         user = User.query.get(session['user_id'])
         user.avatar_url = f'/uploads/{filename}'
         db.session.commit()
+        profiles.invalidate(user.id)
         
         return jsonify({
             'success': True,
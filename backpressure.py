@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+from collections import Counter
+
+POLICIES = ('coalesce', 'drop', 'disconnect')
+# Các sự kiện chỉ mang tính thông báo: khi hàng đợi đầy được gộp thành một bộ đếm
+COALESCED_EVENTS = ('message_notification', 'presence_update')
+# Ngưỡng (byte) cho phân bố kích thước hàng đợi gửi trên /metrics
+QUEUE_BYTES_BUCKETS = (0, 1024, 16384, 65536, 262144, 1048576)
+
+def _event_name(data):
+    # Gói EVENT của Socket.IO đã encode: 2["event",...] hoặc 2/namespace,["event",...]
+    if not isinstance(data, str) or not data.startswith('2'):
+        return None
+    start = data.find('["')
+    if start == -1:
+        return None
+    end = data.find('"', start + 2)
+    return data[start + 2:end] if end != -1 else None
+
+class OutboundLimiter:
+    """Giới hạn hàng đợi gửi của từng kết nối Engine.IO.
+
+    Bọc server.eio.send: khi hàng đợi của một kết nối đã có max_frames gói,
+    gói mới bị xử lý theo policy:
+    - 'coalesce': message_notification/presence_update được gộp thành một gói
+      notifications_collapsed {count}; new_message/new_messages bị bỏ và cuộc trò chuyện được
+      ghi lại để gửi sync_required (client đồng bộ lại theo seq); sự kiện khác bị bỏ.
+    - 'drop': bỏ mọi gói mới.
+    - 'disconnect': ngắt kết nối chậm, client tự kết nối lại và đồng bộ.
+    Các gói gộp được gửi khi hàng đợi xuống dưới một nửa giới hạn.
+    """
+
+    def __init__(self, max_frames=256, policy='coalesce'):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown outbound queue policy: {policy}')
+        self.max_frames = max_frames
+        self.policy = policy
+        self.server = None
+        self._send = None
+        self._collapsed = {}
+        self._resync = {}
+        self._lock = threading.Lock()
+        self.dropped = Counter()
+
+    def install(self, server):
+        """Gắn vào python-socketio Server (chế độ threading; AsyncServer dùng AsyncOutboundLimiter)."""
+        self.server = server
+        self._send = server.eio.send
+        server.eio.send = self.send
+        return self
+
+    def _queue(self, eio_sid):
+        socket = self.server.eio.sockets.get(eio_sid)
+        return socket.queue if socket is not None else None
+
+    def _admit(self, eio_sid, data):
+        """Quyết định cho một gói: 'send', 'flush' (gửi các gói gộp rồi gửi gói này), 'drop' hoặc 'disconnect'."""
+        queue = self._queue(eio_sid)
+        if queue is None:
+            return 'send'
+
+        depth = queue.qsize()
+        if depth < self.max_frames:
+            if depth < self.max_frames // 2 and (eio_sid in self._collapsed or eio_sid in self._resync):
+                return 'flush'
+            return 'send'
+
+        event_name = _event_name(data)
+        if event_name is None:
+            # Ack và gói điều khiển luôn được gửi
+            return 'send'
+
+        with self._lock:
+            self.dropped[(event_name, self.policy)] += 1
+        if self.policy == 'disconnect':
+            return 'disconnect'
+        if self.policy == 'coalesce':
+            if event_name in COALESCED_EVENTS:
+                with self._lock:
+                    self._collapsed[eio_sid] = self._collapsed.get(eio_sid, 0) + 1
+            elif event_name in ('new_message', 'new_messages'):
+                # Cả gói đơn lẫn gói đã gom theo phòng (RoomBatcher) đều mang 'conversation'
+                conversation = json.loads(data[data.find('['):])[1].get('conversation')
+                with self._lock:
+                    self._resync.setdefault(eio_sid, set()).add(conversation)
+        return 'drop'
+
+    def send(self, eio_sid, data):
+        action = self._admit(eio_sid, data)
+        if action == 'flush':
+            self._flush(eio_sid)
+        if action in ('send', 'flush'):
+            return self._send(eio_sid, data)
+        if action == 'disconnect':
+            self.server.eio.disconnect(eio_sid)
+
+    def _pending_packets(self, eio_sid):
+        with self._lock:
+            collapsed = self._collapsed.pop(eio_sid, 0)
+            conversations = self._resync.pop(eio_sid, None)
+        namespace = '/'
+        packets = []
+        if collapsed:
+            packets.append(self.server.packet_class(
+                2, namespace=namespace, data=['notifications_collapsed', {'count': collapsed}]
+            ))
+        if conversations:
+            packets.append(self.server.packet_class(
+                2, namespace=namespace, data=['sync_required', {'conversations': sorted(c for c in conversations if c)}]
+            ))
+        return packets
+
+    def _flush(self, eio_sid):
+        for packet in self._pending_packets(eio_sid):
+            self.server._send_packet(eio_sid, packet)
+
+    def _idle_sids(self):
+        """Các kết nối có gói gộp đang treo và hàng đợi đã xuống dưới nửa giới hạn."""
+        idle = []
+        for eio_sid in list(self._collapsed) + list(self._resync):
+            queue = self._queue(eio_sid)
+            if queue is None:
+                with self._lock:
+                    self._collapsed.pop(eio_sid, None)
+                    self._resync.pop(eio_sid, None)
+            elif queue.qsize() < self.max_frames // 2:
+                idle.append(eio_sid)
+        return idle
+
+    def flush_idle(self):
+        """Gửi các gói gộp còn treo cho kết nối đã rảnh (gọi định kỳ từ luồng nền)."""
+        for eio_sid in self._idle_sids():
+            self._flush(eio_sid)
+
+    def queue_stats(self, buckets=QUEUE_BYTES_BUCKETS):
+        """Phân bố số byte đang chờ gửi theo kết nối (không kèm sid để không lộ định danh phiên).
+
+        by_bucket: số kết nối có hàng đợi <= từng ngưỡng trong buckets (cộng dồn).
+        """
+        sizes = []
+        for socket in list(self.server.eio.sockets.values()):
+            pending = list(socket.queue.queue)
+            sizes.append(sum(len(pkt.data) for pkt in pending if pkt is not None and isinstance(pkt.data, (str, bytes))))
+        return {
+            'connections': len(sizes),
+            'queued_bytes_total': sum(sizes),
+            'queued_bytes_max': max(sizes, default=0),
+            'by_bucket': [(bound, sum(1 for size in sizes if size <= bound)) for bound in buckets]
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'max_frames': self.max_frames,
+                'dropped': {f'{event}:{policy}': count for (event, policy), count in self.dropped.items()},
+                'collapsed_pending': sum(self._collapsed.values())
+            }
+
+class AsyncOutboundLimiter(OutboundLimiter):
+    """OutboundLimiter cho python-socketio AsyncServer (chế độ ASGI): cùng giới hạn và policy, send là coroutine."""
+
+    async def send(self, eio_sid, data):
+        action = self._admit(eio_sid, data)
+        if action == 'flush':
+            await self._flush(eio_sid)
+        if action in ('send', 'flush'):
+            return await self._send(eio_sid, data)
+        if action == 'disconnect':
+            await self.server.eio.disconnect(eio_sid)
+
+    async def _flush(self, eio_sid):
+        for packet in self._pending_packets(eio_sid):
+            await self.server._send_packet(eio_sid, packet)
+
+    async def flush_idle(self):
+        for eio_sid in self._idle_sids():
+            await self._flush(eio_sid)
+
+class TokenBucketLimiter:
+    """Giới hạn tốc độ theo người dùng: rate token mỗi giây, tối đa burst token."""
+
+    def __init__(self, rate=5.0, burst=20):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.limited += 1
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > 100000:
+                # Bỏ các bucket đã đầy lại (người dùng không gửi gần đây)
+                self._buckets = {
+                    k: v for k, v in self._buckets.items()
+                    if v[0] + (now - v[1]) * self.rate < self.burst
+                }
+            return True
+
+outbound = OutboundLimiter()
+send_limiter = TokenBucketLimiter()
@@ -0,0 +1,155 @@
+"""So sánh số frame/giây và CPU server cho mỗi tin được giao, có và không có gom new_messages.
+
+    pip install "python-socketio[client]" requests
+    python src/bench_delivery.py --receivers 50 --senders 5 --rate 2000 --seconds 5
+
+Với mỗi chế độ (DELIVERY_BATCH_ENABLED=0 và =1) harness chạy server trong một
+tiến trình con trên database tạm (seed bằng bench_load.py), cho --receivers
+client tham gia cùng một nhóm và --senders client gửi tổng cộng --rate tin/giây
+trong --seconds giây. Ghi nhận số frame (new_message + new_messages) và số tin
+nhận được ở client, độ trễ gửi -> nhận và thời gian CPU của tiến trình server
+(đọc /proc, chỉ trên Linux). Mỗi chế độ in một dòng JSON.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.bench_load import percentiles, login, seed
+
+try:
+    import requests
+    import socketio
+except ImportError as e:
+    raise RuntimeError('Benchmark cần client: pip install "python-socketio[client]" requests') from e
+
+def _cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime và stime (trường 14, 15) tính bằng clock tick
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+class GroupClient:
+    def __init__(self, base_url, index, group_id):
+        self.frames = 0
+        self.messages = 0
+        self.latencies = []
+        http = login(base_url, index)
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_message', lambda data: self._receive([data]))
+        self.sio.on('new_messages', lambda data: self._receive(data['messages']))
+        cookie = '; '.join(f'{name}={value}' for name, value in http.cookies.items())
+        self.sio.connect(base_url, headers={'Cookie': cookie}, transports=['websocket'])
+        self.sio.emit('join_chat', {'type': 'group', 'id': group_id})
+
+    def _receive(self, messages):
+        now = time.perf_counter()
+        self.frames += 1
+        self.messages += len(messages)
+        for data in messages:
+            self.latencies.append(now - float(data['content'].rsplit(':', 1)[1]))
+
+def serve(port, users, group_size):
+    from src.main import app, socketio, save_message
+    from src.bench_load import start_server
+    # Database mới nên nhóm duy nhất có id 1, gồm tất cả người dùng
+    seed(app, save_message, users, 1, 1, group_size, 0)
+    start_server(app, socketio, port)
+    threading.Event().wait()
+
+def run_mode(batched, args):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'delivery.db')}",
+        DELIVERY_BATCH_ENABLED='1' if batched else '0',
+        SEND_RATE_PER_SEC='1000000',
+        SEND_RATE_BURST='1000000',
+        OUTBOUND_QUEUE_MAX_FRAMES='1000000',
+        METRICS_ENABLED='0'
+    )
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', str(args.port), str(args.receivers + args.senders)],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        group_id = 1
+        base_url = f'http://127.0.0.1:{args.port}'
+        for _ in range(600):
+            try:
+                requests.get(f'{base_url}/api/auth/me', timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        receivers = [GroupClient(base_url, index, group_id) for index in range(args.receivers)]
+        senders = [GroupClient(base_url, args.receivers + index, group_id) for index in range(args.senders)]
+        time.sleep(0.5)
+
+        interval = args.senders / args.rate
+        def send_loop(client):
+            number = 0
+            deadline = time.perf_counter() + args.seconds
+            while time.perf_counter() < deadline:
+                client.sio.emit('send_message', {
+                    'type': 'group', 'id': group_id, 'content': f'{number}:{time.perf_counter()}'
+                })
+                number += 1
+                time.sleep(interval)
+            return number
+
+        cpu_before = _cpu_seconds(server.pid)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=send_loop, args=(client,)) for client in senders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(1.0)
+        elapsed = time.perf_counter() - started
+        cpu = _cpu_seconds(server.pid) - cpu_before
+
+        frames = sum(client.frames for client in receivers)
+        delivered = sum(client.messages for client in receivers)
+        for client in receivers + senders:
+            client.sio.disconnect()
+        return {
+            'mode': 'batched' if batched else 'per_message',
+            'receivers': args.receivers,
+            'target_rate': args.rate,
+            'frames': frames,
+            'messages_delivered': delivered,
+            'frames_per_sec': round(frames / elapsed, 1),
+            'messages_per_frame': round(delivered / frames, 2) if frames else 0.0,
+            'server_cpu_seconds': round(cpu, 3),
+            'cpu_us_per_delivered_message': round(cpu / delivered * 1e6, 2) if delivered else None,
+            'delivery_latency': percentiles([latency for client in receivers for latency in client.latencies])
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receivers', type=int, default=50)
+    parser.add_argument('--senders', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=2000.0, help='tổng số tin gửi mỗi giây')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=5097)
+    parser.add_argument('--serve', nargs=2, type=int, metavar=('PORT', 'USERS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        port, users = args.serve
+        serve(port, users, users)
+        return
+
+    for batched in (False, True):
+        print(json.dumps(run_mode(batched, args)), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""So sánh kế hoạch truy vấn và thời gian của lịch sử tin nhắn riêng trước/sau conversation_key.
+
+    python src/bench_history_query.py --messages 200000 --users 200
+
+Tạo database SQLite tạm với cùng cấu trúc bảng message, in EXPLAIN QUERY PLAN
+và thời gian trung bình cho:
+- before: predicate OR (sender, receiver) + ORDER BY id DESC LIMIT trên chỉ mục
+  (sender_id, receiver_id, id) của phân trang keyset, chỉ mục bị thay bởi conversation_key
+- after: conversation_key = ? ORDER BY id DESC LIMIT (chỉ mục (conversation_key, id))
+Kết quả cuối cùng in ra dạng JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+BEFORE = """
+    SELECT * FROM message
+    WHERE (sender_id = :a AND receiver_id = :b) OR (sender_id = :b AND receiver_id = :a)
+    ORDER BY id DESC LIMIT :limit
+"""
+
+AFTER = """
+    SELECT * FROM message
+    WHERE conversation_key = :key
+    ORDER BY id DESC LIMIT :limit
+"""
+
+def seed(connection, messages, users):
+    connection.executescript("""
+        CREATE TABLE message (
+            id INTEGER PRIMARY KEY,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER,
+            group_id INTEGER,
+            content TEXT NOT NULL,
+            timestamp DATETIME,
+            conversation_key VARCHAR(40)
+        );
+    """)
+    rows = []
+    for index in range(messages):
+        a, b = random.sample(range(1, users + 1), 2)
+        rows.append((a, b, f'message {index}', f'2025-01-01 00:00:{index % 60:02d}.{index:06d}',
+                     f'private_{min(a, b)}_{max(a, b)}'))
+    connection.executemany(
+        'INSERT INTO message (sender_id, receiver_id, content, timestamp, conversation_key) VALUES (?, ?, ?, ?, ?)',
+        rows
+    )
+    connection.commit()
+
+def measure(connection, sql, params, repeat):
+    plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        connection.execute(sql, params).fetchall()
+    return plan, (time.perf_counter() - started) / repeat * 1000.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    connection = sqlite3.connect(path)
+    seed(connection, args.messages, args.users)
+
+    params = {'a': 1, 'b': 2, 'key': 'private_1_2', 'limit': args.limit}
+    connection.execute('CREATE INDEX ix_message_sender_receiver_id ON message (sender_id, receiver_id, id)')
+    connection.execute('CREATE INDEX ix_message_group_id_id ON message (group_id, id)')
+    connection.execute('ANALYZE')
+    before_plan, before_ms = measure(connection, BEFORE, params, args.repeat)
+
+    connection.execute('DROP INDEX ix_message_sender_receiver_id')
+    connection.execute('CREATE INDEX ix_message_conversation_key_id ON message (conversation_key, id)')
+    connection.execute('ANALYZE')
+    after_plan, after_ms = measure(connection, AFTER, params, args.repeat)
+
+    print('before:', *before_plan, sep='\n  ')
+    print('after:', *after_plan, sep='\n  ')
+    print(json.dumps({
+        'messages': args.messages,
+        'before_ms': round(before_ms, 3),
+        'after_ms': round(after_ms, 3),
+        'before_plan': before_plan,
+        'after_plan': after_plan
+    }))
+
+if __name__ == '__main__':
+    main()
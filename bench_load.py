@@ -0,0 +1,246 @@
+"""Benchmark tải cho đường Socket.IO và các REST API, chạy trên database SQLite tạm.
+
+    pip install "python-socketio[client]" requests
+    python src/bench_load.py --users 500 --groups 20 --group-size 50 --clients 100 --messages 20
+
+Harness tạo database tạm, seed người dùng, quan hệ bạn bè (mỗi người kết bạn
+với --friends người kế tiếp theo vòng), các nhóm --group-size thành viên và
+--history tin nhắn cho cuộc trò chuyện đo lịch sử, rồi chạy server trong
+cùng tiến trình. Sau đó:
+- send_message: --clients client Socket.IO đồng thời, mỗi client gửi --messages
+  tin cho người bạn kế tiếp; đo thông lượng và độ trễ gửi -> nhận new_message
+  (p50/p95/p99) ở phía người nhận.
+- micro-benchmark: /api/messages/history, /api/messages/conversations,
+  /api/groups/list, /api/users/search, mỗi API --repeat lần.
+Kết quả là một JSON (stdout hoặc --output) để so sánh giữa các lần chạy.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+try:
+    import requests
+    import socketio
+except ImportError as e:
+    raise RuntimeError('Benchmark cần client: pip install "python-socketio[client]" requests') from e
+
+PASSWORD = 'bench'
+
+def percentiles(samples):
+    """Trả về p50/p95/p99/mean (ms) của danh sách thời gian tính bằng giây."""
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000.0, 3)
+    return {
+        'count': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000.0, 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(samples[-1] * 1000.0, 3)
+    }
+
+def seed(app, save_message, users, friends, groups, group_size, history):
+    from src.models.user import User, Friendship, Group, GroupMember, db
+
+    with app.app_context():
+        db.session.add_all([
+            User(username=f'bench{index}', password=PASSWORD, custom_id=f'b{index}')
+            for index in range(users)
+        ])
+        db.session.commit()
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id).all()]
+
+        pairs = set()
+        for position, user_id in enumerate(user_ids):
+            for offset in range(1, friends + 1):
+                friend_id = user_ids[(position + offset) % len(user_ids)]
+                if friend_id != user_id and (friend_id, user_id) not in pairs:
+                    pairs.add((user_id, friend_id))
+        db.session.add_all([Friendship(user_id1=a, user_id2=b, status='accepted') for a, b in pairs])
+
+        group_ids = []
+        for index in range(groups):
+            members = [user_ids[(index * group_size + offset) % len(user_ids)] for offset in range(group_size)]
+            group = Group(name=f'bench group {index}', creator_id=members[0])
+            db.session.add(group)
+            db.session.flush()
+            db.session.add_all([GroupMember(group_id=group.id, user_id=user_id) for user_id in set(members)])
+            group_ids.append(group.id)
+        db.session.commit()
+
+        # Lịch sử cho cuộc trò chuyện được đo (user đầu tiên với bạn kế tiếp và nhóm đầu tiên)
+        for index in range(history):
+            sender, receiver = (user_ids[0], user_ids[1]) if index % 2 == 0 else (user_ids[1], user_ids[0])
+            save_message({'sender_id': sender, 'receiver_id': receiver, 'content': f'history message {index}'})
+            if group_ids:
+                save_message({'sender_id': user_ids[0], 'group_id': group_ids[0], 'content': f'group message {index}'})
+        return user_ids, group_ids
+
+def login(base_url, user_id):
+    http = requests.Session()
+    response = http.post(f'{base_url}/api/auth/login', json={'username': f'b{user_id}', 'password': PASSWORD})
+    response.raise_for_status()
+    return http
+
+class BenchClient:
+    """Một client Socket.IO đã đăng nhập; ghi độ trễ các new_message nhận từ người khác."""
+
+    def __init__(self, base_url, user_id, custom_index):
+        self.user_id = user_id
+        self.http = login(base_url, custom_index)
+        self.latencies = []
+        self.received = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_message', self._on_message)
+        cookie = '; '.join(f'{name}={value}' for name, value in self.http.cookies.items())
+        self.sio.connect(base_url, headers={'Cookie': cookie}, transports=['websocket'])
+
+    def _on_message(self, data):
+        if data.get('sender_id') == self.user_id:
+            return
+        sent_at = float(data['content'].rsplit(':', 1)[1])
+        self.latencies.append(time.perf_counter() - sent_at)
+        self.received += 1
+
+def run_socket_benchmark(base_url, user_ids, clients, messages):
+    clients = min(clients, len(user_ids))
+    # custom_id là b{index} theo thứ tự seed, user_ids cũng tăng dần theo thứ tự đó
+    bench_clients = [BenchClient(base_url, user_ids[index], index) for index in range(clients)]
+    for index, client in enumerate(bench_clients):
+        for peer in (bench_clients[(index + 1) % clients], bench_clients[index - 1]):
+            client.sio.emit('join_chat', {'type': 'friend', 'id': peer.user_id})
+    time.sleep(0.5)
+
+    def send_all(index, client):
+        peer = bench_clients[(index + 1) % clients]
+        for number in range(messages):
+            client.sio.emit('send_message', {
+                'type': 'friend',
+                'id': peer.user_id,
+                'content': f'{client.user_id}:{number}:{time.perf_counter()}'
+            })
+
+    expected = clients * messages
+    started = time.perf_counter()
+    senders = [threading.Thread(target=send_all, args=(index, client)) for index, client in enumerate(bench_clients)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+
+    deadline = time.monotonic() + 30
+    while sum(client.received for client in bench_clients) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    delivered = sum(client.received for client in bench_clients)
+    latencies = [latency for client in bench_clients for latency in client.latencies]
+    for client in bench_clients:
+        client.sio.disconnect()
+    return {
+        'clients': clients,
+        'messages_sent': expected,
+        'messages_delivered': delivered,
+        'seconds': round(elapsed, 4),
+        'messages_per_sec': round(delivered / elapsed, 1),
+        'delivery_latency': percentiles(latencies)
+    }
+
+def run_rest_benchmarks(base_url, user_ids, group_ids, repeat):
+    http = login(base_url, 0)
+    endpoints = {
+        'history': f'/api/messages/history?friend_id={user_ids[1]}',
+        'history_page_2': None,
+        'conversations': '/api/messages/conversations',
+        'groups_list': '/api/groups/list',
+        'users_search': '/api/users/search?q=bench1',
+        'group_history': f'/api/groups/history?group_id={group_ids[0]}' if group_ids else None
+    }
+    # Trang thứ hai đọc database thay vì bộ đệm tin nhắn gần nhất
+    cursor = http.get(base_url + endpoints['history']).json().get('next_cursor')
+    if cursor:
+        endpoints['history_page_2'] = f"{endpoints['history']}&before={cursor}"
+
+    results = {}
+    for name, path in endpoints.items():
+        if path is None:
+            continue
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = http.get(base_url + path)
+            samples.append(time.perf_counter() - started)
+            response.raise_for_status()
+        results[name] = dict(percentiles(samples), bytes=len(response.content))
+    return results
+
+def start_server(app, socketio, port):
+    """Chạy server Socket.IO trong luồng nền và chờ nó nhận kết nối; trả về base URL."""
+    from src.main import start_presence
+    start_presence()
+    server = threading.Thread(target=socketio.run, args=(app,), kwargs={
+        'host': '127.0.0.1', 'port': port, 'log_output': False,
+        'use_reloader': False, 'allow_unsafe_werkzeug': True
+    }, daemon=True)
+    server.start()
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{base_url}/api/auth/me', timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    return base_url
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--friends', type=int, default=5, help='số bạn của mỗi người dùng')
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--group-size', type=int, default=50)
+    parser.add_argument('--history', type=int, default=2000, help='số tin nhắn trong cuộc trò chuyện đo lịch sử')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=20, help='số tin mỗi client gửi')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--output', help='ghi JSON kết quả vào file thay vì stdout')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    # Giới hạn tốc độ send_message theo người dùng không được chặn tải của benchmark
+    os.environ['SEND_RATE_PER_SEC'] = '1000000'
+    os.environ['SEND_RATE_BURST'] = '1000000'
+    from src.main import app, socketio, save_message
+
+    seeded_at = time.perf_counter()
+    user_ids, group_ids = seed(app, save_message, args.users, args.friends, args.groups, args.group_size, args.history)
+    seed_seconds = time.perf_counter() - seeded_at
+
+    base_url = start_server(app, socketio, args.port)
+
+    result = {
+        'config': vars(args),
+        'database_profile': app.config['DATABASE_PROFILE'],
+        'message_batching': app.config['MESSAGE_BATCH_ENABLED'],
+        'seed_seconds': round(seed_seconds, 3),
+        'rest': run_rest_benchmarks(base_url, user_ids, group_ids, args.repeat),
+        'socket': run_socket_benchmark(base_url, user_ids, args.clients, args.messages)
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Đo độ trễ tin nhắn Socket.IO khi có bão đăng nhập (băm mật khẩu scrypt trên pool giới hạn).
+
+    pip install "python-socketio[client]" requests
+    python src/bench_login_storm.py --seconds 10 --login-threads 32 --rate 50
+
+Harness (dùng chung với bench_load.py) seed người dùng trên database tạm,
+chạy server trong cùng tiến trình rồi cho hai client Socket.IO gửi tin cho
+nhau đều đặn --rate tin/giây. Độ trễ gửi -> nhận được đo trong hai pha cùng
+độ dài: yên tĩnh, và trong khi --login-threads luồng liên tục gọi
+/api/auth/login (mật khẩu đã được băm nên mỗi lần đều chạy scrypt). In ra JSON
+gồm p50/p95/p99 của từng pha, số lần đăng nhập thành công và số bị từ chối 503.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.bench_load import PASSWORD, BenchClient, percentiles, seed, start_server
+
+try:
+    import requests
+except ImportError as e:
+    raise RuntimeError('Benchmark cần client: pip install "python-socketio[client]" requests') from e
+
+def measure_latency(sender, receiver, rate, seconds):
+    receiver.latencies = []
+    interval = 1.0 / rate
+    deadline = time.perf_counter() + seconds
+    number = 0
+    while time.perf_counter() < deadline:
+        sender.sio.emit('send_message', {
+            'type': 'friend',
+            'id': receiver.user_id,
+            'content': f'{sender.user_id}:{number}:{time.perf_counter()}'
+        })
+        number += 1
+        time.sleep(interval)
+    time.sleep(1.0)
+    return dict(percentiles(receiver.latencies), sent=number)
+
+def login_storm(base_url, user_count, stop, counts, lock):
+    http = requests.Session()
+    index = 0
+    while not stop.is_set():
+        response = http.post(f'{base_url}/api/auth/login', json={
+            'username': f'b{2 + index % user_count}',
+            'password': PASSWORD
+        })
+        with lock:
+            counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        index += 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=50.0, help='số tin nhắn mỗi giây trong lúc đo')
+    parser.add_argument('--login-threads', type=int, default=32)
+    parser.add_argument('--port', type=int, default=5098)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'storm.db')}"
+    # Giới hạn tốc độ send_message theo người dùng không được chặn tải của benchmark
+    os.environ['SEND_RATE_PER_SEC'] = '1000000'
+    os.environ['SEND_RATE_BURST'] = '1000000'
+    from src.main import app, socketio, save_message
+    from src.passwords import password_hasher
+
+    user_ids, _ = seed(app, save_message, args.users, 1, 0, 0, 0)
+    base_url = start_server(app, socketio, args.port)
+
+    # Lần đăng nhập đầu tiên chuyển mật khẩu thô sang scrypt
+    for index in range(args.users):
+        requests.post(f'{base_url}/api/auth/login', json={'username': f'b{index}', 'password': PASSWORD})
+
+    sender = BenchClient(base_url, user_ids[0], 0)
+    receiver = BenchClient(base_url, user_ids[1], 1)
+    for client, peer in ((sender, receiver), (receiver, sender)):
+        client.sio.emit('join_chat', {'type': 'friend', 'id': peer.user_id})
+    time.sleep(0.5)
+
+    quiet = measure_latency(sender, receiver, args.rate, args.seconds)
+
+    stop = threading.Event()
+    counts = {}
+    lock = threading.Lock()
+    stormers = [
+        threading.Thread(target=login_storm, args=(base_url, args.users - 2, stop, counts, lock), daemon=True)
+        for _ in range(args.login_threads)
+    ]
+    started = time.perf_counter()
+    for stormer in stormers:
+        stormer.start()
+    storm = measure_latency(sender, receiver, args.rate, args.seconds)
+    stop.set()
+    for stormer in stormers:
+        stormer.join()
+    storm_seconds = time.perf_counter() - started
+
+    sender.sio.disconnect()
+    receiver.sio.disconnect()
+    print(json.dumps({
+        'config': vars(args),
+        'hasher': password_hasher.stats(),
+        'quiet': quiet,
+        'login_storm': storm,
+        'logins_ok': counts.get(200, 0),
+        'logins_shed': counts.get(503, 0),
+        'logins_per_sec': round(counts.get(200, 0) / storm_seconds, 1)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark thông lượng giao tin nhóm qua message bus theo số worker.
+
+    pip install "python-socketio[client]" requests
+    python src/bench_message_bus.py --workers 1 2 4 --clients 200 --messages 500 --rate 200
+
+Với mỗi số worker, harness seed một database tạm (một nhóm gồm mọi client),
+chạy các worker thật bằng cluster.py (main.py + BusManager trên Unix socket
+bus) rồi chia --clients client Socket.IO đều cho các worker, tất cả tham gia
+phòng nhóm. Một client gửi --messages tin với tốc độ --rate tin/giây; mỗi tin
+phải đến mọi client nên số lượt giao kỳ vọng là messages * clients. Ghi nhận
+số lượt giao thực tế, số lượt bị mất (không đến trong --timeout giây), thông
+lượng giao và độ trễ gửi -> nhận. Mỗi cấu hình in một dòng JSON.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.bench_load import percentiles, login, seed
+
+try:
+    import requests
+    import socketio
+except ImportError as e:
+    raise RuntimeError('Benchmark cần client: pip install "python-socketio[client]" requests') from e
+
+GROUP_ID = 1
+
+class Receiver:
+    def __init__(self, base_url, index):
+        self.received = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+        http = login(base_url, index)
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_message', lambda data: self._receive([data]))
+        self.sio.on('new_messages', lambda data: self._receive(data['messages']))
+        cookie = '; '.join(f'{name}={value}' for name, value in http.cookies.items())
+        self.sio.connect(base_url, headers={'Cookie': cookie}, transports=['websocket'])
+        self.sio.emit('join_chat', {'type': 'group', 'id': GROUP_ID})
+
+    def _receive(self, messages):
+        now = time.perf_counter()
+        with self._lock:
+            self.received += len(messages)
+            for data in messages:
+                self.latencies.append(now - float(data['content'].rsplit(':', 1)[1]))
+
+def seed_database(users):
+    from src.main import app, save_message
+    # Database mới nên nhóm duy nhất có id GROUP_ID, gồm tất cả người dùng
+    seed(app, save_message, users, 1, 1, users, 0)
+
+def wait_ready(base_url):
+    for _ in range(600):
+        try:
+            requests.get(f'{base_url}/api/auth/me', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Worker at {base_url} did not start')
+
+def run(workers, args):
+    directory = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bus.db')}",
+        SEND_RATE_PER_SEC='1000000',
+        SEND_RATE_BURST='1000000',
+        OUTBOUND_QUEUE_MAX_FRAMES='1000000',
+        METRICS_ENABLED='0'
+    )
+    users = args.clients + 1
+    subprocess.run([sys.executable, __file__, '--seed', str(users)], env=env, check=True, stdout=subprocess.DEVNULL)
+
+    cluster = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(__file__), 'cluster.py'),
+        '--workers', str(workers), '--base-port', str(args.base_port),
+        '--bus-path', os.path.join(directory, 'bus.sock')
+    ], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        urls = [f'http://127.0.0.1:{args.base_port + index}' for index in range(workers)]
+        for url in urls:
+            wait_ready(url)
+
+        # custom_id b0 là người gửi, các client nhận được chia đều cho các worker
+        receivers = [Receiver(urls[index % workers], index + 1) for index in range(args.clients)]
+        sender = Receiver(urls[0], 0)
+        time.sleep(1.0)
+
+        expected = args.messages * args.clients
+        interval = 1.0 / args.rate
+        started = time.perf_counter()
+        for number in range(args.messages):
+            sender.sio.emit('send_message', {
+                'type': 'group', 'id': GROUP_ID, 'content': f'{number}:{time.perf_counter()}'
+            })
+            time.sleep(interval)
+        deadline = time.monotonic() + args.timeout
+        while sum(receiver.received for receiver in receivers) < expected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        delivered = sum(receiver.received for receiver in receivers)
+        latencies = [latency for receiver in receivers for latency in receiver.latencies]
+        for client in receivers + [sender]:
+            client.sio.disconnect()
+        return {
+            'workers': workers,
+            'clients': args.clients,
+            'messages': args.messages,
+            'expected_deliveries': expected,
+            'deliveries': delivered,
+            'dropped': expected - delivered,
+            'seconds': round(elapsed, 4),
+            'deliveries_per_sec': round(delivered / elapsed, 1),
+            'delivery_latency': percentiles(latencies)
+        }
+    finally:
+        # SIGINT để cluster.py dừng các worker và broker của nó
+        cluster.send_signal(signal.SIGINT)
+        cluster.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=200.0, help='số tin gửi mỗi giây')
+    parser.add_argument('--timeout', type=float, default=30.0, help='thời gian chờ các lượt giao còn thiếu')
+    parser.add_argument('--base-port', type=int, default=5201)
+    parser.add_argument('--seed', type=int, metavar='USERS', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed_database(args.seed)
+        return
+
+    for workers in args.workers:
+        print(json.dumps(run(workers, args)), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""So sánh bytes/s và bộ nhớ đỉnh (RSS) khi trả lịch sử 100k tin nhắn: list + jsonify so với stream.
+
+    python src/bench_streaming.py --messages 100000
+
+Tạo database SQLite tạm với một cuộc trò chuyện --messages tin nhắn, sau đó
+chạy mỗi chế độ trong một tiến trình riêng để RSS đỉnh không ảnh hưởng lẫn nhau:
+- list: query.all() + jsonify cả danh sách (cách làm trước đây)
+- stream: GET /api/messages/history?stream=1 (yield_per + ghi dần), backend json
+- stream-orjson: như trên với JSON_BACKEND=orjson (bỏ qua nếu chưa cài orjson)
+Mỗi chế độ in một dòng JSON.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+def _rss_mb():
+    # ru_maxrss tính bằng KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def seed(messages):
+    from src.main import app
+    from src.models.user import User, Message, db
+
+    with app.app_context():
+        alice = User(username='stream_a', password='bench', custom_id='stream_a')
+        bob = User(username='stream_b', password='bench', custom_id='stream_b')
+        db.session.add_all([alice, bob])
+        db.session.commit()
+        for start in range(0, messages, 5000):
+            db.session.add_all([
+                Message(
+                    sender_id=alice.id if index % 2 == 0 else bob.id,
+                    receiver_id=bob.id if index % 2 == 0 else alice.id,
+                    content=f'message {index} ' + 'x' * 80
+                ) for index in range(start, min(start + 5000, messages))
+            ])
+            db.session.commit()
+        return alice.id, bob.id
+
+def run_mode(mode, user_id, friend_id):
+    from src.main import app
+    from src.models.user import Message
+    from src.models.indexes import private_conversation_key
+    from src.database import read_session
+    from src.sync import message_payload
+    from flask import jsonify
+
+    baseline = _rss_mb()
+    started = time.perf_counter()
+    total = 0
+    if mode == 'list':
+        with app.test_request_context():
+            rows = read_session.query(Message).filter(
+                Message.conversation_key == private_conversation_key(user_id, friend_id)
+            ).order_by(Message.id.asc()).all()
+            total = len(jsonify({'success': True, 'messages': [message_payload(row) for row in rows]}).get_data())
+    else:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        response = client.get(f'/api/messages/history?friend_id={friend_id}&stream=1', buffered=False)
+        for chunk in response.response:
+            total += len(chunk)
+        response.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'mode': mode,
+        'json_backend': app.config['JSON_BACKEND'],
+        'bytes': total,
+        'seconds': round(elapsed, 4),
+        'mb_per_sec': round(total / elapsed / 1e6, 2),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(_rss_mb(), 1),
+        'peak_rss_growth_mb': round(_rss_mb() - baseline, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'USER_ID', 'FRIEND_ID'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, user_id, friend_id = args.child
+        print(json.dumps(run_mode(mode, int(user_id), int(friend_id))))
+        return
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stream.db')}"
+    os.environ['METRICS_ENABLED'] = '0'
+    user_id, friend_id = seed(args.messages)
+
+    try:
+        import orjson  # noqa: F401
+        modes = ['list', 'stream', 'stream-orjson']
+    except ImportError:
+        modes = ['list', 'stream']
+
+    for mode in modes:
+        env = dict(os.environ, JSON_BACKEND='orjson' if mode.endswith('orjson') else 'json')
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', mode.split('-')[0], str(user_id), str(friend_id)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        print(output.strip().splitlines()[-1], flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import or_
+from src.models.user import User, Group, GroupMember, Friendship
+import src.models.columns  # Group.deleted_at
+from src.database import read_session
+
+class LRUCache:
+    """Cache LRU có giới hạn kích thước và thời gian sống (TTL), an toàn đa luồng.
+
+    Nạp giá trị khi miss: lấy generation(key) trước khi đọc database rồi truyền
+    vào set(); nếu invalidate(key) xảy ra trong lúc đọc, set() bỏ qua giá trị cũ.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # key -> số thứ tự của lần invalidate gần nhất (giới hạn maxsize key gần nhất)
+        self._generations = OrderedDict()
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                # Bị invalidate sau khi giá trị được đọc: không lưu giá trị cũ
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._counter += 1
+            self._generations[key] = self._counter
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                self._generations.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+# Khi chạy nhiều worker, hàm này phát sự kiện invalidate sang các worker khác (xem message_bus)
+_invalidation_publisher = None
+
+def set_invalidation_publisher(publisher):
+    """Đăng ký hàm publisher(cache_name, key) được gọi mỗi khi một cache bị invalidate."""
+    global _invalidation_publisher
+    _invalidation_publisher = publisher
+
+def _publish_invalidation(cache_name, key):
+    if _invalidation_publisher is not None:
+        _invalidation_publisher(cache_name, key)
+
+class MembershipCache:
+    """Cache danh sách thành viên theo nhóm: group_id -> frozenset(user_id).
+
+    Các route thay đổi thành viên phải gọi invalidate(group_id) sau khi commit.
+    """
+
+    def __init__(self, maxsize=4096, ttl=300.0):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_members(self, group_id):
+        group_id = int(group_id)
+        members = self._cache.get(group_id)
+        if members is None:
+            generation = self._cache.generation(group_id)
+            # Nhóm đã ẩn chờ xóa không còn thành viên, dù các dòng GroupMember chưa được dọn
+            rows = read_session.query(GroupMember.user_id).join(Group, Group.id == GroupMember.group_id).filter(
+                GroupMember.group_id == group_id, Group.deleted_at.is_(None)
+            ).all()
+            members = frozenset(user_id for (user_id,) in rows)
+            self._cache.set(group_id, members, generation)
+        return members
+
+    def is_member(self, group_id, user_id):
+        # group_id đến từ payload socket nên có thể thiếu hoặc không phải số
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
+            return False
+        return user_id in self.get_members(group_id)
+
+    def invalidate(self, group_id, publish=True):
+        self._cache.invalidate(int(group_id))
+        if publish:
+            _publish_invalidation('group_members', int(group_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+class ProfileCache:
+    """Cache hồ sơ người dùng: user_id -> user.to_dict() (username, custom_id, avatar_url...).
+
+    Dùng cho thông tin người gửi và danh sách bạn bè; auth phải gọi
+    invalidate(user_id) khi hồ sơ thay đổi.
+    """
+
+    def __init__(self, maxsize=16384, ttl=600.0):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(int(user_id))
+
+    def get_many(self, user_ids):
+        """Trả về dict user_id -> hồ sơ; các id không tồn tại bị bỏ qua. Chỉ một truy vấn cho các id bị miss."""
+        profiles = {}
+        missing = []
+        for user_id in {int(user_id) for user_id in user_ids}:
+            profile = self._cache.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles[user_id] = profile
+        if missing:
+            generations = {user_id: self._cache.generation(user_id) for user_id in missing}
+            for user in read_session.query(User).filter(User.id.in_(missing)).all():
+                profile = user.to_dict()
+                self._cache.set(user.id, profile, generations[user.id])
+                profiles[user.id] = profile
+        return {user_id: dict(profile) for user_id, profile in profiles.items()}
+
+    def invalidate(self, user_id, publish=True):
+        self._cache.invalidate(int(user_id))
+        if publish:
+            _publish_invalidation('profiles', int(user_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+class GroupNameCache:
+    """Cache tên nhóm: group_id -> name (None nếu nhóm không tồn tại hoặc đã ẩn chờ xóa).
+
+    Route xóa nhóm phải gọi invalidate(group_id).
+    """
+
+    def __init__(self, maxsize=4096, ttl=600.0):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, group_id):
+        group_id = int(group_id)
+        name = self._cache.get(group_id)
+        if name is None:
+            generation = self._cache.generation(group_id)
+            group = read_session.get(Group, group_id)
+            if not group or group.deleted_at is not None:
+                return None
+            name = group.name
+            self._cache.set(group_id, name, generation)
+        return name
+
+    def invalidate(self, group_id, publish=True):
+        self._cache.invalidate(int(group_id))
+        if publish:
+            _publish_invalidation('group_names', int(group_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+class FriendCache:
+    """Cache danh sách bạn bè đã chấp nhận: user_id -> frozenset(friend_id).
+
+    Dùng để gửi thay đổi trạng thái online; accept_friend phải gọi
+    invalidate() cho cả hai người sau khi commit.
+    """
+
+    def __init__(self, maxsize=16384, ttl=300.0):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_friends(self, user_id):
+        user_id = int(user_id)
+        friends = self._cache.get(user_id)
+        if friends is None:
+            generation = self._cache.generation(user_id)
+            rows = read_session.query(Friendship.user_id1, Friendship.user_id2).filter(
+                Friendship.status == 'accepted',
+                or_(Friendship.user_id1 == user_id, Friendship.user_id2 == user_id)
+            ).all()
+            friends = frozenset(user_id2 if user_id1 == user_id else user_id1 for user_id1, user_id2 in rows)
+            self._cache.set(user_id, friends, generation)
+        return friends
+
+    def invalidate(self, user_id, publish=True):
+        self._cache.invalidate(int(user_id))
+        if publish:
+            _publish_invalidation('friends', int(user_id))
+
+    def stats(self):
+        return self._cache.stats()
+
+group_members = MembershipCache()
+profiles = ProfileCache()
+group_names = GroupNameCache()
+friend_lists = FriendCache()
+
+CACHES = {
+    'group_members': group_members,
+    'profiles': profiles,
+    'group_names': group_names,
+    'friends': friend_lists
+}
+
+def apply_remote_invalidation(cache_name, key):
+    """Invalidate cục bộ theo sự kiện nhận từ worker khác (không phát lại)."""
+    cache = CACHES.get(cache_name)
+    if cache is not None:
+        cache.invalidate(key, publish=False)
@@ -0,0 +1,138 @@
+"""Kiểm tra phân trang lịch sử qua ranh giới database (hot) và kho lưu trữ.
+
+    python src/check_archive_history.py --messages 300 --archived 120
+
+Harness tạo database SQLite và ARCHIVE_DIR tạm, ghi --messages tin nhắn cho
+một cuộc trò chuyện riêng và một nhóm, rồi chuyển --archived tin đầu tiên
+(theo id) vào kho với khối nhỏ --block-messages để trang đi qua nhiều khối.
+Với mỗi cuộc trò chuyện và mỗi limit, load_history_page được duyệt:
+- lùi từ trang mới nhất theo before, kể cả limit bằng đúng số tin còn trong
+  database (limit - len(payloads) == 0 ở ranh giới);
+- tiến theo after từ 0 và từ các id nằm trong kho (after < archived_up_to),
+  kể cả trang kết thúc đúng ở tin cuối cùng đã lưu trữ;
+mỗi lần duyệt phải trả về đủ các id, tăng dần, không trùng, không trang nào
+quá limit tin, rồi next_cursor None.
+In một dòng JSON; thoát với mã 1 nếu có sai lệch.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+def walk_before(load, key, limit):
+    """Các id của mọi trang khi lùi từ trang mới nhất, và số tin lớn nhất trong một trang."""
+    ids = []
+    largest = 0
+    before = None
+    for _ in range(100000):
+        payloads, next_cursor = load(key, before=before, limit=limit)
+        ids[:0] = [payload['id'] for payload in payloads]
+        largest = max(largest, len(payloads))
+        if next_cursor is None:
+            return ids, largest
+        before = next_cursor
+    raise RuntimeError('Pagination did not terminate')
+
+def walk_after(load, key, after, limit):
+    ids = []
+    largest = 0
+    for _ in range(100000):
+        payloads, next_cursor = load(key, after=after, limit=limit)
+        ids.extend(payload['id'] for payload in payloads)
+        largest = max(largest, len(payloads))
+        if next_cursor is None:
+            return ids, largest
+        after = next_cursor
+    raise RuntimeError('Pagination did not terminate')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=300, help='số tin mỗi cuộc trò chuyện')
+    parser.add_argument('--archived', type=int, default=120, help='số tin đầu tiên của mỗi cuộc trò chuyện được lưu trữ')
+    parser.add_argument('--block-messages', type=int, default=16)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'check.db')}"
+    os.environ['ARCHIVE_DIR'] = os.path.join(directory, 'archive')
+    from src.main import app, save_message
+    from src.models.user import User, Group, GroupMember, Message, db
+    from src.models.indexes import private_conversation_key, group_conversation_key
+    from src.archive import message_archive, archive_cold_messages
+    from src.recent_messages import recent_messages, load_history_page
+
+    message_archive.block_messages = args.block_messages
+    with app.app_context():
+        db.session.add_all([User(username=f'check{index}', password='check', custom_id=f'c{index}') for index in range(2)])
+        db.session.commit()
+        first, second = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id).all()]
+        group = Group(name='check group', creator_id=first)
+        db.session.add(group)
+        db.session.flush()
+        db.session.add_all([GroupMember(group_id=group.id, user_id=user_id) for user_id in (first, second)])
+        db.session.commit()
+        keys = [private_conversation_key(first, second), group_conversation_key(group.id)]
+
+        for index in range(args.messages):
+            save_message({'sender_id': first, 'receiver_id': second, 'content': f'private {index}'})
+            save_message({'sender_id': second, 'group_id': group.id, 'content': f'group {index}'})
+
+        # Đoạn đầu theo id của bảng là tin cũ: archive_cold_messages chuyển đúng đoạn đó
+        cutoff = db.session.query(Message.id).order_by(Message.id).offset(args.archived * 2 - 1).limit(1).scalar()
+        db.session.query(Message).filter(Message.id <= cutoff).update(
+            {Message.timestamp: datetime.utcnow() - timedelta(days=365)}, synchronize_session=False
+        )
+        db.session.commit()
+        archive_cold_messages(30, batch_size=50)
+
+        checks = 0
+        failures = []
+        for key in keys:
+            archived = [payload['id'] for payload in message_archive.iter_messages(key)]
+            hot = [message_id for (message_id,) in db.session.query(Message.id).filter(
+                Message.conversation_key == key
+            ).order_by(Message.id).all()]
+            expected = archived + hot
+            archived_up_to = message_archive.last_id(key)
+
+            # limit = len(hot): trang đầu lấy hết database, phần kho còn lại là 0 tin
+            limits = sorted({1, 7, args.block_messages, len(hot), len(hot) + 1, len(archived), len(expected) + 5} - {0})
+            # after trong kho: trước tin đầu tiên, tin đầu tiên, giữa kho và ngay trước archived_up_to
+            starts = sorted({0, archived[0], archived[len(archived) // 2], archived[-1] - 1} if archived else {0})
+            for limit in limits:
+                for cached in (False, True):
+                    if not cached:
+                        recent_messages.drop(key)
+                    walks = [('before', None, walk_before(load_history_page, key, limit))]
+                    walks += [('after', after, walk_after(load_history_page, key, after, limit)) for after in starts]
+                    for direction, after, (ids, largest) in walks:
+                        checks += 1
+                        wanted = [message_id for message_id in expected if after is None or message_id > after]
+                        if ids != wanted or largest > limit:
+                            failures.append({'key': key, 'direction': direction, 'after': after, 'limit': limit,
+                                             'cached': cached, 'got': len(ids), 'expected': len(wanted),
+                                             'largest_page': largest})
+            # after nằm trong kho với trang vừa khít phần còn lại của kho
+            if len(archived) > 1:
+                after = archived[len(archived) // 2]
+                remaining = len([message_id for message_id in archived if message_id > after])
+                payloads, next_cursor = load_history_page(key, after=after, limit=remaining)
+                checks += 1
+                if [payload['id'] for payload in payloads] != archived[archived.index(after) + 1:] \
+                        or next_cursor != (archived_up_to if hot else None):
+                    failures.append({'key': key, 'direction': 'after', 'after': after, 'limit': remaining,
+                                     'case': 'archive page ends at archived_up_to', 'next_cursor': next_cursor})
+
+    print(json.dumps({
+        'conversations': len(keys),
+        'archived_per_conversation': args.archived,
+        'checks': checks,
+        'failures': failures
+    }))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.message_bus import run_broker
+
+def main():
+    parser = argparse.ArgumentParser(description='Chạy nhiều worker Socket.IO dùng chung message bus trên Unix socket')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--base-port', type=int, default=5001)
+    parser.add_argument('--bus-path', default='/tmp/chat-app-bus.sock')
+    args = parser.parse_args()
+
+    broker = multiprocessing.Process(target=run_broker, args=(args.bus_path,), daemon=True)
+    broker.start()
+    while not os.path.exists(args.bus_path):
+        time.sleep(0.05)
+
+    workers = []
+    for index in range(args.workers):
+        env = dict(
+            os.environ,
+            PORT=str(args.base_port + index),
+            SOCKETIO_MESSAGE_BUS=f'unix:{args.bus_path}'
+        )
+        workers.append(subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), 'main.py')], env=env))
+        print(f'Worker {index} listening on port {args.base_port + index}')
+
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        broker.terminate()
+
+if __name__ == '__main__':
+    main()
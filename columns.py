@@ -0,0 +1,17 @@
+"""Các cột được thêm sau vào model gốc trong src/models/user.py.
+
+Khai báo tập trung ở đây (chỉ phụ thuộc src.models.user) để cột tồn tại trên
+model bất kể thứ tự import; phần migration/backfill cho database cũ nằm ở
+module tương ứng (indexes, sequence, group_deletion).
+"""
+from src.models.user import db, Group, Message
+
+# Khóa cuộc trò chuyện được lưu sẵn để lịch sử riêng chỉ cần một khoảng chỉ mục
+# thay vì OR của hai cặp (sender, receiver); xem ensure_indexes
+Message.conversation_key = db.Column(db.String(40), nullable=True)
+
+# Số thứ tự tăng dần theo từng cuộc trò chuyện, để client phát hiện tin nhắn bị lỡ; xem ensure_sequences
+Message.seq = db.Column(db.Integer, nullable=True)
+
+# Nhóm đang chờ xóa bị ẩn ngay: mọi truy vấn nhóm/thành viên phải lọc deleted_at IS NULL; xem ensure_group_deletion
+Group.deleted_at = db.Column(db.DateTime, nullable=True)
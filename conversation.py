@@ -0,0 +1,92 @@
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert
+from src.models.user import db, Message
+
+SNIPPET_LENGTH = 100
+
+class ConversationSummary(db.Model):
+    """Bảng tóm tắt cuộc trò chuyện riêng, mỗi người dùng một dòng cho mỗi người bạn.
+
+    Được cập nhật cùng transaction với tin nhắn mới để /api/messages/conversations
+    chỉ cần đọc một chỉ mục thay vì quét toàn bộ bảng Message.
+    """
+    __tablename__ = 'conversation_summary'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    last_sender_id = db.Column(db.Integer, nullable=False)
+    last_message_snippet = db.Column(db.String(SNIPPET_LENGTH), nullable=False, default='')
+    last_message_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'peer_id', name='uq_conversation_summary_user_peer'),
+        db.Index('ix_conversation_summary_user_last', 'user_id', 'last_message_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.last_message_id,
+            'sender_id': self.last_sender_id,
+            'receiver_id': self.peer_id if self.last_sender_id == self.user_id else self.user_id,
+            'content': self.last_message_snippet,
+            'timestamp': self.last_message_at.isoformat()
+        }
+
+def _upsert_summary(session, user_id, peer_id, message):
+    values = {
+        'user_id': user_id,
+        'peer_id': peer_id,
+        'last_message_id': message.id,
+        'last_sender_id': message.sender_id,
+        'last_message_snippet': message.content[:SNIPPET_LENGTH],
+        'last_message_at': message.timestamp or datetime.utcnow()
+    }
+    stmt = insert(ConversationSummary).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'peer_id'],
+        set_={
+            'last_message_id': stmt.excluded.last_message_id,
+            'last_sender_id': stmt.excluded.last_sender_id,
+            'last_message_snippet': stmt.excluded.last_message_snippet,
+            'last_message_at': stmt.excluded.last_message_at
+        }
+    )
+    session.execute(stmt)
+
+def record_private_message(message, session=None):
+    """Cập nhật tóm tắt cho cả người gửi và người nhận.
+
+    Phải gọi sau flush() (cần message.id) và trước commit, trên cùng session
+    với tin nhắn (mặc định là db.session).
+    """
+    if session is None:
+        session = db.session
+    _upsert_summary(session, message.sender_id, message.receiver_id, message)
+    _upsert_summary(session, message.receiver_id, message.sender_id, message)
+
+def backfill_conversation_summaries():
+    """Dựng bảng tóm tắt từ bảng Message cho database cũ (chỉ chạy khi bảng còn trống)."""
+    if db.session.query(ConversationSummary.id).first() is not None:
+        return
+
+    message_table = Message.__tablename__
+    db.session.execute(db.text(f"""
+        INSERT INTO conversation_summary
+            (user_id, peer_id, last_message_id, last_sender_id,
+             last_message_snippet, last_message_at)
+        SELECT c.user_id, c.peer_id, m.id, m.sender_id,
+               substr(m.content, 1, {SNIPPET_LENGTH}), m.timestamp
+        FROM (
+            SELECT user_id, peer_id, max(id) AS last_id FROM (
+                SELECT sender_id AS user_id, receiver_id AS peer_id, id
+                FROM {message_table} WHERE receiver_id IS NOT NULL
+                UNION ALL
+                SELECT receiver_id AS user_id, sender_id AS peer_id, id
+                FROM {message_table} WHERE receiver_id IS NOT NULL
+            ) GROUP BY user_id, peer_id
+        ) c
+        JOIN {message_table} m ON m.id = c.last_id
+    """))
+    db.session.commit()
@@ -0,0 +1,64 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from src.models.user import db
+
+# Session chỉ đọc cho các endpoint lịch sử, tìm kiếm, bạn bè và danh sách nhóm.
+# Ở profile production nó dùng pool kết nối riêng (query_only) để không phải chờ kết nối ghi.
+read_session = scoped_session(sessionmaker())
+
+COMMON_PRAGMAS = {
+    'busy_timeout': 5000,
+    'cache_size': -65536,  # 64 MB
+    'mmap_size': 268435456,  # 256 MB
+    'temp_store': 'MEMORY'
+}
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return set_pragmas
+
+def init_database(app):
+    """Khởi tạo db cho app theo DATABASE_PROFILE.
+
+    - 'default': cấu hình SQLite mặc định, read_session dùng chung engine với db.
+    - 'production': WAL + pragma tối ưu, engine ghi chỉ một kết nối
+      (SQLITE_WRITER_POOL_SIZE) và pool kết nối chỉ đọc riêng (SQLITE_READER_POOL_SIZE).
+    """
+    production = app.config.get('DATABASE_PROFILE') == 'production'
+    if production:
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update({
+            'pool_size': app.config.get('SQLITE_WRITER_POOL_SIZE', 1),
+            'max_overflow': 0,
+            'pool_timeout': 30
+        })
+
+    db.init_app(app)
+
+    with app.app_context():
+        if production:
+            event.listen(db.engine, 'connect', _pragma_listener({
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                **COMMON_PRAGMAS
+            }))
+            read_engine = create_engine(
+                app.config['SQLALCHEMY_DATABASE_URI'],
+                pool_size=app.config.get('SQLITE_READER_POOL_SIZE', 8),
+                max_overflow=0,
+                pool_timeout=30
+            )
+            event.listen(read_engine, 'connect', _pragma_listener({
+                **COMMON_PRAGMAS,
+                'query_only': 'ON'
+            }))
+            read_session.configure(bind=read_engine)
+        else:
+            read_session.configure(bind=db.engine)
+
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        read_session.remove()
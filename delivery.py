@@ -0,0 +1,91 @@
+import math
+import threading
+import time
+
+class RoomBatcher:
+    """Gom các new_message của cùng một phòng thành một gói new_messages.
+
+    Cửa sổ gom thích ứng theo lưu lượng của phòng, ước lượng số tin/giây suy
+    giảm theo thời gian: rate = rate * exp(-elapsed / tau) + 1 / tau ở mỗi tin,
+    nên phòng im lặng sau một đợt dồn dập nhanh chóng được coi là yên tĩnh lại:
+    - phòng yên tĩnh (dưới busy_rate tin/giây) và không có tin đang chờ: gửi
+      new_message ngay, không thêm độ trễ;
+    - phòng bận: tin được giữ tối đa window = min(max_window, target_batch / rate)
+      rồi gửi một lần, nên lưu lượng càng cao thì mỗi gói càng gần target_batch tin.
+    emit(event, payload, room), spawn(fn, *args) và sleep(seconds) do server cung cấp.
+    """
+
+    def __init__(self, emit, spawn, sleep=time.sleep, max_window_ms=10, target_batch=8, busy_rate=50.0,
+                 rate_tau_ms=500):
+        self.emit = emit
+        self.spawn = spawn
+        self.sleep = sleep
+        self.max_window = max_window_ms / 1000.0
+        self.target_batch = target_batch
+        self.busy_rate = busy_rate
+        self.rate_tau = rate_tau_ms / 1000.0
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.messages = 0
+
+    def add(self, room, payload):
+        now = time.monotonic()
+        with self._lock:
+            state = self._rooms.get(room)
+            if state is None:
+                state = self._rooms[room] = {'last': now, 'rate': 0.0, 'pending': []}
+            state['rate'] = self._decayed_rate(state, now) + 1.0 / self.rate_tau
+            state['last'] = now
+            self.messages += 1
+
+            if state['pending']:
+                state['pending'].append(payload)
+                return
+            if state['rate'] < self.busy_rate:
+                self.frames += 1
+                send_now = True
+            else:
+                state['pending'].append(payload)
+                window = min(self.max_window, self.target_batch / state['rate'])
+                send_now = False
+            if len(self._rooms) > 10000:
+                self._prune(now)
+
+        if send_now:
+            self.emit('new_message', payload, room)
+        else:
+            self.spawn(self._flush_after, room, window)
+
+    def _decayed_rate(self, state, now):
+        return state['rate'] * math.exp(-(now - state['last']) / self.rate_tau)
+
+    def _prune(self, now):
+        for room, state in list(self._rooms.items()):
+            if not state['pending'] and now - state['last'] > 60:
+                del self._rooms[room]
+
+    def _flush_after(self, room, window):
+        self.sleep(window)
+        with self._lock:
+            state = self._rooms.get(room)
+            if state is None or not state['pending']:
+                return
+            messages, state['pending'] = state['pending'], []
+            self.frames += 1
+        if len(messages) == 1:
+            self.emit('new_message', messages[0], room)
+        else:
+            self.emit('new_messages', {'conversation': room, 'messages': messages}, room)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'busy_rooms': sum(1 for state in self._rooms.values()
+                                  if self._decayed_rate(state, now) >= self.busy_rate),
+                'messages': self.messages,
+                'frames': self.frames,
+                'messages_per_frame': self.messages / self.frames if self.frames else 0.0
+            }
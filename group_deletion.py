@@ -0,0 +1,180 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from src.models.user import db, Group, GroupMember, Message
+import src.models.columns  # Group.deleted_at
+from src.models.indexes import group_conversation_key
+from src.models.sequence import ConversationSequence
+from src.models.read_state import ReadCursor
+from src.archive import message_archive
+
+class GroupDeletionJob(db.Model):
+    """Tiến trình xóa một nhóm ở nền: pending -> running -> done (hoặc failed)."""
+    __tablename__ = 'group_deletion_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, nullable=False, index=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    messages_total = db.Column(db.Integer, nullable=False, default=0)
+    messages_deleted = db.Column(db.Integer, nullable=False, default=0)
+    members_deleted = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'status': self.status,
+            'messages_total': self.messages_total,
+            'messages_deleted': self.messages_deleted,
+            'members_deleted': self.members_deleted,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+def active_group(group_id):
+    """Nhóm chưa bị xóa, hoặc None."""
+    group = db.session.get(Group, group_id)
+    if group is None or group.deleted_at is not None:
+        return None
+    return group
+
+class GroupPurger:
+    """Xóa dữ liệu của các nhóm đã ẩn theo từng khối nhỏ trên một luồng nền.
+
+    Mỗi khối (chunk_size dòng) là một transaction ngắn, kèm cập nhật tiến độ
+    của job; giữa hai khối luồng nghỉ pause giây để các lượt ghi khác lấy được
+    khóa ghi của SQLite. Thứ tự: thành viên, tin nhắn, read cursor, rồi kho lưu
+    trữ, bộ đếm seq và chính nhóm. Job chưa xong được tiếp tục khi khởi động lại.
+    notify(group_id, member_ids) do server đặt để báo cho thành viên và đóng phòng.
+    """
+
+    def __init__(self, chunk_size=500, pause_ms=20):
+        self.chunk_size = chunk_size
+        self.pause = pause_ms / 1000.0
+        self.notify = None
+        self.app = None
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.chunks = 0
+
+    def start(self, app):
+        self.app = app
+        if self._thread is None:
+            with app.app_context():
+                for (job_id,) in db.session.query(GroupDeletionJob.id).filter(
+                    GroupDeletionJob.status != 'done'
+                ).order_by(GroupDeletionJob.id).all():
+                    self._queue.put(job_id)
+            self._thread = threading.Thread(target=self._run, name='group-purge', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def request(self, group, user_id, member_ids=()):
+        """Ẩn nhóm và tạo job trong một transaction ngắn, rồi đưa job vào hàng đợi."""
+        group.deleted_at = datetime.utcnow()
+        job = GroupDeletionJob(
+            group_id=group.id,
+            requested_by=user_id,
+            messages_total=db.session.query(db.func.count(Message.id)).filter(
+                Message.conversation_key == group_conversation_key(group.id)
+            ).scalar()
+        )
+        db.session.add(job)
+        db.session.commit()
+        if self.notify is not None:
+            try:
+                self.notify(group.id, list(member_ids))
+            except Exception as e:
+                print(f'Error notifying group deletion: {e}')
+        self._queue.put(job.id)
+        return job
+
+    def _run(self):
+        while not self._stopped.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            with self.app.app_context():
+                self.run_job(job_id)
+
+    def _delete_chunk(self, table, where, params, job, counter):
+        """Xóa tối đa chunk_size dòng của table thỏa where; trả về số dòng đã xóa."""
+        deleted = db.session.execute(db.text(f"""
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {where} LIMIT :chunk
+            )
+        """), dict(params, chunk=self.chunk_size)).rowcount
+        if counter is not None:
+            setattr(job, counter, getattr(job, counter) + deleted)
+        db.session.commit()
+        self.chunks += 1
+        return deleted
+
+    def _purge(self, table, where, params, job, counter=None):
+        while not self._stopped.is_set():
+            if self._delete_chunk(table, where, params, job, counter) < self.chunk_size:
+                return True
+            time.sleep(self.pause)
+        return False
+
+    def run_job(self, job_id):
+        job = db.session.get(GroupDeletionJob, job_id)
+        if job is None or job.status == 'done':
+            return
+        key = group_conversation_key(job.group_id)
+        try:
+            job.status = 'running'
+            job.error = None
+            db.session.commit()
+
+            steps = (
+                (GroupMember.__tablename__, 'group_id = :group_id', {'group_id': job.group_id}, 'members_deleted'),
+                (Message.__tablename__, 'conversation_key = :key', {'key': key}, 'messages_deleted'),
+                (ReadCursor.__tablename__, 'conversation_key = :key', {'key': key}, None)
+            )
+            for table, where, params, counter in steps:
+                if not self._purge(table, where, params, job, counter):
+                    # Dừng giữa chừng: job vẫn 'running' và được tiếp tục lần khởi động sau
+                    return
+
+            message_archive.delete(key)
+            db.session.execute(db.delete(ConversationSequence).where(ConversationSequence.conversation_key == key))
+            db.session.execute(db.delete(Group).where(Group.id == job.group_id))
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f'Error purging group {job.group_id}: {e}')
+            job = db.session.get(GroupDeletionJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            db.session.commit()
+
+    def stats(self):
+        return {'queued_jobs': self._queue.qsize(), 'chunks': self.chunks}
+
+group_purger = GroupPurger()
+
+def ensure_group_deletion():
+    """Thêm cột deleted_at cho bảng nhóm của database cũ."""
+    group_table = Group.__tablename__
+    columns = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info("{group_table}")'))}
+    if 'deleted_at' not in columns:
+        db.session.execute(db.text(f'ALTER TABLE "{group_table}" ADD COLUMN deleted_at DATETIME'))
+        db.session.commit()
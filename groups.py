@@ -1,8 +1,50 @@
-from flask import Blueprint, jsonify, request, session
-from src.models.user import User, Group, GroupMember, Message, db
+import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+from flask import Blueprint, current_app, jsonify, request, session
+from src.models.user import User, Group, GroupMember, db
+from src.cache import group_members, group_names
+from src.database import read_session
+from src.models.indexes import group_conversation_key
+from src.recent_messages import recent_messages, load_history_page, stream_history
+from src.models.read_state import read_cursors, unread_columns, unread_count
+from src.models.group_deletion import GroupDeletionJob, active_group, group_purger
+from src.pagination import parse_page_args
+from src.write_pipeline import save_message
 
 groups_bp = Blueprint('groups', __name__)
 
+def _busy_response():
+    # Hàng đợi ghi đầy hoặc lô chưa commit kịp: báo client thử lại sau thay vì lỗi 500
+    response = jsonify({'success': False, 'error': 'Máy chủ đang quá tải, vui lòng thử lại sau'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Số người dùng tối đa trong một yêu cầu thêm/xóa hàng loạt
+MAX_BULK_MEMBERS = 1000
+
+def _parse_user_ids(data):
+    """Đọc danh sách user_ids (giữ thứ tự, bỏ trùng); ném ValueError nếu không hợp lệ."""
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        raise ValueError('Danh sách ID người dùng không được để trống')
+    if len(user_ids) > MAX_BULK_MEMBERS:
+        raise ValueError(f'Tối đa {MAX_BULK_MEMBERS} người dùng mỗi lần')
+    parsed = []
+    for user_id in user_ids:
+        if isinstance(user_id, bool) or not isinstance(user_id, int):
+            raise ValueError('ID người dùng không hợp lệ')
+        parsed.append(user_id)
+    return list(dict.fromkeys(parsed))
+
+def _current_members(group_id, user_ids):
+    """Tập user_id trong user_ids đã là thành viên của nhóm (một truy vấn)."""
+    rows = db.session.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id, GroupMember.user_id.in_(user_ids)
+    ).all()
+    return {user_id for (user_id,) in rows}
+
 @groups_bp.route('/create', methods=['POST'])
 def create_group():
     if 'user_id' not in session:
@@ -24,6 +66,7 @@ def create_group():
         member = GroupMember(group_id=group.id, user_id=session['user_id'])
         db.session.add(member)
         db.session.commit()
+        group_members.invalidate(group.id)
         
         return jsonify({
             'success': True,
@@ -48,13 +91,12 @@ def add_member():
         return jsonify({'success': False, 'error': 'ID nhóm và ID người dùng không được để trống'}), 400
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
+    group = active_group(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
     # Kiểm tra quyền (chỉ người tạo nhóm hoặc thành viên hiện tại mới có thể thêm người)
-    current_member = GroupMember.query.filter_by(group_id=group_id, user_id=session['user_id']).first()
-    if not current_member and group.creator_id != session['user_id']:
+    if not group_members.is_member(group_id, session['user_id']) and group.creator_id != session['user_id']:
         return jsonify({'success': False, 'error': 'Không có quyền thêm thành viên vào nhóm này'}), 403
     
     # Kiểm tra người dùng có tồn tại không
@@ -63,8 +105,7 @@ def add_member():
         return jsonify({'success': False, 'error': 'Người dùng không tồn tại'}), 404
     
     # Kiểm tra xem người dùng đã là thành viên chưa
-    existing_member = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-    if existing_member:
+    if group_members.is_member(group_id, user_id):
         return jsonify({'success': False, 'error': 'Người dùng đã là thành viên của nhóm'}), 400
     
     try:
@@ -72,6 +113,7 @@ def add_member():
         member = GroupMember(group_id=group_id, user_id=user_id)
         db.session.add(member)
         db.session.commit()
+        group_members.invalidate(group_id)
         
         return jsonify({
             'success': True,
@@ -82,6 +124,69 @@ def add_member():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@groups_bp.route('/add_members', methods=['POST'])
+def add_members():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    data = request.json or {}
+    group_id = data.get('group_id')
+    if not group_id:
+        return jsonify({'success': False, 'error': 'ID nhóm không được để trống'}), 400
+    
+    try:
+        user_ids = _parse_user_ids(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Kiểm tra nhóm có tồn tại không
+    group = active_group(group_id)
+    if not group:
+        return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
+    
+    # Kiểm tra quyền (giống add_member)
+    if not group_members.is_member(group_id, session['user_id']) and group.creator_id != session['user_id']:
+        return jsonify({'success': False, 'error': 'Không có quyền thêm thành viên vào nhóm này'}), 403
+    
+    # Kiểm tra cả danh sách bằng hai truy vấn theo tập hợp thay vì từng người một
+    existing_users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids)).all()}
+    already_members = _current_members(group_id, user_ids)
+    
+    to_add = [user_id for user_id in user_ids if user_id in existing_users and user_id not in already_members]
+    added = set()
+    if to_add:
+        try:
+            # Một lệnh INSERT executemany trong một transaction; người được thêm đồng thời bởi
+            # request khác vi phạm chỉ mục unique (group_id, user_id) và bị bỏ qua thay vì lỗi
+            added = set(db.session.execute(
+                sqlite_insert(GroupMember).on_conflict_do_nothing(
+                    index_elements=['group_id', 'user_id']
+                ).returning(GroupMember.user_id),
+                [{'group_id': group_id, 'user_id': user_id} for user_id in to_add]
+            ).scalars())
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e)}), 500
+        group_members.invalidate(group_id)
+    
+    results = []
+    for user_id in user_ids:
+        if user_id not in existing_users:
+            status = 'user_not_found'
+        elif user_id in added:
+            status = 'added'
+        else:
+            status = 'already_member'
+        results.append({'user_id': user_id, 'status': status})
+    
+    return jsonify({
+        'success': True,
+        'message': f'Đã thêm {len(added)} thành viên',
+        'added': len(added),
+        'results': results
+    }), 200
+
 @groups_bp.route('/remove_member', methods=['POST'])
 def remove_member():
     if 'user_id' not in session:
@@ -95,7 +200,7 @@ def remove_member():
         return jsonify({'success': False, 'error': 'ID nhóm và ID người dùng không được để trống'}), 400
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
+    group = active_group(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
@@ -115,6 +220,7 @@ def remove_member():
     try:
         db.session.delete(member)
         db.session.commit()
+        group_members.invalidate(group_id)
         
         return jsonify({
             'success': True,
@@ -125,6 +231,63 @@ def remove_member():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@groups_bp.route('/remove_members', methods=['POST'])
+def remove_members():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    data = request.json or {}
+    group_id = data.get('group_id')
+    if not group_id:
+        return jsonify({'success': False, 'error': 'ID nhóm không được để trống'}), 400
+    
+    try:
+        user_ids = _parse_user_ids(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Kiểm tra nhóm có tồn tại không
+    group = active_group(group_id)
+    if not group:
+        return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
+    
+    # Kiểm tra quyền (giống remove_member: người tạo nhóm, hoặc thành viên tự rời nhóm)
+    if group.creator_id != session['user_id'] and user_ids != [session['user_id']]:
+        return jsonify({'success': False, 'error': 'Không có quyền xóa thành viên khỏi nhóm này'}), 403
+    
+    current = _current_members(group_id, user_ids)
+    
+    results = []
+    to_remove = []
+    for user_id in user_ids:
+        if user_id == group.creator_id:
+            # Không cho phép xóa người tạo nhóm
+            status = 'is_creator'
+        elif user_id not in current:
+            status = 'not_member'
+        else:
+            status = 'removed'
+            to_remove.append(user_id)
+        results.append({'user_id': user_id, 'status': status})
+    
+    if to_remove:
+        try:
+            db.session.execute(db.delete(GroupMember).where(
+                GroupMember.group_id == group_id, GroupMember.user_id.in_(to_remove)
+            ))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e)}), 500
+        group_members.invalidate(group_id)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Đã xóa {len(to_remove)} thành viên',
+        'removed': len(to_remove),
+        'results': results
+    }), 200
+
 @groups_bp.route('/delete', methods=['POST'])
 def delete_group():
     if 'user_id' not in session:
@@ -137,7 +300,7 @@ def delete_group():
         return jsonify({'success': False, 'error': 'ID nhóm không được để trống'}), 400
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
+    group = active_group(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
@@ -146,19 +309,37 @@ def delete_group():
         return jsonify({'success': False, 'error': 'Chỉ người tạo nhóm mới có thể xóa nhóm'}), 403
     
     try:
-        # Xóa tất cả thành viên và tin nhắn (cascade delete)
-        db.session.delete(group)
-        db.session.commit()
+        # Ẩn nhóm ngay; thành viên và tin nhắn được xóa dần ở nền theo từng khối
+        member_ids = group_members.get_members(group_id)
+        job = group_purger.request(group, session['user_id'], member_ids)
+        group_members.invalidate(group_id)
+        group_names.invalidate(group_id)
+        recent_messages.drop(group_conversation_key(group_id))
         
         return jsonify({
             'success': True,
-            'message': 'Xóa nhóm thành công'
-        }), 200
+            'message': 'Nhóm đang được xóa',
+            'job': job.to_dict()
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@groups_bp.route('/delete_jobs/<int:job_id>', methods=['GET'])
+def get_delete_job(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    job = db.session.get(GroupDeletionJob, job_id)
+    if not job or job.requested_by != session['user_id']:
+        return jsonify({'success': False, 'error': 'Không tìm thấy tiến trình xóa nhóm'}), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    }), 200
+
 @groups_bp.route('/send_message', methods=['POST'])
 def send_group_message():
     if 'user_id' not in session:
@@ -175,24 +356,42 @@ def send_group_message():
         return jsonify({'success': False, 'error': 'Nội dung tin nhắn không được để trống'}), 400
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
+    group = active_group(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
     # Kiểm tra người dùng có phải là thành viên của nhóm không
-    member = GroupMember.query.filter_by(group_id=group_id, user_id=session['user_id']).first()
-    if not member:
+    if not group_members.is_member(group_id, session['user_id']):
         return jsonify({'success': False, 'error': 'Bạn không phải là thành viên của nhóm này'}), 403
     
+    message_writer = current_app.extensions.get('message_writer')
+    if message_writer is not None:
+        # Chế độ ghi theo lô: chờ lô chứa tin nhắn được commit
+        try:
+            future = message_writer.submit({
+                'sender_id': session['user_id'],
+                'group_id': group_id,
+                'content': content
+            })
+            data = future.result(timeout=5)
+        except (queue.Full, FutureTimeoutError):
+            return _busy_response()
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+        
+        return jsonify({
+            'success': True,
+            'message': 'Gửi tin nhắn nhóm thành công',
+            'data': data
+        }), 201
+    
     try:
         # Tạo tin nhắn nhóm
-        message = Message(
-            sender_id=session['user_id'],
-            group_id=group_id,
-            content=content
-        )
-        db.session.add(message)
-        db.session.commit()
+        message = save_message({
+            'sender_id': session['user_id'],
+            'group_id': group_id,
+            'content': content
+        })
         
         return jsonify({
             'success': True,
@@ -219,21 +418,34 @@ def get_group_history():
         return jsonify({'success': False, 'error': 'ID nhóm không hợp lệ'}), 400
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
-    if not group:
+    if group_names.get(group_id) is None:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
     # Kiểm tra người dùng có phải là thành viên của nhóm không
-    member = GroupMember.query.filter_by(group_id=group_id, user_id=session['user_id']).first()
-    if not member:
+    if not group_members.is_member(group_id, session['user_id']):
         return jsonify({'success': False, 'error': 'Bạn không phải là thành viên của nhóm này'}), 403
     
-    # Lấy lịch sử tin nhắn nhóm
-    messages = Message.query.filter_by(group_id=group_id).order_by(Message.timestamp.asc()).all()
+    try:
+        before, after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Lấy lịch sử tin nhắn nhóm (phân trang theo id, trang đầu từ bộ đệm nếu có)
+    conversation_key = group_conversation_key(group_id)
+    if request.args.get('stream') == '1':
+        # Xuất toàn bộ lịch sử (không giới hạn limit) dưới dạng stream
+        return stream_history(conversation_key, before, after)
+    
+    messages, next_cursor = load_history_page(conversation_key, before, after, limit)
+    
+    # Mở trang mới nhất nghĩa là người dùng đã đọc đến tin nhắn mới nhất
+    if before is None and after is None and messages:
+        read_cursors.mark(session['user_id'], conversation_key, messages[-1]['seq'])
     
     return jsonify({
         'success': True,
-        'messages': [message.to_dict() for message in messages]
+        'messages': messages,
+        'next_cursor': next_cursor
     }), 200
 
 @groups_bp.route('/list', methods=['GET'])
@@ -241,18 +453,27 @@ def get_user_groups():
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
     
-    # Lấy danh sách nhóm mà người dùng tham gia
-    memberships = GroupMember.query.filter_by(user_id=session['user_id']).all()
-    
+    # Lấy danh sách nhóm mà người dùng tham gia cùng số thành viên và số tin chưa đọc trong một truy vấn
+    user_id = session['user_id']
+    counted = aliased(GroupMember)
+    member_count = read_session.query(db.func.count(counted.user_id)).filter(
+        counted.group_id == Group.id
+    ).scalar_subquery()
+    last_seq, last_read_seq, joins = unread_columns(user_id, 'group_' + db.cast(Group.id, db.String))
+    query = read_session.query(Group, member_count, last_seq, last_read_seq).join(
+        GroupMember, GroupMember.group_id == Group.id
+    )
+    for target, condition in joins:
+        query = query.outerjoin(target, condition)
+    rows = query.filter(GroupMember.user_id == user_id, Group.deleted_at.is_(None)).all()
+    
+    pending = read_cursors.pending_for(user_id)
     groups = []
-    for membership in memberships:
-        group = Group.query.get(membership.group_id)
-        if group:
-            group_data = group.to_dict()
-            # Thêm thông tin số thành viên
-            member_count = GroupMember.query.filter_by(group_id=group.id).count()
-            group_data['member_count'] = member_count
-            groups.append(group_data)
+    for group, count, seq, read_seq in rows:
+        group_data = group.to_dict()
+        group_data['member_count'] = count
+        group_data['unread_count'] = unread_count(seq, read_seq, pending.get(group_conversation_key(group.id), 0))
+        groups.append(group_data)
     
     return jsonify({
         'success': True,
@@ -265,13 +486,12 @@ def get_group_members(group_id):
         return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
     
     # Kiểm tra nhóm có tồn tại không
-    group = Group.query.get(group_id)
+    group = active_group(group_id)
     if not group:
         return jsonify({'success': False, 'error': 'Nhóm không tồn tại'}), 404
     
     # Kiểm tra người dùng có phải là thành viên của nhóm không
-    member = GroupMember.query.filter_by(group_id=group_id, user_id=session['user_id']).first()
-    if not member:
+    if not group_members.is_member(group_id, session['user_id']):
         return jsonify({'success': False, 'error': 'Bạn không phải là thành viên của nhóm này'}), 403
     
     # Lấy danh sách thành viên
@@ -289,3 +509,13 @@ def get_group_members(group_id):
         'members': member_list
     }), 200
 
+
+@groups_bp.route('/cache_stats', methods=['GET'])
+def get_membership_cache_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    return jsonify({
+        'success': True,
+        'membership_cache': group_members.stats()
+    }), 200
@@ -0,0 +1,84 @@
+from sqlalchemy import event
+from src.models.user import db, GroupMember, Message
+import src.models.columns  # Message.conversation_key
+
+def private_conversation_key(user_id, friend_id):
+    """Khóa chuẩn của cuộc trò chuyện riêng, trùng với tên phòng Socket.IO private_{min}_{max}."""
+    user_id, friend_id = int(user_id), int(friend_id)
+    return f'private_{min(user_id, friend_id)}_{max(user_id, friend_id)}'
+
+def group_conversation_key(group_id):
+    """Khóa chuẩn của cuộc trò chuyện nhóm, trùng với tên phòng Socket.IO group_{id}."""
+    return f'group_{int(group_id)}'
+
+def message_conversation_key(message):
+    if message.group_id is not None:
+        return group_conversation_key(message.group_id)
+    return private_conversation_key(message.sender_id, message.receiver_id)
+
+@event.listens_for(Message, 'before_insert')
+def _set_conversation_key(mapper, connection, target):
+    if target.conversation_key is None:
+        target.conversation_key = message_conversation_key(target)
+
+# Chỉ mục phục vụ phân trang lịch sử tin nhắn theo khóa (keyset) trên Message.id
+message_conversation_index = db.Index('ix_message_conversation_key_id', Message.conversation_key, Message.id)
+message_group_index = db.Index('ix_message_group_id_id', Message.group_id, Message.id)
+# Mỗi người dùng là thành viên của một nhóm nhiều nhất một lần; add_members dựa vào
+# chỉ mục này cho INSERT ... ON CONFLICT DO NOTHING
+group_member_unique_index = db.Index(
+    'ux_group_member_group_id_user_id', GroupMember.group_id, GroupMember.user_id, unique=True
+)
+
+BACKFILL_CHUNK_SIZE = 10000
+
+def _migrate_conversation_key():
+    """Thêm cột conversation_key vào database cũ và điền giá trị theo từng khoảng id."""
+    message_table = Message.__tablename__
+    columns = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info({message_table})'))}
+    if 'conversation_key' not in columns:
+        db.session.execute(db.text(f'ALTER TABLE {message_table} ADD COLUMN conversation_key VARCHAR(40)'))
+        db.session.commit()
+
+    max_id = db.session.execute(db.text(
+        f'SELECT max(id) FROM {message_table} WHERE conversation_key IS NULL'
+    )).scalar()
+    start = 0
+    while max_id is not None and start <= max_id:
+        # Mỗi khoảng là một transaction ngắn để không giữ khóa ghi quá lâu
+        db.session.execute(db.text(f"""
+            UPDATE {message_table}
+            SET conversation_key = CASE
+                WHEN group_id IS NOT NULL THEN 'group_' || group_id
+                ELSE 'private_' || min(sender_id, receiver_id) || '_' || max(sender_id, receiver_id)
+            END
+            WHERE conversation_key IS NULL AND id > :start AND id <= :end
+        """), {'start': start, 'end': start + BACKFILL_CHUNK_SIZE})
+        db.session.commit()
+        start += BACKFILL_CHUNK_SIZE
+
+def _ensure_group_member_unique():
+    """Tạo chỉ mục unique (group_id, user_id), xóa trước các dòng thành viên trùng của database cũ."""
+    exists = db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"
+    ), {'name': group_member_unique_index.name}).first()
+    if exists:
+        return
+    member_table = GroupMember.__tablename__
+    # Giữ dòng cũ nhất của mỗi cặp (group_id, user_id)
+    db.session.execute(db.text(f"""
+        DELETE FROM {member_table}
+        WHERE id NOT IN (SELECT min(id) FROM {member_table} GROUP BY group_id, user_id)
+    """))
+    db.session.commit()
+    group_member_unique_index.create(db.engine, checkfirst=True)
+
+def ensure_indexes():
+    """Tạo cột và các chỉ mục còn thiếu trên database đã tồn tại (create_all bỏ qua bảng cũ)."""
+    _migrate_conversation_key()
+    _ensure_group_member_unique()
+    for index in (message_conversation_index, message_group_index):
+        index.create(db.engine, checkfirst=True)
+    # Chỉ mục (sender_id, receiver_id, id) cũ đã được thay bằng (conversation_key, id)
+    db.session.execute(db.text('DROP INDEX IF EXISTS ix_message_sender_receiver_id'))
+    db.session.commit()
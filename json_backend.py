@@ -0,0 +1,84 @@
+import json
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Số dòng đọc mỗi lần từ cursor và kích thước tối thiểu mỗi đoạn gửi đi khi stream
+STREAM_BATCH_ROWS = 500
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def dumps_bytes(obj):
+    """Serialize obj thành bytes JSON gọn, dùng orjson nếu được bật."""
+    if orjson is not None and FastJSON.enabled:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default).encode()
+
+class FastJSON:
+    """Module JSON cho Socket.IO (tham số json= của SocketIO): dumps/loads bằng orjson khi có."""
+
+    enabled = False
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if orjson is not None and FastJSON.enabled:
+            return orjson.dumps(obj, default=_default).decode()
+        return json.dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(data, **kwargs):
+        if orjson is not None and FastJSON.enabled:
+            return orjson.loads(data)
+        return json.loads(data, **kwargs)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider của Flask dùng orjson cho jsonify/response (giữ loads của Flask cho request)."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_default), mimetype=self.mimetype)
+
+def configure_json_backend(app, backend):
+    """Chọn backend JSON: 'json' (mặc định) hoặc 'orjson' nếu đã cài; trả về tên backend được dùng."""
+    if backend == 'orjson' and orjson is not None:
+        FastJSON.enabled = True
+        app.json = OrjsonProvider(app)
+        return 'orjson'
+    if backend == 'orjson':
+        print('JSON_BACKEND=orjson but orjson is not installed, falling back to json')
+    return 'json'
+
+def stream_json_array(head, key, rows, serialize):
+    """Response JSON dạng {**head, key: [...]} được ghi dần từ iterator rows.
+
+    rows nên là query.yield_per(...) để chỉ giữ một lô dòng trong bộ nhớ;
+    serialize(row) trả về dict của từng phần tử.
+    """
+    prefix = dumps_bytes(head)[:-1] + (b',' if head else b'') + dumps_bytes(key) + b':['
+
+    def generate():
+        buffer = bytearray(prefix)
+        first = True
+        for row in rows:
+            if not first:
+                buffer += b','
+            buffer += dumps_bytes(serialize(row))
+            first = False
+            if len(buffer) >= STREAM_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b']}'
+        yield bytes(buffer)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
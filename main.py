@@ -1,12 +1,35 @@
+import json
 import os
+import queue
 import sys
+import click
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, session
+from flask import Flask, request, send_from_directory, session
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from src.models.user import db, User, Message, Group, GroupMember
+from src.models.user import db, Message
+from src.models.indexes import ensure_indexes, private_conversation_key, group_conversation_key
+from src.models.sequence import ensure_sequences
+from src.sync import collect_missing_messages, can_access_conversation
+from src.recent_messages import recent_messages
+from src.archive import message_archive, archive_cold_messages
+from src.models.search_index import ensure_search_index, rebuild_search_index
+from src.models.user_search import ensure_user_search_index
+from src.database import init_database, read_session
+from src.cache import group_members, profiles, group_names, CACHES
+from src.models.conversation import backfill_conversation_summaries
+from src.models.read_state import read_cursors, ensure_read_state, clamp_read_seq
+from src.models.group_deletion import group_purger, ensure_group_deletion
+from src.write_pipeline import MessageWriter, save_message
+from src.presence import presence, presence_cycle, connect_snapshot, filter_offline
+from src.message_bus import BusManager, create_bus, start_cache_invalidation
+from src.metrics import install_metrics, parse_allowlist
+from src.json_backend import FastJSON, configure_json_backend
+from src.passwords import password_hasher
+from src.backpressure import outbound, send_limiter
+from src.delivery import RoomBatcher
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.messages import messages_bp
@@ -18,8 +41,19 @@ app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 # Enable CORS for all routes
 CORS(app)
 
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Initialize SocketIO. With SOCKETIO_MESSAGE_BUS set ('local' or 'unix:/path/to/bus.sock'),
+# room broadcasts and cache invalidations go through a message bus so several
+# worker processes can serve the same rooms (see cluster.py).
+app.config['SOCKETIO_MESSAGE_BUS'] = os.environ.get('SOCKETIO_MESSAGE_BUS', '')
+message_bus = create_bus(app.config['SOCKETIO_MESSAGE_BUS']) if app.config['SOCKETIO_MESSAGE_BUS'] else None
+if message_bus is not None:
+    socketio = SocketIO(app, cors_allowed_origins="*", client_manager=BusManager(message_bus), json=FastJSON)
+    start_cache_invalidation(message_bus, socketio.start_background_task)
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", json=FastJSON)
+
+# JSON_BACKEND=orjson switches Flask responses and Socket.IO packets to orjson when it is installed
+app.config['JSON_BACKEND'] = configure_json_backend(app, os.environ.get('JSON_BACKEND', 'json'))
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -28,11 +62,174 @@ app.register_blueprint(messages_bp, url_prefix='/api/messages')
 app.register_blueprint(groups_bp, url_prefix='/api/groups')
 
 # Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+# DATABASE_URL overrides the default file, e.g. for the benchmark harness (bench_load.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+# 'production' enables WAL, tuned pragmas and separate writer/reader connection pools
+app.config['DATABASE_PROFILE'] = os.environ.get('DATABASE_PROFILE', 'default')
+app.config['SQLITE_WRITER_POOL_SIZE'] = int(os.environ.get('SQLITE_WRITER_POOL_SIZE', '1'))
+app.config['SQLITE_READER_POOL_SIZE'] = int(os.environ.get('SQLITE_READER_POOL_SIZE', '8'))
+init_database(app)
 with app.app_context():
     db.create_all()
+    ensure_group_deletion()
+    ensure_indexes()
+    ensure_sequences()
+    backfill_conversation_summaries()
+    ensure_read_state()
+    ensure_search_index()
+    ensure_user_search_index()
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the FTS5 message search index from the message table."""
+    rebuild_search_index()
+    print('Search index rebuilt')
+
+# Messages older than ARCHIVE_AFTER_DAYS are moved by `flask archive-messages` into compressed
+# per-conversation segment files under ARCHIVE_DIR; history pages continue into them transparently
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'database', 'archive'))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+message_archive.root = app.config['ARCHIVE_DIR']
+
+@app.cli.command('archive-messages')
+@click.option('--days', type=int, default=None, help='Archive messages older than this many days.')
+@click.option('--batch-size', type=int, default=2000)
+def archive_messages_command(days, batch_size):
+    """Move cold messages from the message table into the segment archive."""
+    if days is None:
+        days = app.config['ARCHIVE_AFTER_DAYS']
+    moved = archive_cold_messages(days, batch_size)
+    print(f'Archived {moved} messages older than {days} days')
+
+@app.cli.command('compact-archive')
+def compact_archive_command():
+    """Rewrite every conversation archive into full, highly compressed blocks (run with the server stopped)."""
+    for key in message_archive.keys():
+        (blocks_before, bytes_before), (blocks_after, bytes_after) = message_archive.compact(key)
+        print(f'{key}: {blocks_before} blocks / {bytes_before} bytes -> {blocks_after} blocks / {bytes_after} bytes')
+
+@app.cli.command('archive-report')
+@click.option('--samples', type=int, default=200, help='Number of archived history pages to time.')
+def archive_report_command(samples):
+    """Print archive size, compression ratio and page read latency as JSON."""
+    report = message_archive.report(samples)
+    report['hot_messages'] = db.session.query(db.func.count(Message.id)).scalar()
+    database = app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///')
+    if os.path.exists(database):
+        report['database_bytes'] = os.path.getsize(database)
+    print(json.dumps(report, indent=2))
+
+# The recent-message buffer is per process; it is only coherent when a single worker serves all writes
+recent_messages.enabled = message_bus is None
+# Likewise presence only sees this process's connections, so offline users are not skipped with a bus
+presence.authoritative = message_bus is None
+
+# Presence: clients send 'heartbeat' every PRESENCE_HEARTBEAT_S; friends get one diff per PRESENCE_BROADCAST_MS
+app.config['PRESENCE_HEARTBEAT_S'] = int(os.environ.get('PRESENCE_HEARTBEAT_S', '25'))
+app.config['PRESENCE_BROADCAST_MS'] = int(os.environ.get('PRESENCE_BROADCAST_MS', '2000'))
+presence.heartbeat_timeout = app.config['PRESENCE_HEARTBEAT_S'] * 3
+
+# Read cursors are buffered in memory and written in one batch every READ_CURSOR_FLUSH_MS
+app.config['READ_CURSOR_FLUSH_MS'] = int(os.environ.get('READ_CURSOR_FLUSH_MS', '1000'))
+read_cursors.interval = app.config['READ_CURSOR_FLUSH_MS'] / 1000.0
+read_cursors.start(app)
+
+# Deleted groups are hidden at once and purged in background chunks of GROUP_PURGE_CHUNK rows,
+# sleeping GROUP_PURGE_PAUSE_MS between chunks so other writers get the SQLite write lock
+app.config['GROUP_PURGE_CHUNK'] = int(os.environ.get('GROUP_PURGE_CHUNK', '500'))
+app.config['GROUP_PURGE_PAUSE_MS'] = int(os.environ.get('GROUP_PURGE_PAUSE_MS', '20'))
+group_purger.chunk_size = app.config['GROUP_PURGE_CHUNK']
+group_purger.pause = app.config['GROUP_PURGE_PAUSE_MS'] / 1000.0
+
+def close_group_room(group_id, member_ids):
+    """Tell the members a group was deleted and drop every connection from its room."""
+    rooms = [f'user_{user_id}' for user_id in member_ids]
+    if rooms:
+        socketio.emit('group_deleted', {'group_id': group_id}, to=rooms)
+    socketio.close_room(group_conversation_key(group_id))
+
+group_purger.notify = close_group_room
+group_purger.start(app)
+
+# Password hashing runs on a bounded pool; logins beyond PASSWORD_HASH_QUEUE in flight get 503
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', '32'))
+password_hasher.configure(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'])
+
+# Per-connection outbound queues are capped at OUTBOUND_QUEUE_MAX_FRAMES; OUTBOUND_QUEUE_POLICY decides
+# what happens to frames for a client whose queue is full ('coalesce', 'drop' or 'disconnect')
+app.config['OUTBOUND_QUEUE_MAX_FRAMES'] = int(os.environ.get('OUTBOUND_QUEUE_MAX_FRAMES', '256'))
+app.config['OUTBOUND_QUEUE_POLICY'] = os.environ.get('OUTBOUND_QUEUE_POLICY', 'coalesce')
+outbound.max_frames = app.config['OUTBOUND_QUEUE_MAX_FRAMES']
+outbound.policy = app.config['OUTBOUND_QUEUE_POLICY']
+outbound.install(socketio.server)
+
+# Token bucket per user on send_message
+app.config['SEND_RATE_PER_SEC'] = float(os.environ.get('SEND_RATE_PER_SEC', '5'))
+app.config['SEND_RATE_BURST'] = int(os.environ.get('SEND_RATE_BURST', '20'))
+send_limiter.rate = app.config['SEND_RATE_PER_SEC']
+send_limiter.burst = app.config['SEND_RATE_BURST']
+
+# Optional micro-batching of new_message: busy rooms get one new_messages frame per adaptive window
+app.config['DELIVERY_BATCH_ENABLED'] = os.environ.get('DELIVERY_BATCH_ENABLED', '0') == '1'
+app.config['DELIVERY_BATCH_MAX_WINDOW_MS'] = int(os.environ.get('DELIVERY_BATCH_MAX_WINDOW_MS', '10'))
+app.config['DELIVERY_BATCH_TARGET'] = int(os.environ.get('DELIVERY_BATCH_TARGET', '8'))
+room_batcher = None
+if app.config['DELIVERY_BATCH_ENABLED']:
+    room_batcher = RoomBatcher(
+        lambda event, payload, room: socketio.emit(event, payload, to=room),
+        socketio.start_background_task,
+        socketio.sleep,
+        max_window_ms=app.config['DELIVERY_BATCH_MAX_WINDOW_MS'],
+        target_batch=app.config['DELIVERY_BATCH_TARGET']
+    )
+
+# Optional group-commit mode for incoming messages
+app.config['MESSAGE_BATCH_ENABLED'] = os.environ.get('MESSAGE_BATCH_ENABLED', '0') == '1'
+app.config['MESSAGE_BATCH_SIZE'] = int(os.environ.get('MESSAGE_BATCH_SIZE', '64'))
+app.config['MESSAGE_BATCH_DELAY_MS'] = int(os.environ.get('MESSAGE_BATCH_DELAY_MS', '10'))
+app.config['MESSAGE_QUEUE_SIZE'] = int(os.environ.get('MESSAGE_QUEUE_SIZE', '10000'))
+
+message_writer = None
+if app.config['MESSAGE_BATCH_ENABLED']:
+    message_writer = MessageWriter(
+        app,
+        batch_size=app.config['MESSAGE_BATCH_SIZE'],
+        delay_ms=app.config['MESSAGE_BATCH_DELAY_MS'],
+        max_queue=app.config['MESSAGE_QUEUE_SIZE']
+    ).start()
+
+def presence_broadcaster():
+    """Background loop sending each online friend one coalesced presence diff per interval."""
+    interval = app.config['PRESENCE_BROADCAST_MS'] / 1000.0
+    while True:
+        socketio.sleep(interval)
+        try:
+            with app.app_context():
+                diffs = presence_cycle()
+            for friend_id, diff in diffs.items():
+                socketio.emit('presence_update', diff, to=f'user_{friend_id}')
+            # Deliver notification counts collapsed while a client's queue was full
+            outbound.flush_idle()
+        except Exception as e:
+            print(f'Error broadcasting presence: {e}')
+        finally:
+            read_session.remove()
+
+_presence_started = False
+
+def start_presence():
+    """Start the presence loop once; only for processes where this Flask-SocketIO server serves clients.
+
+    Not started at import: asgi.py imports this module and runs its own loop on the AsyncServer.
+    """
+    global _presence_started
+    if not _presence_started:
+        _presence_started = True
+        socketio.start_background_task(presence_broadcaster)
 
 # WebSocket Events
 @socketio.on('connect')
@@ -40,6 +237,11 @@ def handle_connect():
     if 'user_id' in session:
         user_id = session['user_id']
         join_room(f'user_{user_id}')
+        presence.connect(user_id, request.sid)
+        online_friends, digest = connect_snapshot(user_id)
+        emit('presence_snapshot', {'online': online_friends, 'heartbeat_interval': app.config['PRESENCE_HEARTBEAT_S']})
+        if digest:
+            emit('pending_notifications', {'notifications': digest})
         print(f'User {user_id} connected')
     else:
         print('Unauthorized connection attempt')
@@ -49,8 +251,18 @@ def handle_disconnect():
     if 'user_id' in session:
         user_id = session['user_id']
         leave_room(f'user_{user_id}')
+        presence.disconnect(user_id, request.sid)
         print(f'User {user_id} disconnected')
 
+@socketio.on('heartbeat')
+def handle_heartbeat():
+    if 'user_id' not in session:
+        return
+    
+    # An expired connection that is still alive comes back online
+    if not presence.heartbeat(session['user_id'], request.sid):
+        presence.connect(session['user_id'], request.sid)
+
 @socketio.on('join_chat')
 def handle_join_chat(data):
     if 'user_id' not in session:
@@ -61,14 +273,13 @@ def handle_join_chat(data):
     
     if chat_type == 'friend':
         # Join private chat room
-        room = f'private_{min(session["user_id"], chat_id)}_{max(session["user_id"], chat_id)}'
+        room = private_conversation_key(session['user_id'], chat_id)
         join_room(room)
         print(f'User {session["user_id"]} joined private chat with {chat_id}')
     elif chat_type == 'group':
         # Check if user is member of the group
-        member = GroupMember.query.filter_by(group_id=chat_id, user_id=session['user_id']).first()
-        if member:
-            room = f'group_{chat_id}'
+        if group_members.is_member(chat_id, session['user_id']):
+            room = group_conversation_key(chat_id)
             join_room(room)
             print(f'User {session["user_id"]} joined group {chat_id}')
 
@@ -81,12 +292,135 @@ def handle_leave_chat(data):
     chat_id = data.get('id')
     
     if chat_type == 'friend':
-        room = f'private_{min(session["user_id"], chat_id)}_{max(session["user_id"], chat_id)}'
+        room = private_conversation_key(session['user_id'], chat_id)
         leave_room(room)
     elif chat_type == 'group':
-        room = f'group_{chat_id}'
+        room = group_conversation_key(chat_id)
         leave_room(room)
 
+@socketio.on('sync')
+def handle_sync(data):
+    """Return messages missed while disconnected: {conversation_key: last_seen_seq} -> delta."""
+    if 'user_id' not in session:
+        return {'success': False}
+    
+    cursors = data.get('conversations') if isinstance(data, dict) else None
+    if not isinstance(cursors, dict):
+        return {'success': False, 'error': 'invalid_conversations'}
+    return {
+        'success': True,
+        'conversations': collect_missing_messages(session['user_id'], cursors)
+    }
+
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    """Advance the user's read cursor: {conversation: key, seq: last_read_seq}."""
+    if 'user_id' not in session:
+        return {'success': False}
+    
+    conversation_key = data.get('conversation')
+    try:
+        seq = int(data.get('seq'))
+    except (TypeError, ValueError):
+        return {'success': False}
+    
+    if not isinstance(conversation_key, str) or not can_access_conversation(session['user_id'], conversation_key):
+        return {'success': False}
+    
+    # Clamp to the last assigned seq so a bogus value cannot mark future messages as read
+    read_cursors.mark(session['user_id'], conversation_key, clamp_read_seq(conversation_key, seq))
+    return {'success': True}
+
+DIGEST_SNIPPET_LENGTH = 100
+
+def message_events(message):
+    """Build the (event, payload, to) emits for a committed message.
+
+    Payloads are built once; for group messages the notification goes to the
+    list of member user rooms (from the membership cache) minus the sender.
+    Notifications for offline users are not emitted but added to their
+    pending digest, sent on their next connect.
+    Shared by the threading server below and the asyncio server in asgi.py.
+    """
+    sender = profiles.get(message.sender_id)
+    
+    if message.receiver_id is not None:
+        room = private_conversation_key(message.sender_id, message.receiver_id)
+        notification = {
+            'from_user': sender['username'],
+            'content': message.content[:DIGEST_SNIPPET_LENGTH],
+            'type': 'friend'
+        }
+        notify = filter_offline([message.receiver_id], room, notification)
+        events = [
+            ('new_message', {
+                'id': message.id,
+                'sender_id': message.sender_id,
+                'sender_username': sender['username'],
+                'receiver_id': message.receiver_id,
+                'content': message.content,
+                'timestamp': message.timestamp.isoformat(),
+                'type': 'friend',
+                'conversation': room,
+                'seq': message.seq
+            }, room)
+        ]
+        if notify:
+            # Also emit to individual user rooms for notifications
+            events.append(('message_notification', {
+                'from_user': sender['username'],
+                'content': message.content,
+                'type': 'friend'
+            }, f'user_{message.receiver_id}'))
+        return events
+    
+    room = group_conversation_key(message.group_id)
+    group_name = group_names.get(message.group_id)
+    recipients = [user_id for user_id in group_members.get_members(message.group_id) if user_id != message.sender_id]
+    rooms = [f'user_{user_id}' for user_id in filter_offline(recipients, room, {
+        'from_user': sender['username'],
+        'group_name': group_name,
+        'content': message.content[:DIGEST_SNIPPET_LENGTH],
+        'type': 'group'
+    })]
+    return [
+        ('new_message', {
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'sender_username': sender['username'],
+            'group_id': message.group_id,
+            'content': message.content,
+            'timestamp': message.timestamp.isoformat(),
+            'type': 'group',
+            'conversation': room,
+            'seq': message.seq
+        }, room),
+        # Notify all group members except the sender in one batch
+        ('message_notification', {
+            'from_user': sender['username'],
+            'group_name': group_name,
+            'content': message.content,
+            'type': 'group'
+        }, rooms)
+    ]
+
+def broadcast_message(message):
+    """Emit new_message to the chat room and notifications to the recipients.
+
+    Called once the message is committed, either inline by the socket handler
+    or from the batched writer thread. The multi-room group notification runs
+    as a background task so the handler thread does not pay for the group size.
+    With DELIVERY_BATCH_ENABLED, new_message goes through the room batcher.
+    """
+    for event, payload, to in message_events(message):
+        if isinstance(to, list):
+            if to:
+                socketio.start_background_task(socketio.emit, event, payload, to=to)
+        elif event == 'new_message' and room_batcher is not None:
+            room_batcher.add(to, payload)
+        else:
+            socketio.emit(event, payload, to=to)
+
 @socketio.on('send_message')
 def handle_send_message(data):
     if 'user_id' not in session:
@@ -99,81 +433,32 @@ def handle_send_message(data):
     if not content:
         return
     
+    if not send_limiter.allow(session['user_id']):
+        return {'success': False, 'error': 'rate_limited'}
+    
+    if chat_type == 'friend':
+        fields = {'sender_id': session['user_id'], 'receiver_id': chat_id, 'content': content}
+    elif chat_type == 'group':
+        # Check if user is member of the group
+        if not group_members.is_member(chat_id, session['user_id']):
+            return
+        fields = {'sender_id': session['user_id'], 'group_id': chat_id, 'content': content}
+    else:
+        return
+    
     try:
-        if chat_type == 'friend':
-            # Save message to database
-            message = Message(
-                sender_id=session['user_id'],
-                receiver_id=chat_id,
-                content=content
-            )
-            db.session.add(message)
-            db.session.commit()
-            
-            # Get sender info
-            sender = User.query.get(session['user_id'])
-            
-            # Emit to private chat room
-            room = f'private_{min(session["user_id"], chat_id)}_{max(session["user_id"], chat_id)}'
-            socketio.emit('new_message', {
-                'id': message.id,
-                'sender_id': message.sender_id,
-                'sender_username': sender.username,
-                'receiver_id': message.receiver_id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'type': 'friend'
-            }, room=room)
-            
-            # Also emit to individual user rooms for notifications
-            socketio.emit('message_notification', {
-                'from_user': sender.username,
-                'content': content,
-                'type': 'friend'
-            }, room=f'user_{chat_id}')
-            
-        elif chat_type == 'group':
-            # Check if user is member of the group
-            member = GroupMember.query.filter_by(group_id=chat_id, user_id=session['user_id']).first()
-            if not member:
-                return
-            
-            # Save message to database
-            message = Message(
-                sender_id=session['user_id'],
-                group_id=chat_id,
-                content=content
-            )
-            db.session.add(message)
-            db.session.commit()
-            
-            # Get sender and group info
-            sender = User.query.get(session['user_id'])
-            group = Group.query.get(chat_id)
-            
-            # Emit to group room
-            room = f'group_{chat_id}'
-            socketio.emit('new_message', {
-                'id': message.id,
-                'sender_id': message.sender_id,
-                'sender_username': sender.username,
-                'group_id': message.group_id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'type': 'group'
-            }, room=room)
-            
-            # Emit notifications to all group members
-            members = GroupMember.query.filter_by(group_id=chat_id).all()
-            for member in members:
-                if member.user_id != session['user_id']:  # Don't notify sender
-                    socketio.emit('message_notification', {
-                        'from_user': sender.username,
-                        'group_name': group.name,
-                        'content': content,
-                        'type': 'group'
-                    }, room=f'user_{member.user_id}')
+        if message_writer is not None:
+            # Batched mode: the writer thread commits and then broadcasts
+            message_writer.submit(fields, on_commit=broadcast_message)
+            return
+        
+        # Save message to database
+        message = save_message(fields)
+        broadcast_message(message)
     
+    except queue.Full:
+        # The batched writer's queue is full: tell the sender instead of dropping silently
+        return {'success': False, 'error': 'busy'}
     except Exception as e:
         print(f'Error sending message: {e}')
         db.session.rollback()
@@ -195,5 +480,51 @@ def serve(path):
             return "index.html not found", 404
 
 
+def metrics_gauges():
+    """Point-in-time values exported next to the request/event metrics on /metrics."""
+    gauges = [
+        ('chat_cache_hit_ratio', 'Hit ratio of the in-process caches.',
+         [(f'{{cache="{name}"}}', cache.stats()['hit_rate']) for name, cache in CACHES.items()]),
+        ('chat_online_users', 'Users with at least one live connection in this process.',
+         [('', presence.stats()['online_users'])]),
+        ('chat_recent_buffer_bytes', 'Bytes held by the recent-message buffer.',
+         [('', recent_messages.stats(top=0)['bytes'])])
+    ]
+    queues = outbound.queue_stats()
+    gauges.append(('chat_outbound_queue_connections', 'Connections whose outbound queue holds at most le bytes.',
+                   [(f'{{le="{bound}"}}', count) for bound, count in queues['by_bucket']]
+                   + [('{le="+Inf"}', queues['connections'])]))
+    gauges.append(('chat_outbound_queued_bytes_max', 'Bytes waiting in the largest outbound queue.',
+                   [('', queues['queued_bytes_max'])]))
+    gauges.append(('chat_outbound_queued_bytes_total', 'Bytes waiting in all outbound queues.',
+                   [('', queues['queued_bytes_total'])]))
+    gauges.append(('chat_outbound_dropped_frames', 'Frames dropped or collapsed because an outbound queue was full.',
+                   [(f'{{event="{event}",policy="{policy}"}}', count) for (event, policy), count in dict(outbound.dropped).items()]))
+    gauges.append(('chat_send_rate_limited', 'send_message events rejected by the per-user token bucket.',
+                   [('', send_limiter.limited)]))
+    hasher = password_hasher.stats()
+    gauges.append(('chat_password_hash_shed', 'Password hash requests rejected because the pool queue was full.',
+                   [('', hasher['shed'])]))
+    gauges.append(('chat_password_hash_timed_out', 'Password hash requests answered 503 after waiting past the timeout.',
+                   [('', hasher['timed_out'])]))
+    if room_batcher is not None:
+        batching = room_batcher.stats()
+        gauges.append(('chat_delivery_messages_per_frame', 'Average new_message payloads per delivered frame.',
+                       [('', batching['messages_per_frame'])]))
+    gauges.append(('chat_group_purge_queued_jobs', 'Group deletion jobs waiting for the purge thread.',
+                   [('', group_purger.stats()['queued_jobs'])]))
+    if message_writer is not None:
+        gauges.append(('chat_message_queue_depth', 'Messages waiting for the batched writer.',
+                       [('', message_writer.stats()['queue_depth'])]))
+    return gauges
+
+# Request/event latency, SQL counts and emit counts on /metrics; METRICS_ENABLED=0 installs no hooks at all.
+# Only clients in METRICS_ALLOW (comma-separated IPs/CIDRs, loopback by default) may read /metrics
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_ALLOW'] = os.environ.get('METRICS_ALLOW', '127.0.0.1/8,::1')
+if app.config['METRICS_ENABLED']:
+    install_metrics(app, socketio.server, metrics_gauges, parse_allowlist(app.config['METRICS_ALLOW']))
+
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    start_presence()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')), debug=message_bus is None)
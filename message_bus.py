@@ -0,0 +1,195 @@
+import json
+import os
+import pickle
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from collections import defaultdict
+import socketio
+from src.cache import set_invalidation_publisher, apply_remote_invalidation
+
+# Khung dữ liệu trên Unix socket: 4 byte độ dài (big-endian) + nội dung.
+# Nội dung: 1 byte lệnh (S = subscribe, P = publish) + 2 byte độ dài channel + channel + data.
+_HEADER = struct.Struct('>I')
+_CHANNEL_LEN = struct.Struct('>H')
+
+def _send_frame(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Message bus connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def _recv_frame(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, size)
+
+def _encode_command(command, channel, data=b''):
+    channel = channel.encode()
+    return command + _CHANNEL_LEN.pack(len(channel)) + channel + data
+
+def _decode_command(payload):
+    command = payload[:1]
+    (channel_len,) = _CHANNEL_LEN.unpack(payload[1:3])
+    channel = payload[3:3 + channel_len].decode()
+    return command, channel, payload[3 + channel_len:]
+
+class LocalBus:
+    """Bus trong cùng tiến trình: mỗi subscribe() nhận mọi tin publish sau đó trên channel.
+
+    Cả hai loại bus có cùng giao diện: publish(channel, data: bytes) và
+    subscribe(channel) trả về iterator các bytes nhận được.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, data):
+        with self._lock:
+            subscribers = list(self._subscribers[channel])
+        for subscriber in subscribers:
+            subscriber.put(data)
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers[channel].append(subscriber)
+        return iter(subscriber.get, None)
+
+class UnixSocketBus:
+    """Client của broker trên Unix socket (xem run_broker), dùng cho nhiều tiến trình trên một máy."""
+
+    def __init__(self, path):
+        self.path = path
+        self._publisher = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def publish(self, channel, data):
+        frame = _encode_command(b'P', channel, data)
+        with self._lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = self._connect()
+                _send_frame(self._publisher, frame)
+            except OSError:
+                # Thử kết nối lại một lần nếu broker vừa khởi động lại
+                self._publisher = self._connect()
+                _send_frame(self._publisher, frame)
+
+    def subscribe(self, channel):
+        """Đăng ký ngay với broker và trả về iterator các tin nhận được."""
+        sock = self._connect()
+        _send_frame(sock, _encode_command(b'S', channel))
+        return self._receive(sock)
+
+    def _receive(self, sock):
+        try:
+            while True:
+                yield _recv_frame(sock)
+        finally:
+            sock.close()
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server
+        try:
+            while True:
+                command, channel, data = _decode_command(_recv_frame(self.request))
+                if command == b'S':
+                    broker.add_subscriber(channel, self.request)
+                elif command == b'P':
+                    broker.relay(channel, data)
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            broker.remove_subscriber(self.request)
+
+class _Broker(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, _BrokerHandler)
+        self._subscribers = defaultdict(set)
+        self._send_locks = {}
+        self._lock = threading.Lock()
+
+    def add_subscriber(self, channel, sock):
+        with self._lock:
+            self._subscribers[channel].add(sock)
+            self._send_locks.setdefault(sock, threading.Lock())
+
+    def remove_subscriber(self, sock):
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(sock)
+            self._send_locks.pop(sock, None)
+
+    def relay(self, channel, data):
+        with self._lock:
+            targets = [(sock, self._send_locks[sock]) for sock in self._subscribers[channel]]
+        for sock, send_lock in targets:
+            try:
+                with send_lock:
+                    _send_frame(sock, data)
+            except OSError:
+                self.remove_subscriber(sock)
+
+def run_broker(path):
+    """Chạy broker chuyển tiếp tin nhắn giữa các worker (chặn cho đến khi bị dừng)."""
+    if os.path.exists(path):
+        os.unlink(path)
+    with _Broker(path) as broker:
+        broker.serve_forever()
+
+def create_bus(url):
+    """Tạo bus từ cấu hình: 'local' hoặc 'unix:/đường/dẫn.sock'."""
+    if url == 'local':
+        return LocalBus()
+    if url.startswith('unix:'):
+        return UnixSocketBus(url[len('unix:'):])
+    raise ValueError(f'Unsupported message bus: {url}')
+
+class BusManager(socketio.PubSubManager):
+    """Client manager của python-socketio chuyển các emit/room qua message bus.
+
+    Mọi worker dùng chung channel nên emit tới group_{id} hay user_{id}
+    đến được các client đang kết nối ở bất kỳ worker nào.
+    """
+    name = 'bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        self.bus = bus
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, pickle.dumps(data))
+
+    def _listen(self):
+        yield from self.bus.subscribe(self.channel)
+
+def start_cache_invalidation(bus, start_background_task, channel='cache'):
+    """Phát và nhận sự kiện invalidate cache giữa các worker qua bus."""
+    set_invalidation_publisher(
+        lambda cache_name, key: bus.publish(channel, json.dumps([cache_name, key]).encode())
+    )
+
+    def listen():
+        for data in bus.subscribe(channel):
+            cache_name, key = json.loads(data)
+            apply_remote_invalidation(cache_name, key)
+
+    start_background_task(listen)
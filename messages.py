@@ -1,9 +1,26 @@
-from flask import Blueprint, jsonify, request, session
-from src.models.user import User, Message, db
-from sqlalchemy import or_, and_
+import queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, current_app, jsonify, request, session
+from src.models.user import db
+from src.write_pipeline import save_message
+from src.cache import profiles
+from src.database import read_session
+from src.models.search_index import search_messages
+from src.models.indexes import private_conversation_key
+from src.sync import collect_missing_messages
+from src.recent_messages import recent_messages, load_history_page, stream_history
+from src.models.conversation import ConversationSummary
+from src.models.read_state import read_cursors, unread_columns, unread_count
+from src.pagination import parse_page_args, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 messages_bp = Blueprint('messages', __name__)
 
+def _busy_response():
+    # Hàng đợi ghi đầy hoặc lô chưa commit kịp: báo client thử lại sau thay vì lỗi 500
+    response = jsonify({'success': False, 'error': 'Máy chủ đang quá tải, vui lòng thử lại sau'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @messages_bp.route('/send', methods=['POST'])
 def send_message():
     if 'user_id' not in session:
@@ -16,6 +33,13 @@ def send_message():
     if not receiver_id:
         return jsonify({'success': False, 'error': 'ID người nhận không được để trống'}), 400
     
+    try:
+        if isinstance(receiver_id, bool):
+            raise ValueError()
+        receiver_id = int(receiver_id)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'ID người nhận không hợp lệ'}), 400
+    
     if not content:
         return jsonify({'success': False, 'error': 'Nội dung tin nhắn không được để trống'}), 400
     
@@ -23,19 +47,38 @@ def send_message():
         return jsonify({'success': False, 'error': 'Không thể gửi tin nhắn cho chính mình'}), 400
     
     # Kiểm tra xem người nhận có tồn tại không
-    receiver = User.query.get(receiver_id)
+    receiver = profiles.get(receiver_id)
     if not receiver:
         return jsonify({'success': False, 'error': 'Người nhận không tồn tại'}), 404
     
+    message_writer = current_app.extensions.get('message_writer')
+    if message_writer is not None:
+        # Chế độ ghi theo lô: chờ lô chứa tin nhắn được commit
+        try:
+            future = message_writer.submit({
+                'sender_id': session['user_id'],
+                'receiver_id': receiver_id,
+                'content': content
+            })
+            data = future.result(timeout=5)
+        except (queue.Full, FutureTimeoutError):
+            return _busy_response()
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+        
+        return jsonify({
+            'success': True,
+            'message': 'Gửi tin nhắn thành công',
+            'data': data
+        }), 201
+    
     try:
         # Tạo tin nhắn mới
-        message = Message(
-            sender_id=session['user_id'],
-            receiver_id=receiver_id,
-            content=content
-        )
-        db.session.add(message)
-        db.session.commit()
+        message = save_message({
+            'sender_id': session['user_id'],
+            'receiver_id': receiver_id,
+            'content': content
+        })
         
         return jsonify({
             'success': True,
@@ -61,17 +104,27 @@ def get_message_history():
     except ValueError:
         return jsonify({'success': False, 'error': 'ID bạn bè không hợp lệ'}), 400
     
-    # Lấy lịch sử tin nhắn giữa hai người
-    messages = Message.query.filter(
-        or_(
-            and_(Message.sender_id == session['user_id'], Message.receiver_id == friend_id),
-            and_(Message.sender_id == friend_id, Message.receiver_id == session['user_id'])
-        )
-    ).order_by(Message.timestamp.asc()).all()
+    try:
+        before, after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Lấy lịch sử tin nhắn giữa hai người (phân trang theo id, trang đầu từ bộ đệm nếu có)
+    conversation_key = private_conversation_key(session['user_id'], friend_id)
+    if request.args.get('stream') == '1':
+        # Xuất toàn bộ lịch sử (không giới hạn limit) dưới dạng stream
+        return stream_history(conversation_key, before, after)
+    
+    messages, next_cursor = load_history_page(conversation_key, before, after, limit)
+    
+    # Mở trang mới nhất nghĩa là người dùng đã đọc đến tin nhắn mới nhất
+    if before is None and after is None and messages:
+        read_cursors.mark(session['user_id'], conversation_key, messages[-1]['seq'])
     
     return jsonify({
         'success': True,
-        'messages': [message.to_dict() for message in messages]
+        'messages': messages,
+        'next_cursor': next_cursor
     }), 200
 
 @messages_bp.route('/conversations', methods=['GET'])
@@ -79,49 +132,105 @@ def get_conversations():
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
     
-    # Lấy danh sách cuộc trò chuyện (tin nhắn gần nhất với mỗi người)
-    subquery = db.session.query(
-        Message.id,
-        Message.sender_id,
-        Message.receiver_id,
-        Message.content,
-        Message.timestamp,
-        db.func.row_number().over(
-            partition_by=db.case(
-                (Message.sender_id == session['user_id'], Message.receiver_id),
-                else_=Message.sender_id
-            ),
-            order_by=Message.timestamp.desc()
-        ).label('rn')
-    ).filter(
-        or_(Message.sender_id == session['user_id'], Message.receiver_id == session['user_id'])
-    ).subquery()
-    
-    latest_messages = db.session.query(subquery).filter(subquery.c.rn == 1).all()
-    
-    conversations = []
-    for msg in latest_messages:
-        # Xác định ID của người bạn
-        friend_id = msg.receiver_id if msg.sender_id == session['user_id'] else msg.sender_id
-        friend = User.query.get(friend_id)
-        
-        if friend:
-            conversations.append({
-                'friend': friend.to_dict(),
-                'last_message': {
-                    'id': msg.id,
-                    'sender_id': msg.sender_id,
-                    'receiver_id': msg.receiver_id,
-                    'content': msg.content,
-                    'timestamp': msg.timestamp.isoformat()
-                }
-            })
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit is None or limit < 1:
+        return jsonify({'success': False, 'error': 'Tham số limit không hợp lệ'}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
     
-    # Sắp xếp theo thời gian tin nhắn gần nhất
-    conversations.sort(key=lambda x: x['last_message']['timestamp'], reverse=True)
+    # Đọc bảng tóm tắt cuộc trò chuyện, sắp xếp theo tin nhắn gần nhất (id tăng dần theo thời gian),
+    # kèm seq cuối và read cursor để tính số tin chưa đọc trong cùng truy vấn
+    user_id = session['user_id']
+    conversation_key = db.func.printf(
+        'private_%d_%d',
+        db.func.min(ConversationSummary.user_id, ConversationSummary.peer_id),
+        db.func.max(ConversationSummary.user_id, ConversationSummary.peer_id)
+    )
+    last_seq, last_read_seq, joins = unread_columns(user_id, conversation_key)
+    query = read_session.query(ConversationSummary, last_seq, last_read_seq)
+    for target, condition in joins:
+        query = query.outerjoin(target, condition)
+    query = query.filter(ConversationSummary.user_id == user_id)
+    if before is not None:
+        query = query.filter(ConversationSummary.last_message_id < before)
+    rows = query.order_by(ConversationSummary.last_message_id.desc()).limit(limit + 1).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    pending = read_cursors.pending_for(user_id)
+    peer_profiles = profiles.get_many([summary.peer_id for summary, _, _ in rows])
+    conversations = [{
+        'friend': peer_profiles[summary.peer_id],
+        'last_message': summary.to_dict(),
+        'unread_count': unread_count(seq, read_seq, pending.get(private_conversation_key(user_id, summary.peer_id), 0))
+    } for summary, seq, read_seq in rows if summary.peer_id in peer_profiles]
     
     return jsonify({
         'success': True,
-        'conversations': conversations
+        'conversations': conversations,
+        'next_cursor': rows[-1][0].last_message_id if has_more else None
     }), 200
 
+@messages_bp.route('/sync', methods=['POST'])
+def sync_messages():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    data = request.json or {}
+    cursors = data.get('conversations')
+    if not isinstance(cursors, dict):
+        return jsonify({'success': False, 'error': 'Danh sách cuộc trò chuyện không hợp lệ'}), 400
+    
+    # Chỉ trả về các tin nhắn có seq lớn hơn seq cuối cùng client đã thấy
+    return jsonify({
+        'success': True,
+        'conversations': collect_missing_messages(session['user_id'], cursors)
+    }), 200
+
+@messages_bp.route('/search', methods=['GET'])
+def search_message_history():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'Từ khóa tìm kiếm không được để trống'}), 400
+    
+    page = request.args.get('page', 1, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    if page is None or page < 1 or limit is None or limit < 1:
+        return jsonify({'success': False, 'error': 'Tham số phân trang không hợp lệ'}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    
+    # Tìm kiếm toàn văn (FTS5) trong các cuộc trò chuyện riêng và nhóm của người dùng
+    results, has_more = search_messages(read_session, session['user_id'], query, limit, (page - 1) * limit)
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'page': page,
+        'has_more': has_more
+    }), 200
+
+@messages_bp.route('/write_stats', methods=['GET'])
+def get_write_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    message_writer = current_app.extensions.get('message_writer')
+    return jsonify({
+        'success': True,
+        'batching_enabled': message_writer is not None,
+        'stats': message_writer.stats() if message_writer is not None else None
+    }), 200
+
+@messages_bp.route('/recent_buffer_stats', methods=['GET'])
+def get_recent_buffer_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
+    
+    return jsonify({
+        'success': True,
+        'stats': recent_messages.stats()
+    }), 200
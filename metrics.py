@@ -0,0 +1,245 @@
+import inspect
+import ipaddress
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from flask import Response, abort, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+# Cùng một câu SELECT chạy từ ngần này lần trở lên trong một request/sự kiện bị coi là N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+class Histogram:
+    """Histogram kiểu Prometheus (bucket cộng dồn) theo từng bộ nhãn, an toàn đa luồng."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, count, total) in sorted(self._series.items()):
+                label_text = _labels(self.label_names, labels)
+                prefix = label_text[:-1] + ',' if label_text else '{'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{prefix}le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{prefix}le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{label_text} {total}')
+                lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+class CounterMetric:
+    """Bộ đếm kiểu Prometheus theo từng bộ nhãn."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {value}')
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+http_latency = Histogram('chat_http_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method'))
+http_requests = CounterMetric('chat_http_requests_total', 'HTTP requests by route and status.', ('route', 'method', 'status'))
+socket_latency = Histogram('chat_socketio_event_duration_seconds', 'Socket.IO event handler latency.', ('event',))
+socket_emits = CounterMetric('chat_socketio_emits_total', 'Socket.IO emits by event name.', ('event',))
+sql_statements = CounterMetric('chat_sql_statements_total', 'SQL statements executed by scope.', ('scope',))
+sql_seconds = CounterMetric('chat_sql_duration_seconds_total', 'Time spent in SQL statements by scope.', ('scope',))
+sql_per_scope = Histogram(
+    'chat_sql_statements_per_call', 'SQL statements per request or socket event.', ('scope',), buckets=STATEMENT_BUCKETS
+)
+n_plus_one = CounterMetric('chat_sql_n_plus_one_total', 'Requests or events repeating one SELECT at least '
+                           f'{N_PLUS_ONE_THRESHOLD} times.', ('scope',))
+
+METRICS = [http_latency, http_requests, socket_latency, socket_emits, sql_statements, sql_seconds, sql_per_scope, n_plus_one]
+
+# Phạm vi đang chạy (route HTTP hoặc sự kiện Socket.IO) của luồng hiện tại
+_scope = threading.local()
+_reported_n_plus_one = set()
+
+def _begin_scope(name):
+    _scope.name = name
+    _scope.statements = Counter()
+    _scope.sql_seconds = 0.0
+
+def _end_scope():
+    name = getattr(_scope, 'name', None)
+    if name is None:
+        return
+    statements = _scope.statements
+    total = sum(statements.values())
+    sql_per_scope.observe((name,), total)
+    if total:
+        sql_statements.inc((name,), total)
+        sql_seconds.inc((name,), _scope.sql_seconds)
+        statement, repeats = statements.most_common(1)[0]
+        if repeats >= N_PLUS_ONE_THRESHOLD and statement.lstrip().upper().startswith('SELECT'):
+            n_plus_one.inc((name,))
+            if (name, statement) not in _reported_n_plus_one:
+                _reported_n_plus_one.add((name, statement))
+                print(f'Possible N+1 in {name}: {repeats}x {" ".join(statement.split())[:200]}')
+    _scope.name = None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Theo cursor: câu lệnh lỗi không gọi after_cursor_execute nên không được lệch thời gian câu sau
+    conn.info.setdefault('metrics_started', {})[id(cursor)] = time.perf_counter()
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    context = exception_context.execution_context
+    if connection is not None and context is not None:
+        connection.info.get('metrics_started', {}).pop(id(context.cursor), None)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started', {}).pop(id(cursor), None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    name = getattr(_scope, 'name', None)
+    if name is None:
+        # Luồng nền (ghi theo lô, flush read cursor...) không thuộc request nào
+        sql_statements.inc(('background',))
+        sql_seconds.inc(('background',), elapsed)
+        return
+    _scope.statements[statement] += 1
+    _scope.sql_seconds += elapsed
+
+def _timed_handler(event_name, handler):
+    if inspect.iscoroutinefunction(handler):
+        @wraps(handler)
+        async def async_wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return await handler(*args)
+            finally:
+                socket_latency.observe((event_name,), time.perf_counter() - started)
+        return async_wrapper
+
+    @wraps(handler)
+    def wrapper(*args):
+        started = time.perf_counter()
+        _begin_scope(f'socket:{event_name}')
+        try:
+            return handler(*args)
+        finally:
+            _end_scope()
+            socket_latency.observe((event_name,), time.perf_counter() - started)
+    return wrapper
+
+def instrument_socketio(server):
+    """Đo thời gian mọi handler và đếm emit theo tên sự kiện của một python-socketio Server/AsyncServer.
+
+    Gọi sau khi đã đăng ký tất cả handler.
+    """
+    for handlers in server.handlers.values():
+        for event_name, handler in list(handlers.items()):
+            handlers[event_name] = _timed_handler(event_name, handler)
+
+    manager_emit = server.manager.emit
+
+    def counted_emit(event_name, *args, **kwargs):
+        socket_emits.inc((event_name,))
+        return manager_emit(event_name, *args, **kwargs)
+    server.manager.emit = counted_emit
+
+def render_metrics(extra=None):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, help_text, samples in (extra() if extra is not None else []):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(f'{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
+
+def parse_allowlist(text):
+    """Danh sách mạng từ chuỗi 'ip/cidr,ip/cidr,...' (bỏ qua phần tử rỗng)."""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in text.split(',') if item.strip()]
+
+def _allowed(address, networks):
+    try:
+        ip = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+def install_metrics(app, socketio_server, extra=None, allow=None):
+    """Bật đo đạc cho app Flask và server Socket.IO, thêm endpoint /metrics.
+
+    Khi không gọi hàm này (METRICS_ENABLED=0) không có hook nào được đăng ký.
+    extra: hàm trả về các gauge bổ sung [(name, help, [(label_text, value)])].
+    allow: các mạng (ipaddress) được đọc /metrics; địa chỉ khác nhận 403.
+    None chỉ cho phép loopback.
+    """
+    allow = parse_allowlist('127.0.0.1/8,::1') if allow is None else allow
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        _begin_scope(request.url_rule.rule if request.url_rule is not None else 'unmatched')
+
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        route = getattr(_scope, 'name', None) or 'unmatched'
+        _end_scope()
+        http_latency.observe((route, request.method), time.perf_counter() - started)
+
+    @app.after_request
+    def count_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_requests.inc((route, request.method, response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if not _allowed(request.remote_addr, allow):
+            abort(403)
+        return Response(render_metrics(extra), mimetype='text/plain; version=0.0.4')
+
+    instrument_socketio(socketio_server)
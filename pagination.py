@@ -0,0 +1,45 @@
+from src.models.user import Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def parse_page_args(args):
+    """Đọc tham số phân trang (before, after, limit) từ query string.
+
+    Trả về tuple (before, after, limit); ném ValueError nếu tham số không hợp lệ.
+    """
+    before = args.get('before', type=int)
+    after = args.get('after', type=int)
+    if before is not None and after is not None:
+        raise ValueError('Chỉ được dùng một trong hai tham số before hoặc after')
+
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if limit is None or limit < 1:
+        raise ValueError('Tham số limit không hợp lệ')
+
+    return before, after, min(limit, MAX_PAGE_SIZE)
+
+def paginate_messages(query, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Phân trang tin nhắn theo khóa (keyset) trên Message.id.
+
+    - Không có cursor: trang mới nhất.
+    - before: các tin nhắn cũ hơn id đã cho.
+    - after: các tin nhắn mới hơn id đã cho.
+
+    Luôn trả về danh sách tăng dần theo id cùng với next_cursor (None nếu hết dữ liệu).
+    """
+    if after is not None:
+        rows = query.filter(Message.id > after).order_by(Message.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = rows[-1].id if has_more and rows else None
+    else:
+        if before is not None:
+            query = query.filter(Message.id < before)
+        rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        next_cursor = rows[0].id if has_more and rows else None
+
+    return rows, next_cursor
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+SCHEME = 'scrypt'
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi băm mật khẩu đã đầy hoặc chờ quá timeout; request nên được trả 503 để client thử lại sau."""
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+def _derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2), dklen=KEY_BYTES)
+
+def _hash(password):
+    salt = os.urandom(SALT_BYTES)
+    key = _derive(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}'
+
+def _verify(password, stored):
+    _, n, r, p, salt, key = stored.split('$')
+    derived = _derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(derived, base64.b64decode(key))
+
+def is_hashed(stored):
+    return stored.startswith(SCHEME + '$')
+
+class PasswordHasher:
+    """Băm/kiểm tra mật khẩu scrypt trên pool luồng giới hạn.
+
+    hashlib.scrypt nhả GIL nên các luồng xử lý socket vẫn chạy trong lúc băm.
+    Tổng số việc đang chạy và đang chờ bị giới hạn bởi max_pending; vượt quá
+    thì ném PasswordHasherBusy ngay (load shedding) thay vì xếp hàng vô hạn.
+    Chỗ trong max_pending chỉ được trả khi việc băm thật sự kết thúc, kể cả
+    khi request đã bỏ cuộc vì quá timeout (cũng báo PasswordHasherBusy).
+    """
+
+    def __init__(self, workers=2, max_pending=32, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def configure(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, fn, *args):
+        if not self._pending.acquire(blocking=False):
+            with self._lock:
+                self.shed += 1
+            raise PasswordHasherBusy()
+        pending = self._pending
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            pending.release()
+            raise
+        # Trả chỗ khi việc kết thúc (hoặc bị hủy khi còn trong hàng đợi), không phải khi hết timeout
+        future.add_done_callback(lambda _: pending.release())
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise PasswordHasherBusy()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def hash(self, password):
+        return self._run(_hash, password)
+
+    def verify(self, password, stored):
+        """Trả về (khớp, cần_băm_lại). Dòng cũ lưu mật khẩu thô được so sánh trực tiếp và cần băm lại."""
+        if not stored:
+            return False, False
+        if not is_hashed(stored):
+            matches = hmac.compare_digest(stored.encode(), password.encode())
+            return matches, matches
+        return self._run(_verify, password, stored), False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'shed': self.shed,
+                'timed_out': self.timed_out
+            }
+
+password_hasher = PasswordHasher()
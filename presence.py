@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from src.cache import friend_lists
+
+class PresenceTracker:
+    """Theo dõi người dùng đang online trong tiến trình này.
+
+    Mỗi người dùng có thể có nhiều kết nối (nhiều tab/thiết bị), mỗi kết nối
+    có thời điểm heartbeat cuối; kết nối không gửi heartbeat quá
+    heartbeat_timeout giây bị coi là đã ngắt. Các thay đổi online/offline
+    được gom lại và chỉ trạng thái cuối cùng trong mỗi chu kỳ được gửi cho
+    bạn bè (xem collect_presence_diffs).
+    """
+
+    def __init__(self, heartbeat_timeout=90.0, max_digest_users=100000):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_digest_users = max_digest_users
+        # Khi nhiều worker dùng chung message bus, mỗi tiến trình chỉ thấy kết nối của mình:
+        # lúc đó không được bỏ thông báo cho người dùng "offline"
+        self.authoritative = True
+        self._connections = {}
+        # Trạng thái đã gửi cho bạn bè lần trước, để bỏ các thay đổi qua lại trong cùng chu kỳ
+        self._announced = {}
+        self._changed = set()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, sid):
+        with self._lock:
+            self._connections.setdefault(int(user_id), {})[sid] = time.monotonic()
+            self._changed.add(int(user_id))
+
+    def heartbeat(self, user_id, sid):
+        with self._lock:
+            connections = self._connections.get(int(user_id))
+            if connections is not None and sid in connections:
+                connections[sid] = time.monotonic()
+                return True
+            return False
+
+    def disconnect(self, user_id, sid):
+        with self._lock:
+            connections = self._connections.get(int(user_id))
+            if connections is None:
+                return
+            connections.pop(sid, None)
+            if not connections:
+                del self._connections[int(user_id)]
+                self._changed.add(int(user_id))
+
+    def expire(self):
+        """Bỏ các kết nối quá hạn heartbeat; trả về danh sách (user_id, sid) đã bỏ."""
+        deadline = time.monotonic() - self.heartbeat_timeout
+        expired = []
+        with self._lock:
+            for user_id, connections in list(self._connections.items()):
+                for sid, last_seen in list(connections.items()):
+                    if last_seen < deadline:
+                        del connections[sid]
+                        expired.append((user_id, sid))
+                if not connections:
+                    del self._connections[user_id]
+                    self._changed.add(user_id)
+        return expired
+
+    def is_online(self, user_id):
+        return int(user_id) in self._connections
+
+    def online_among(self, user_ids):
+        connections = self._connections
+        return [user_id for user_id in user_ids if user_id in connections]
+
+    def drain_changes(self):
+        """Trả về {user_id: online} cho các người dùng đổi trạng thái từ lần gửi trước."""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            changes = {}
+            for user_id in changed:
+                online = user_id in self._connections
+                if self._announced.get(user_id, False) != online:
+                    changes[user_id] = online
+                    if online:
+                        self._announced[user_id] = True
+                    else:
+                        self._announced.pop(user_id, None)
+            return changes
+
+    def record_missed(self, user_id, conversation_key, notification):
+        """Ghi thông báo cho người dùng offline vào digest gọn: mỗi cuộc trò chuyện một mục."""
+        user_id = int(user_id)
+        with self._lock:
+            digest = self._digests.get(user_id)
+            if digest is None:
+                digest = self._digests[user_id] = {}
+                while len(self._digests) > self.max_digest_users:
+                    self._digests.popitem(last=False)
+            entry = digest.get(conversation_key)
+            if entry is None:
+                entry = digest[conversation_key] = dict(notification, count=0)
+            entry.update(notification)
+            entry['count'] += 1
+
+    def take_digest(self, user_id):
+        with self._lock:
+            digest = self._digests.pop(int(user_id), None)
+        if not digest:
+            return []
+        return [dict(entry, conversation=key) for key, entry in digest.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'online_users': len(self._connections),
+                'connections': sum(len(connections) for connections in self._connections.values()),
+                'pending_digests': len(self._digests),
+                'authoritative': self.authoritative
+            }
+
+presence = PresenceTracker()
+
+def collect_presence_diffs(changes):
+    """Gom các thay đổi thành một bản diff cho mỗi người bạn đang online.
+
+    changes: {user_id: online}. Trả về {friend_id: {'online': [...], 'offline': [...]}}.
+    """
+    diffs = {}
+    for user_id, online in changes.items():
+        for friend_id in presence.online_among(friend_lists.get_friends(user_id)):
+            diff = diffs.get(friend_id)
+            if diff is None:
+                diff = diffs[friend_id] = {'online': [], 'offline': []}
+            diff['online' if online else 'offline'].append(user_id)
+    return diffs
+
+def filter_offline(user_ids, conversation_key, notification):
+    """Tách người nhận online; người offline được ghi vào digest thay vì nhận emit."""
+    if not presence.authoritative:
+        return list(user_ids)
+    online = []
+    for user_id in user_ids:
+        if presence.is_online(user_id):
+            online.append(user_id)
+        else:
+            presence.record_missed(user_id, conversation_key, notification)
+    return online
+
+def presence_cycle():
+    """Một chu kỳ gửi presence: bỏ kết nối quá hạn rồi trả về diff cho từng người bạn."""
+    presence.expire()
+    return collect_presence_diffs(presence.drain_changes())
+
+def connect_snapshot(user_id):
+    """Dữ liệu gửi cho kết nối mới: bạn bè đang online và digest thông báo bị lỡ."""
+    return (
+        presence.online_among(friend_lists.get_friends(user_id)),
+        presence.take_digest(user_id)
+    )
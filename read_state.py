@@ -0,0 +1,157 @@
+import atexit
+import threading
+from sqlalchemy.dialects.sqlite import insert
+from src.models.user import db, GroupMember
+from src.models.sequence import ConversationSequence
+from src.models.conversation import ConversationSummary
+from src.database import read_session
+
+class ReadCursor(db.Model):
+    """Seq cuối cùng người dùng đã đọc trong mỗi cuộc trò chuyện.
+
+    Số tin chưa đọc = ConversationSequence.last_seq - last_read_seq: bộ đếm
+    seq tăng khi gửi tin nên không cần đếm lại bảng Message.
+    """
+    __tablename__ = 'read_cursor'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    conversation_key = db.Column(db.String(40), primary_key=True)
+    last_read_seq = db.Column(db.Integer, nullable=False, default=0)
+
+class ReadCursorBuffer:
+    """Gom các cập nhật read cursor trong bộ nhớ và ghi theo lô định kỳ.
+
+    Nhiều lần mark_read liên tiếp cho cùng (user, conversation) chỉ giữ seq lớn
+    nhất; luồng nền ghi tất cả trong một transaction mỗi interval_ms.
+    """
+
+    def __init__(self, interval_ms=1000):
+        self.interval = interval_ms / 1000.0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.app = None
+        self.flushes = 0
+        self.flushed_cursors = 0
+
+    def mark(self, user_id, conversation_key, seq):
+        if not seq:
+            return
+        key = (int(user_id), conversation_key)
+        with self._lock:
+            if seq > self._pending.get(key, 0):
+                self._pending[key] = seq
+
+    def pending_for(self, user_id):
+        """Các cursor chưa ghi của một người dùng: {conversation_key: seq}."""
+        user_id = int(user_id)
+        with self._lock:
+            return {key: seq for (uid, key), seq in self._pending.items() if uid == user_id}
+
+    def start(self, app):
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='read-cursor-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = [
+            {'user_id': user_id, 'conversation_key': key, 'last_read_seq': seq}
+            for (user_id, key), seq in pending.items()
+        ]
+        stmt = insert(ReadCursor)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'conversation_key'],
+            set_={'last_read_seq': db.func.max(ReadCursor.last_read_seq, stmt.excluded.last_read_seq)}
+        )
+        with self.app.app_context():
+            try:
+                db.session.execute(stmt, rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f'Error flushing read cursors: {e}')
+                # Đưa lại vào hàng chờ để lần sau ghi tiếp
+                for (user_id, key), seq in pending.items():
+                    self.mark(user_id, key, seq)
+                return
+        self.flushes += 1
+        self.flushed_cursors += len(rows)
+
+read_cursors = ReadCursorBuffer()
+
+def unread_columns(user_id, conversation_key_expr):
+    """Cột (last_seq, last_read_seq) cho truy vấn danh sách, nối theo biểu thức conversation_key.
+
+    Trả về (last_seq, last_read_seq, joins) để gắn vào query bằng outerjoin.
+    """
+    return (
+        db.func.coalesce(ConversationSequence.last_seq, 0),
+        db.func.coalesce(ReadCursor.last_read_seq, 0),
+        [
+            (ConversationSequence, ConversationSequence.conversation_key == conversation_key_expr),
+            (ReadCursor, db.and_(ReadCursor.user_id == user_id, ReadCursor.conversation_key == conversation_key_expr))
+        ]
+    )
+
+def clamp_read_seq(conversation_key, seq):
+    """Giới hạn seq client gửi lên trong [0, last_seq] của cuộc trò chuyện.
+
+    seq lớn hơn số đã cấp sẽ làm số chưa đọc của các tin gửi sau bị âm (hiển thị 0).
+    """
+    last_seq = read_session.query(ConversationSequence.last_seq).filter(
+        ConversationSequence.conversation_key == conversation_key
+    ).scalar()
+    return max(0, min(seq, last_seq or 0))
+
+def unread_count(last_seq, last_read_seq, pending_seq=0):
+    return max(0, last_seq - max(last_read_seq, pending_seq))
+
+def ensure_read_state():
+    """Khởi tạo read cursor cho database cũ (chỉ chạy khi bảng còn trống).
+
+    Cuộc trò chuyện riêng giữ nguyên số chưa đọc cũ (cột unread_count của
+    conversation_summary, bị xóa sau khi chuyển), nhóm coi như đã đọc hết.
+    """
+    summary_table = ConversationSummary.__tablename__
+    columns = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info({summary_table})'))}
+    legacy_unread = 'unread_count' in columns
+
+    if db.session.query(ReadCursor.user_id).first() is None:
+        unread = 's.unread_count' if legacy_unread else '0'
+        db.session.execute(db.text(f"""
+            INSERT OR IGNORE INTO {ReadCursor.__tablename__} (user_id, conversation_key, last_read_seq)
+            SELECT s.user_id, q.conversation_key, max(q.last_seq - {unread}, 0)
+            FROM {summary_table} s
+            JOIN {ConversationSequence.__tablename__} q
+              ON q.conversation_key = printf('private_%d_%d', min(s.user_id, s.peer_id), max(s.user_id, s.peer_id))
+        """))
+        db.session.execute(db.text(f"""
+            INSERT OR IGNORE INTO {ReadCursor.__tablename__} (user_id, conversation_key, last_read_seq)
+            SELECT g.user_id, q.conversation_key, q.last_seq
+            FROM {GroupMember.__tablename__} g
+            JOIN {ConversationSequence.__tablename__} q ON q.conversation_key = 'group_' || g.group_id
+        """))
+        db.session.commit()
+
+    if legacy_unread:
+        db.session.execute(db.text(f'ALTER TABLE {summary_table} DROP COLUMN unread_count'))
+        db.session.commit()
@@ -0,0 +1,217 @@
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from itertools import chain
+from src.models.user import Message
+import src.models.columns  # Message.conversation_key
+from src.database import read_session
+from src.pagination import paginate_messages
+from src.sync import message_payload
+from src.json_backend import stream_json_array, STREAM_BATCH_ROWS
+from src.archive import message_archive
+
+class _RoomBuffer:
+    __slots__ = ('ids', 'frames', 'bytes', 'complete', 'hits', 'misses')
+
+    def __init__(self):
+        self.ids = []
+        self.frames = []
+        self.bytes = 0
+        # True khi bộ đệm chứa toàn bộ lịch sử của phòng (không còn tin nhắn cũ hơn)
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+
+class RecentMessageBuffer:
+    """Bộ đệm vòng các tin nhắn gần nhất (đã serialize JSON) cho mỗi phòng private_*/group_*.
+
+    Mỗi phòng giữ tối đa per_room tin nhắn liên tiếp mới nhất; tổng dung lượng
+    bị giới hạn bởi max_bytes, vượt quá thì bỏ phòng ít dùng nhất (LRU). Phòng
+    chỉ được tạo khi trang đầu lịch sử được đọc từ database (seed), sau đó các
+    đường ghi gọi append() nên bộ đệm luôn là đoạn cuối liên tục của lịch sử.
+    """
+
+    def __init__(self, per_room=100, max_bytes=32 * 1024 * 1024):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self._rooms = OrderedDict()
+        # id tin nhắn mới nhất đã ghi cho các phòng chưa có bộ đệm, để seed không ghi đè dữ liệu cũ
+        self._latest_ids = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._rooms:
+            _, room = self._rooms.popitem(last=False)
+            self._bytes -= room.bytes
+
+    def _note_latest(self, key, message_id):
+        if message_id > self._latest_ids.get(key, 0):
+            self._latest_ids[key] = message_id
+            self._latest_ids.move_to_end(key)
+            while len(self._latest_ids) > 100000:
+                self._latest_ids.popitem(last=False)
+
+    def append(self, message):
+        """Thêm tin nhắn vừa commit vào bộ đệm của phòng (nếu phòng đang được đệm)."""
+        if not self.enabled:
+            return
+        key = message.conversation_key
+        frame = json.dumps(message_payload(message), separators=(',', ':')).encode()
+        with self._lock:
+            room = self._rooms.get(key)
+            if room is None:
+                self._note_latest(key, message.id)
+                return
+            position = bisect.bisect_left(room.ids, message.id)
+            if position < len(room.ids) and room.ids[position] == message.id:
+                return
+            room.ids.insert(position, message.id)
+            room.frames.insert(position, frame)
+            room.bytes += len(frame)
+            self._bytes += len(frame)
+            while len(room.ids) > self.per_room:
+                room.ids.pop(0)
+                dropped = room.frames.pop(0)
+                room.bytes -= len(dropped)
+                self._bytes -= len(dropped)
+                room.complete = False
+            self._rooms.move_to_end(key)
+            self._evict()
+
+    def seed(self, key, messages, complete):
+        """Tạo bộ đệm cho phòng từ trang mới nhất vừa đọc từ database (tăng dần theo id)."""
+        if not self.enabled:
+            return
+        frames = [json.dumps(message_payload(message), separators=(',', ':')).encode() for message in messages]
+        with self._lock:
+            if key in self._rooms:
+                return
+            newest = messages[-1].id if messages else 0
+            if self._latest_ids.get(key, 0) > newest:
+                # Có tin nhắn mới được ghi sau khi đọc trang này; lần đọc sau sẽ seed lại
+                return
+            self._latest_ids.pop(key, None)
+            room = _RoomBuffer()
+            room.ids = [message.id for message in messages][-self.per_room:]
+            room.frames = frames[-self.per_room:]
+            room.bytes = sum(len(frame) for frame in room.frames)
+            room.complete = complete and len(messages) <= self.per_room
+            room.misses = 1
+            self._rooms[key] = room
+            self._bytes += room.bytes
+            self._evict()
+
+    def get_page(self, key, limit):
+        """Trả về (messages, next_cursor) cho trang mới nhất, hoặc None nếu không phục vụ được."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            room = self._rooms.get(key)
+            if room is None or (len(room.ids) < limit and not room.complete):
+                self.misses += 1
+                if room is not None:
+                    room.misses += 1
+                return None
+            self._rooms.move_to_end(key)
+            room.hits += 1
+            self.hits += 1
+            frames = room.frames[-limit:]
+            has_more = len(room.ids) > limit or not room.complete
+            next_cursor = room.ids[-limit] if has_more and frames else None
+        return [json.loads(frame) for frame in frames], next_cursor
+
+    def drop(self, key):
+        with self._lock:
+            room = self._rooms.pop(key, None)
+            if room is not None:
+                self._bytes -= room.bytes
+            self._latest_ids.pop(key, None)
+
+    def stats(self, top=20):
+        with self._lock:
+            total = self.hits + self.misses
+            rooms = sorted(self._rooms.items(), key=lambda item: item[1].hits + item[1].misses, reverse=True)[:top]
+            return {
+                'enabled': self.enabled,
+                'rooms': len(self._rooms),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'per_room': {
+                    key: {
+                        'messages': len(room.ids),
+                        'bytes': room.bytes,
+                        'hits': room.hits,
+                        'misses': room.misses,
+                        'hit_rate': room.hits / (room.hits + room.misses) if room.hits + room.misses else 0.0
+                    } for key, room in rooms
+                }
+            }
+
+recent_messages = RecentMessageBuffer()
+
+def load_history_page(conversation_key, before=None, after=None, limit=50):
+    """Đọc một trang lịch sử: trang mới nhất lấy từ bộ đệm nếu có, còn lại đọc database.
+
+    Tin nhắn cũ đã chuyển sang kho lưu trữ là đoạn đầu (theo id) của cuộc trò
+    chuyện, nên trang đi tiếp vào kho khi database hết tin cũ hơn (before) và
+    bắt đầu từ kho khi after nằm trong khoảng đã lưu trữ.
+    Trả về (danh sách payload tin nhắn tăng dần theo id, next_cursor).
+    """
+    first_page = before is None and after is None
+    if first_page:
+        cached = recent_messages.get_page(conversation_key, limit)
+        if cached is not None:
+            return cached
+
+    query = read_session.query(Message).filter(Message.conversation_key == conversation_key)
+    archived_up_to = message_archive.last_id(conversation_key)
+    if after is not None and after < archived_up_to:
+        archived, has_more = message_archive.page_after(conversation_key, after, limit)
+        if has_more:
+            return archived, archived[-1]['id']
+        remaining = limit - len(archived)
+        if remaining == 0:
+            more = query.filter(Message.id > archived_up_to).first() is not None
+            return archived, archived[-1]['id'] if more else None
+        messages, next_cursor = paginate_messages(query, None, archived_up_to, remaining)
+        return archived + [message_payload(message) for message in messages], next_cursor
+
+    messages, next_cursor = paginate_messages(query, before, after, limit)
+    if first_page:
+        recent_messages.seed(conversation_key, messages, complete=next_cursor is None and not archived_up_to)
+    payloads = [message_payload(message) for message in messages]
+    if after is None and next_cursor is None and archived_up_to:
+        # Database đã hết tin nhắn cũ hơn: đọc tiếp từ kho lưu trữ
+        boundary = messages[0].id if messages else before
+        archived, has_more = message_archive.page_before(conversation_key, boundary, limit - len(payloads))
+        payloads = archived + payloads
+        next_cursor = payloads[0]['id'] if has_more else None
+    return payloads, next_cursor
+
+def stream_history(conversation_key, before=None, after=None):
+    """Response JSON chứa toàn bộ lịch sử (tăng dần theo id) trong khoảng before/after, ghi dần từ cursor.
+
+    Phần đã lưu trữ được đọc trước, từng khối một từ kho; sau đó chỉ một lô
+    STREAM_BATCH_ROWS tin nhắn nằm trong bộ nhớ tại một thời điểm, nên dung
+    lượng bộ nhớ không tăng theo độ dài cuộc trò chuyện.
+    """
+    archived_up_to = message_archive.last_id(conversation_key)
+    query = read_session.query(Message).filter(Message.conversation_key == conversation_key)
+    if before is not None:
+        query = query.filter(Message.id < before)
+    if after is not None or archived_up_to:
+        query = query.filter(Message.id > max(after or 0, archived_up_to))
+    rows = query.order_by(Message.id.asc()).yield_per(STREAM_BATCH_ROWS)
+    payloads = chain(
+        message_archive.iter_messages(conversation_key, before, after),
+        (message_payload(message) for message in rows)
+    )
+    return stream_json_array({'success': True}, 'messages', payloads, lambda payload: payload)
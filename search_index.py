@@ -0,0 +1,110 @@
+import html
+from src.models.user import db, Message, Group, GroupMember
+
+FTS_TABLE = 'message_fts'
+# Ký tự đánh dấu đoạn khớp do snippet() chèn vào; được thay bằng <mark> sau khi escape nội dung
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+def _ddl():
+    message_table = Message.__tablename__
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"content, content='{message_table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        # Trigger giữ chỉ mục đồng bộ với mọi đường ghi (socket, REST, ghi theo lô, xóa nhóm)
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {message_table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {message_table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON {message_table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+        END"""
+    ]
+
+def ensure_search_index():
+    """Tạo bảng FTS5 và trigger nếu chưa có; dựng lại chỉ mục khi bảng vừa được tạo."""
+    exists = db.session.execute(
+        db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first()
+    for statement in _ddl():
+        db.session.execute(db.text(statement))
+    if not exists:
+        rebuild_search_index()
+    db.session.commit()
+
+def rebuild_search_index():
+    """Dựng lại toàn bộ chỉ mục từ bảng Message (dùng cho database cũ hoặc khi nghi ngờ lệch)."""
+    db.session.execute(db.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+
+def build_match_query(text):
+    """Chuyển chuỗi người dùng nhập thành truy vấn FTS5 an toàn.
+
+    Mỗi từ được đặt trong dấu nháy (AND giữa các từ); từ cuối được tìm theo tiền tố.
+    """
+    tokens = [token.replace('"', '""') for token in text.split()]
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def highlight_snippet(marked):
+    """HTML an toàn từ snippet có ký tự đánh dấu: escape nội dung tin nhắn rồi mới chèn <mark>."""
+    if marked is None:
+        return None
+    return html.escape(marked).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+def search_messages(session, user_id, text, limit, offset):
+    """Tìm tin nhắn trong các cuộc trò chuyện của user_id, xếp hạng theo bm25.
+
+    Chỉ trả về tin nhắn riêng mà user_id gửi/nhận và tin nhắn trong các nhóm
+    user_id đang là thành viên. Trả về (kết quả, has_more).
+    """
+    match = build_match_query(text)
+    if match is None:
+        return [], False
+
+    message_table = Message.__tablename__
+    member_table = GroupMember.__tablename__
+    group_table = Group.__tablename__
+    statement = db.text(f"""
+        SELECT m.id, m.sender_id, m.receiver_id, m.group_id, m.timestamp,
+               snippet({FTS_TABLE}, 0, :mark_start, :mark_end, '…', 16) AS snippet
+        FROM {FTS_TABLE}
+        JOIN {message_table} m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :match
+          AND (
+            (m.receiver_id IS NOT NULL AND (m.sender_id = :user_id OR m.receiver_id = :user_id))
+            OR m.group_id IN (
+              SELECT gm.group_id FROM {member_table} gm JOIN "{group_table}" g ON g.id = gm.group_id
+              WHERE gm.user_id = :user_id AND g.deleted_at IS NULL
+            )
+          )
+        ORDER BY {FTS_TABLE}.rank
+        LIMIT :limit OFFSET :offset
+    """).columns(timestamp=db.DateTime)
+
+    rows = session.execute(statement, {
+        'match': match,
+        'mark_start': _MARK_START,
+        'mark_end': _MARK_END,
+        'user_id': user_id,
+        'limit': limit + 1,
+        'offset': offset
+    }).all()
+
+    results = [{
+        'id': row.id,
+        'sender_id': row.sender_id,
+        'receiver_id': row.receiver_id,
+        'group_id': row.group_id,
+        'type': 'group' if row.group_id is not None else 'friend',
+        'snippet': highlight_snippet(row.snippet),
+        'timestamp': row.timestamp.isoformat() if row.timestamp else None
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
@@ -0,0 +1,52 @@
+from sqlalchemy import event
+from src.models.user import db, Message
+import src.models.columns  # Message.seq
+from src.models.indexes import message_conversation_key
+
+class ConversationSequence(db.Model):
+    """Số thứ tự cuối cùng đã cấp cho mỗi cuộc trò chuyện (conversation_key)."""
+    __tablename__ = 'conversation_sequence'
+
+    conversation_key = db.Column(db.String(40), primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+
+# Đồng bộ tin bị lỡ đọc theo (conversation_key, seq)
+message_seq_index = db.Index('ix_message_conversation_key_seq', Message.conversation_key, Message.seq)
+
+_NEXT_SEQ = db.text(f"""
+    INSERT INTO {ConversationSequence.__tablename__} (conversation_key, last_seq) VALUES (:key, 1)
+    ON CONFLICT (conversation_key) DO UPDATE SET last_seq = last_seq + 1
+    RETURNING last_seq
+""")
+
+@event.listens_for(Message, 'before_insert')
+def _assign_seq(mapper, connection, target):
+    # Chạy trong cùng transaction ghi nên SQLite đảm bảo số thứ tự không trùng
+    if target.seq is None:
+        key = target.conversation_key or message_conversation_key(target)
+        target.seq = connection.execute(_NEXT_SEQ, {'key': key}).scalar()
+
+def ensure_sequences():
+    """Thêm cột seq cho database cũ, đánh số các tin nhắn hiện có và khởi tạo bộ đếm."""
+    message_table = Message.__tablename__
+    columns = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info({message_table})'))}
+    if 'seq' not in columns:
+        db.session.execute(db.text(f'ALTER TABLE {message_table} ADD COLUMN seq INTEGER'))
+        db.session.commit()
+
+    if db.session.execute(db.text(f'SELECT 1 FROM {message_table} WHERE seq IS NULL LIMIT 1')).first():
+        db.session.execute(db.text(f"""
+            UPDATE {message_table} SET seq = numbered.rn
+            FROM (
+                SELECT id, row_number() OVER (PARTITION BY conversation_key ORDER BY id) AS rn
+                FROM {message_table}
+            ) AS numbered
+            WHERE {message_table}.id = numbered.id AND {message_table}.seq IS NULL
+        """))
+        db.session.execute(db.text(f"""
+            INSERT OR REPLACE INTO {ConversationSequence.__tablename__} (conversation_key, last_seq)
+            SELECT conversation_key, max(seq) FROM {message_table} GROUP BY conversation_key
+        """))
+        db.session.commit()
+
+    message_seq_index.create(db.engine, checkfirst=True)
@@ -1,6 +1,13 @@
 // WebSocket connection
 let socket = null;
 
+// Last seen sequence number per conversation (e.g. 'private_1_2', 'group_5'),
+// used to fetch only the missed messages after a reconnect or a gap
+const lastSeenSeq = {};
+
+// Heartbeat timer keeping this connection marked online on the server
+let heartbeatTimer = null;
+
 // Initialize WebSocket connection
 function initializeSocket() {
     if (socket) {
@@ -13,6 +20,11 @@ function initializeSocket() {
     socket.on('connect', () => {
         console.log('Connected to server');
         showNotification('Đã kết nối đến server', 'success');
+        
+        // Catch up on messages sent while we were offline
+        if (Object.keys(lastSeenSeq).length > 0) {
+            requestSync({ ...lastSeenSeq });
+        }
     });
     
     socket.on('disconnect', () => {
@@ -30,9 +42,93 @@ function initializeSocket() {
         handleNewMessage(data);
     });
     
+    // Several messages of one busy room delivered in a single frame
+    socket.on('new_messages', (data) => {
+        handleNewMessages(data.messages);
+    });
+    
     socket.on('message_notification', (data) => {
         handleMessageNotification(data);
     });
+    
+    // Presence events
+    socket.on('presence_snapshot', (data) => {
+        startHeartbeat(data.heartbeat_interval);
+        friends.forEach(friend => {
+            friend.online = data.online.includes(friend.id);
+        });
+        renderFriends();
+    });
+    
+    socket.on('presence_update', (data) => {
+        handlePresenceUpdate(data);
+    });
+    
+    socket.on('pending_notifications', (data) => {
+        handlePendingNotifications(data.notifications);
+    });
+    
+    // Sent by the server when this client's outbound queue was full
+    socket.on('notifications_collapsed', (data) => {
+        showNotification(`Bạn có ${data.count} thông báo mới`, 'info');
+    });
+    
+    socket.on('sync_required', (data) => {
+        const cursors = {};
+        data.conversations.forEach(conversation => {
+            cursors[conversation] = lastSeenSeq[conversation] || 0;
+        });
+        if (Object.keys(cursors).length > 0) {
+            requestSync(cursors);
+        }
+    });
+    
+    // The creator deleted a group this user belongs to
+    socket.on('group_deleted', (data) => {
+        handleGroupDeleted(data.group_id);
+    });
+}
+
+function handleGroupDeleted(groupId) {
+    groups = groups.filter(group => group.id !== groupId);
+    renderGroups();
+    if (currentChatType === 'group' && currentChat && currentChat.id === groupId) {
+        closeChatContainer();
+        showNotification('Nhóm đã bị xóa', 'info');
+    }
+}
+
+// Send a heartbeat every interval seconds while connected
+function startHeartbeat(interval) {
+    if (heartbeatTimer) clearInterval(heartbeatTimer);
+    heartbeatTimer = setInterval(() => {
+        if (socket && socket.connected) {
+            socket.emit('heartbeat');
+        }
+    }, (interval || 25) * 1000);
+}
+
+// Apply a batched presence diff: {online: [user ids], offline: [user ids]}
+function handlePresenceUpdate(data) {
+    let changed = false;
+    friends.forEach(friend => {
+        if (data.online.includes(friend.id) && !friend.online) {
+            friend.online = true;
+            changed = true;
+        } else if (data.offline.includes(friend.id) && friend.online) {
+            friend.online = false;
+            changed = true;
+        }
+    });
+    if (changed) renderFriends();
+}
+
+// Summarize notifications missed while offline (one entry per conversation)
+function handlePendingNotifications(notifications) {
+    notifications.forEach(item => {
+        const where = item.type === 'group' ? `nhóm ${item.group_name}` : item.from_user;
+        showNotification(`${item.count} tin nhắn mới từ ${where}: ${item.content}`, 'info');
+    });
 }
 
 // Join a chat room
@@ -63,11 +159,98 @@ function sendMessageViaSocket(chatData, type, content) {
         type: type,
         id: chatData.id,
         content: content
+    }, (response) => {
+        if (response && response.error === 'rate_limited') {
+            showNotification('Bạn gửi tin nhắn quá nhanh, vui lòng chờ một chút', 'error');
+        } else if (response && response.error === 'busy') {
+            showNotification('Máy chủ đang quá tải, tin nhắn chưa được gửi', 'error');
+        }
+    });
+}
+
+// Remember the highest sequence number seen for a conversation
+function trackMessageSeq(message) {
+    if (!message.conversation || !message.seq) return;
+    
+    const lastSeq = lastSeenSeq[message.conversation] || 0;
+    if (message.seq > lastSeq) {
+        lastSeenSeq[message.conversation] = message.seq;
+    }
+}
+
+// Ask the server for messages after the given {conversation: last_seen_seq} cursors
+function requestSync(cursors) {
+    if (!socket) return;
+    
+    socket.emit('sync', { conversations: cursors }, (response) => {
+        if (!response || !response.success) return;
+        
+        const remaining = {};
+        Object.entries(response.conversations).forEach(([conversation, result]) => {
+            result.messages.forEach(message => applyNewMessage(message));
+            if (result.has_more) {
+                remaining[conversation] = lastSeenSeq[conversation];
+            }
+        });
+        
+        if (Object.keys(remaining).length > 0) {
+            requestSync(remaining);
+        }
     });
 }
 
 // Handle incoming messages
 function handleNewMessage(data) {
+    if (data.conversation && data.seq) {
+        const lastSeq = lastSeenSeq[data.conversation];
+        
+        // Already shown (e.g. delivered again by a sync)
+        if (lastSeq && data.seq <= lastSeq) return;
+        
+        // Gap detected: fetch the missing range, which includes this message
+        if (lastSeq && data.seq > lastSeq + 1) {
+            requestSync({ [data.conversation]: lastSeq });
+            return;
+        }
+    }
+    
+    applyNewMessage(data);
+}
+
+// Handle a batch of messages of one conversation with a single DOM update
+function handleNewMessages(messages) {
+    const fragment = document.createDocumentFragment();
+    let lastShown = null;
+    
+    for (const data of messages) {
+        const lastSeq = lastSeenSeq[data.conversation];
+        if (lastSeq && data.seq <= lastSeq) continue;
+        
+        // Gap detected: the sync response covers the rest of the batch
+        if (lastSeq && data.seq > lastSeq + 1) {
+            requestSync({ [data.conversation]: lastSeq });
+            break;
+        }
+        
+        if (applyNewMessage(data, fragment)) {
+            lastShown = data;
+        }
+    }
+    
+    if (lastShown) {
+        const messagesArea = document.getElementById('messages-area');
+        messagesArea.appendChild(fragment);
+        messagesArea.scrollTop = messagesArea.scrollHeight;
+        markConversationRead(lastShown);
+    }
+}
+
+// Display a message in order and advance the sequence cursor.
+// With a fragment, the message element is added to it instead of the chat.
+function applyNewMessage(data, fragment) {
+    if (data.conversation && data.seq && data.seq <= (lastSeenSeq[data.conversation] || 0)) return;
+    trackMessageSeq(data);
+    
     // Only update if we're currently viewing this chat
     if (!currentChat || !currentChatType) return;
     
@@ -79,8 +262,26 @@ function handleNewMessage(data) {
     
     if (isCurrentChat) {
         // Add message to current chat
-        addMessageToChat(data);
+        if (fragment) {
+            // The batch caller appends the fragment and marks the conversation read once
+            fragment.appendChild(createMessageElement(data));
+        } else {
+            addMessageToChat(data);
+            markConversationRead(data);
+        }
     }
+    return isCurrentChat;
+}
+
+// Advance the server-side read cursor for a message shown in the open chat.
+// The server buffers cursors and writes them in batches, so this is cheap to call per message.
+function markConversationRead(message) {
+    if (!socket || !message.conversation || !message.seq) return;
+    
+    socket.emit('mark_read', {
+        conversation: message.conversation,
+        seq: message.seq
+    });
 }
 
 // Handle message notifications
@@ -92,10 +293,8 @@ function handleMessageNotification(data) {
     }
 }
 
-// Add message to current chat display
-function addMessageToChat(messageData) {
-    const messagesArea = document.getElementById('messages-area');
-    
+// Build the DOM element for one message
+function createMessageElement(messageData) {
     const messageElement = document.createElement('div');
     messageElement.className = `message ${messageData.sender_id === currentUser.id ? 'own' : ''}`;
     
@@ -114,7 +313,14 @@ function addMessageToChat(messageData) {
         </div>
     `;
     
-    messagesArea.appendChild(messageElement);
+    return messageElement;
+}
+
+// Add message to current chat display
+function addMessageToChat(messageData) {
+    const messagesArea = document.getElementById('messages-area');
+    
+    messagesArea.appendChild(createMessageElement(messageData));
     
     // Scroll to bottom
     messagesArea.scrollTop = messagesArea.scrollHeight;
@@ -122,6 +328,10 @@ function addMessageToChat(messageData) {
 
 // Disconnect WebSocket
 function disconnectSocket() {
+    if (heartbeatTimer) {
+        clearInterval(heartbeatTimer);
+        heartbeatTimer = null;
+    }
     if (socket) {
         socket.disconnect();
         socket = null;
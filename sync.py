@@ -0,0 +1,53 @@
+import re
+from src.models.user import Message
+import src.models.columns  # Message.conversation_key, Message.seq
+from src.cache import group_members
+from src.database import read_session
+
+MAX_SYNC_CONVERSATIONS = 100
+MAX_SYNC_MESSAGES = 200
+
+_KEY_PATTERN = re.compile(r'^(?:private_(\d+)_(\d+)|group_(\d+))$')
+
+def can_access_conversation(user_id, conversation_key):
+    match = _KEY_PATTERN.match(conversation_key)
+    if not match:
+        return False
+    if match.group(3) is not None:
+        return group_members.is_member(int(match.group(3)), user_id)
+    return user_id in (int(match.group(1)), int(match.group(2)))
+
+def message_payload(message):
+    """Dữ liệu tin nhắn gửi cho client, giống new_message và có thêm seq/conversation."""
+    data = message.to_dict()
+    data['seq'] = message.seq
+    data['conversation'] = message.conversation_key
+    data['type'] = 'group' if message.group_id is not None else 'friend'
+    return data
+
+def collect_missing_messages(user_id, cursors, limit=MAX_SYNC_MESSAGES):
+    """Trả về các tin nhắn có seq lớn hơn last_seen_seq cho từng cuộc trò chuyện.
+
+    cursors: dict {conversation_key: last_seen_seq}. Các khóa không hợp lệ hoặc
+    người dùng không có quyền truy cập bị bỏ qua. Mỗi cuộc trò chuyện trả tối
+    đa limit tin nhắn, has_more cho biết còn tin nhắn cần đồng bộ tiếp.
+    """
+    result = {}
+    for conversation_key, last_seq in list(cursors.items())[:MAX_SYNC_CONVERSATIONS]:
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            continue
+        if not can_access_conversation(user_id, conversation_key):
+            continue
+
+        rows = read_session.query(Message).filter(
+            Message.conversation_key == conversation_key,
+            Message.seq > last_seq
+        ).order_by(Message.seq.asc()).limit(limit + 1).all()
+
+        result[conversation_key] = {
+            'messages': [message_payload(message) for message in rows[:limit]],
+            'has_more': len(rows) > limit
+        }
+    return result
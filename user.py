@@ -1,5 +1,9 @@
 from flask import Blueprint, jsonify, request, session
 from src.models.user import User, Friendship, db
+from src.cache import profiles, friend_lists
+from src.presence import presence
+from src.database import read_session
+from src.models.user_search import search_user_ids
 from sqlalchemy import or_, and_
 
 user_bp = Blueprint('user', __name__)
@@ -13,14 +17,21 @@ def search_users():
     if not query:
         return jsonify({'success': False, 'error': 'Từ khóa tìm kiếm không được để trống'}), 400
     
-    # Tìm kiếm theo custom_id hoặc username
-    users = User.query.filter(
-        or_(User.custom_id.ilike(f'%{query}%'), User.username.ilike(f'%{query}%'))
-    ).filter(User.id != session['user_id']).limit(20).all()
+    page = request.args.get('page', 1, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    if page is None or page < 1 or limit is None or limit < 1:
+        return jsonify({'success': False, 'error': 'Tham số phân trang không hợp lệ'}), 400
+    limit = min(limit, 100)
+    
+    # Tìm kiếm theo custom_id hoặc username qua chỉ mục trigram (khớp tiền tố custom_id xếp trước)
+    user_ids, has_more = search_user_ids(read_session, query, session['user_id'], limit, (page - 1) * limit)
+    user_profiles = profiles.get_many(user_ids)
     
     return jsonify({
         'success': True,
-        'users': [user.to_dict() for user in users]
+        'users': [user_profiles[user_id] for user_id in user_ids if user_id in user_profiles],
+        'page': page,
+        'has_more': has_more
     }), 200
 
 @user_bp.route('/add_friend', methods=['POST'])
@@ -95,6 +106,8 @@ def accept_friend():
     try:
         friendship.status = 'accepted'
         db.session.commit()
+        friend_lists.invalidate(friendship.user_id1)
+        friend_lists.invalidate(friendship.user_id2)
         
         return jsonify({
             'success': True,
@@ -111,19 +124,22 @@ def get_friends():
         return jsonify({'success': False, 'error': 'Chưa đăng nhập'}), 401
     
     # Lấy danh sách bạn bè đã chấp nhận
-    friendships = db.session.query(Friendship).filter(
+    friendships = read_session.query(Friendship).filter(
         or_(
             and_(Friendship.user_id1 == session['user_id'], Friendship.status == 'accepted'),
             and_(Friendship.user_id2 == session['user_id'], Friendship.status == 'accepted')
         )
     ).all()
     
-    friends = []
-    for friendship in friendships:
-        friend_id = friendship.user_id2 if friendship.user_id1 == session['user_id'] else friendship.user_id1
-        friend = User.query.get(friend_id)
-        if friend:
-            friends.append(friend.to_dict())
+    friend_ids = [
+        friendship.user_id2 if friendship.user_id1 == session['user_id'] else friendship.user_id1
+        for friendship in friendships
+    ]
+    friend_profiles = profiles.get_many(friend_ids)
+    friends = [
+        dict(friend_profiles[friend_id], online=presence.is_online(friend_id))
+        for friend_id in friend_ids if friend_id in friend_profiles
+    ]
     
     return jsonify({
         'success': True,
@@ -141,12 +157,13 @@ def get_friend_requests():
         Friendship.status == 'pending'
     ).all()
     
+    requester_profiles = profiles.get_many([request.user_id1 for request in pending_requests])
     requests = []
     for request in pending_requests:
-        user = User.query.get(request.user_id1)
+        user = requester_profiles.get(request.user_id1)
         if user:
             requests.append({
-                'user': user.to_dict(),
+                'user': user,
                 'created_at': request.created_at.isoformat()
             })
     
@@ -0,0 +1,102 @@
+from src.models.user import db, User
+
+USER_FTS_TABLE = 'user_search'
+
+def _ddl():
+    user_table = User.__tablename__
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {USER_FTS_TABLE} USING fts5("
+        f"custom_id, username, content='{user_table}', content_rowid='id', tokenize='trigram')",
+        # Trigger cập nhật chỉ mục khi đăng ký hoặc đổi thông tin người dùng
+        f"""CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_ai AFTER INSERT ON {user_table} BEGIN
+            INSERT INTO {USER_FTS_TABLE}(rowid, custom_id, username) VALUES (new.id, new.custom_id, new.username);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_ad AFTER DELETE ON {user_table} BEGIN
+            INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}, rowid, custom_id, username)
+            VALUES ('delete', old.id, old.custom_id, old.username);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_au AFTER UPDATE OF custom_id, username ON {user_table} BEGIN
+            INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}, rowid, custom_id, username)
+            VALUES ('delete', old.id, old.custom_id, old.username);
+            INSERT INTO {USER_FTS_TABLE}(rowid, custom_id, username) VALUES (new.id, new.custom_id, new.username);
+        END""",
+        # Chỉ mục không phân biệt hoa thường cho tìm kiếm tiền tố của từ khóa ngắn
+        f"CREATE INDEX IF NOT EXISTS ix_user_custom_id_nocase ON {user_table} (custom_id COLLATE NOCASE)",
+        f"CREATE INDEX IF NOT EXISTS ix_user_username_nocase ON {user_table} (username COLLATE NOCASE)"
+    ]
+
+def ensure_user_search_index():
+    """Tạo bảng FTS5 trigram cho người dùng; dựng lại chỉ mục khi bảng vừa được tạo."""
+    exists = db.session.execute(
+        db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': USER_FTS_TABLE}
+    ).first()
+    for statement in _ddl():
+        db.session.execute(db.text(statement))
+    if not exists:
+        db.session.execute(db.text(f"INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_user_ids(session, text, exclude_user_id, limit, offset):
+    """Tìm id người dùng theo custom_id/username, trả về (ids, has_more).
+
+    Từ khóa từ 3 ký tự dùng chỉ mục trigram (khớp chuỗi con, không phân biệt
+    hoa thường). Trigram không tìm được chuỗi 1-2 ký tự, nên từ khóa ngắn hơn
+    chỉ khớp tiền tố (không phân biệt hoa thường với chữ ASCII) qua các chỉ mục
+    COLLATE NOCASE của custom_id và username, thay vì quét cả bảng để khớp
+    chuỗi con. Khớp tiền tố custom_id luôn được xếp trước.
+    """
+    if len(text) < 3:
+        return _prefix_user_ids(session, text, exclude_user_id, limit, offset)
+
+    user_table = User.__tablename__
+    params = {
+        'match': '"' + text.replace('"', '""') + '"',
+        'prefix': _escape_like(text) + '%',
+        'user_id': exclude_user_id,
+        'limit': limit + 1,
+        'offset': offset
+    }
+    statement = db.text(f"""
+        SELECT u.id FROM {USER_FTS_TABLE}
+        JOIN {user_table} u ON u.id = {USER_FTS_TABLE}.rowid
+        WHERE {USER_FTS_TABLE} MATCH :match AND u.id != :user_id
+        ORDER BY (u.custom_id LIKE :prefix ESCAPE '\\') DESC,
+                 (u.username LIKE :prefix ESCAPE '\\') DESC,
+                 {USER_FTS_TABLE}.rank
+        LIMIT :limit OFFSET :offset
+    """)
+    ids = [row.id for row in session.execute(statement, params)]
+    return ids[:limit], len(ids) > limit
+
+def _prefix_user_ids(session, text, exclude_user_id, limit, offset):
+    """Khớp tiền tố cho từ khóa ngắn bằng hai lượt quét theo thứ tự chỉ mục NOCASE.
+
+    Lượt đầu lấy các khớp custom_id theo thứ tự custom_id, lượt sau lấy các khớp
+    username (bỏ người đã khớp custom_id) theo thứ tự username; mỗi lượt dừng
+    sau offset + limit + 1 dòng nên không phải sắp xếp toàn bộ các kết quả khớp.
+    """
+    user_table = User.__tablename__
+    wanted = offset + limit + 1
+    params = {'start': text, 'end': text + '\uffff', 'user_id': exclude_user_id}
+    custom_id_match = 'u.custom_id >= :start COLLATE NOCASE AND u.custom_id < :end COLLATE NOCASE'
+
+    ids = [row.id for row in session.execute(db.text(f"""
+        SELECT u.id FROM {user_table} u
+        WHERE {custom_id_match} AND u.id != :user_id
+        ORDER BY u.custom_id COLLATE NOCASE
+        LIMIT :limit
+    """), dict(params, limit=wanted))]
+    if len(ids) < wanted:
+        ids += [row.id for row in session.execute(db.text(f"""
+            SELECT u.id FROM {user_table} u
+            WHERE u.username >= :start COLLATE NOCASE AND u.username < :end COLLATE NOCASE
+              AND u.id != :user_id AND (u.custom_id IS NULL OR NOT ({custom_id_match}))
+            ORDER BY u.username COLLATE NOCASE
+            LIMIT :limit
+        """), dict(params, limit=wanted - len(ids)))]
+    ids = ids[offset:]
+    return ids[:limit], len(ids) > limit
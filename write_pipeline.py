@@ -0,0 +1,184 @@
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from sqlalchemy.orm import Session
+from src.models.user import db, Message
+from src.models.conversation import record_private_message
+from src.database import read_session
+from src.recent_messages import recent_messages
+from src.models.read_state import read_cursors
+
+def save_message(fields):
+    """Ghi một tin nhắn (kèm các dòng tóm tắt cuộc trò chuyện) và commit ngay, không qua lô.
+
+    Dùng chung cho handler socket và các route REST khi không bật ghi theo lô.
+    """
+    message = Message(**fields)
+    db.session.add(message)
+    db.session.flush()
+    if message.receiver_id is not None:
+        record_private_message(message)
+    db.session.commit()
+    recent_messages.append(message)
+    # Gửi tin nhắn nghĩa là người gửi đã đọc cuộc trò chuyện tới tin đó
+    read_cursors.mark(message.sender_id, message.conversation_key, message.seq)
+    return message
+
+class MessageWriter:
+    """Ghi tin nhắn theo lô (group commit) trên một luồng riêng.
+
+    Tin nhắn được đưa vào hàng đợi có giới hạn; luồng ghi commit mỗi
+    batch_size tin nhắn hoặc sau delay_ms mili giây, rồi mới gọi callback
+    (ví dụ phát new_message) khi lô đã được ghi xuống đĩa.
+    """
+
+    def __init__(self, app, batch_size=64, delay_ms=10, max_queue=10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.delay = delay_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.batches = 0
+        self.messages = 0
+        self.rejected = 0
+        self.failed = 0
+        app.extensions['message_writer'] = self
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, fields, on_commit=None):
+        """Đưa tin nhắn (dict các cột của Message) vào hàng đợi.
+
+        Trả về Future có kết quả là message.to_dict() sau khi commit.
+        Ném queue.Full khi hàng đợi đầy để route có thể từ chối yêu cầu.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((fields, on_commit, future))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+        return future
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            engine = db.engine
+            while not (self._stopped.is_set() and self._queue.empty()):
+                batch = self._collect()
+                if batch:
+                    try:
+                        self._write_batch(engine, batch)
+                    finally:
+                        # Luồng này giữ app context lâu dài nên phải tự trả kết nối đọc
+                        read_session.remove()
+                        db.session.remove()
+
+    def _insert(self, session, batch):
+        messages = [Message(**fields) for fields, _, _ in batch]
+        session.add_all(messages)
+        session.flush()
+        for message in messages:
+            if message.receiver_id is not None:
+                record_private_message(message, session)
+        session.commit()
+        return messages
+
+    def _deliver(self, messages, batch):
+        for message, (_, on_commit, future) in zip(messages, batch):
+            recent_messages.append(message)
+            read_cursors.mark(message.sender_id, message.conversation_key, message.seq)
+            future.set_result(message.to_dict())
+            if on_commit is not None:
+                try:
+                    on_commit(message)
+                except Exception as e:
+                    print(f'Error broadcasting message {message.id}: {e}')
+
+    def _write_batch(self, engine, batch):
+        started = time.perf_counter()
+        with Session(engine, expire_on_commit=False) as session:
+            try:
+                messages = self._insert(session, batch)
+            except Exception as e:
+                session.rollback()
+                print(f'Error writing message batch, retrying one by one: {e}')
+                self._write_rows(session, batch)
+                return
+
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.batches += 1
+                self.messages += len(batch)
+                self._latencies.append(latency)
+            self._deliver(messages, batch)
+
+    def _write_rows(self, session, batch):
+        """Ghi lại từng tin nhắn của một lô bị lỗi, để chỉ tin nhắn hỏng nhận lỗi."""
+        for item in batch:
+            try:
+                messages = self._insert(session, [item])
+            except Exception as e:
+                session.rollback()
+                with self._lock:
+                    self.failed += 1
+                item[2].set_exception(e)
+                continue
+            with self._lock:
+                self.messages += 1
+            self._deliver(messages, [item])
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'batch_size': self.batch_size,
+                'delay_ms': self.delay * 1000.0,
+                'batches': self.batches,
+                'messages': self.messages,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'avg_batch_size': self.messages / self.batches if self.batches else 0.0
+            }
+        if latencies:
+            stats['commit_latency_ms'] = {
+                'avg': sum(latencies) / len(latencies) * 1000.0,
+                'p50': latencies[len(latencies) // 2] * 1000.0,
+                'p95': latencies[int(len(latencies) * 0.95)] * 1000.0,
+                'max': latencies[-1] * 1000.0
+            }
+        return stats